@@ -1,6 +1,7 @@
 import os
 import logging
-from flask import Flask, send_from_directory  # <--- dodaj send_from_directory
+from flask import Flask, request, send_from_directory  # <--- dodaj send_from_directory
+from compression import compress_response
 from extensions import db, login_manager
 import models  # Import models to register them with SQLAlchemy
 
@@ -23,6 +24,11 @@ app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 db.init_app(app)
 login_manager.init_app(app)
 
+# Compress responses for clients that accept it
+@app.after_request
+def compress(response):
+    return compress_response(response, request)
+
 # ✅ Route do obsługi ads.txt
 @app.route("/ads.txt")
 def ads():
@@ -49,6 +55,24 @@ with app.app_context():
     except Exception as e:
         db_connected = False
         logging.error(f"Error initializing database tables: {str(e)}")
+    
+    if db_connected:
+        try:
+            import migrations
+            migrations.ensure_schema()
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Error updating database schema: {str(e)}")
+    
+    if db_connected:
+        try:
+            import migrations
+            seeded = migrations.seed_geocode_cache()
+            if seeded:
+                logging.info(f"Geocode cache seeded with {seeded} saved addresses")
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Error seeding geocode cache: {str(e)}")
 
 # Import routes after application and extensions have been set up
 from main import *
@@ -0,0 +1,53 @@
+"""
+Response compression negotiated with Accept-Encoding.
+
+Brotli is used when the optional `brotli` package is installed and the client
+accepts it, gzip otherwise. Small, streamed and already encoded responses are
+left alone.
+"""
+import gzip
+
+import config
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/html', 'text/css', 'text/csv',
+                      'application/javascript', 'text/javascript', 'image/svg+xml')
+
+
+def _accepted(request, encoding):
+    return request.accept_encodings[encoding] > 0
+
+
+def compress_response(response, request):
+    """Compress a response in place if the client accepts it; returns the response"""
+    response.vary.add('Accept-Encoding')
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+
+    data = response.get_data()
+    if len(data) < config.COMPRESSION_MIN_SIZE:
+        return response
+
+    if brotli is not None and _accepted(request, 'br'):
+        body = brotli.compress(data, quality=config.BROTLI_QUALITY)
+        encoding = 'br'
+    elif _accepted(request, 'gzip'):
+        body = gzip.compress(data, compresslevel=config.GZIP_LEVEL)
+        encoding = 'gzip'
+    else:
+        return response
+
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    # The compressed body differs byte for byte, so the validator becomes weak
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
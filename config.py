@@ -5,16 +5,157 @@ OPENROUTE_API_KEY = os.environ.get("OPENROUTE_API_KEY", "")
 
 # API endpoints
 OPENROUTE_GEOCODE_URL = "https://api.openrouteservice.org/geocode/search"
-OPENROUTE_DIRECTIONS_URL = "https://api.openrouteservice.org/v2/directions/driving-car"
-OPENROUTE_MATRIX_URL = "https://api.openrouteservice.org/v2/matrix/driving-car"
+OPENROUTE_PROFILE = "driving-car"
+OPENROUTE_DIRECTIONS_URL = f"https://api.openrouteservice.org/v2/directions/{OPENROUTE_PROFILE}"
+OPENROUTE_MATRIX_URL = f"https://api.openrouteservice.org/v2/matrix/{OPENROUTE_PROFILE}"
+
+# Upstream HTTP client: pooled connections per host, and per endpoint timeouts
+# (seconds), retries and token-bucket rate limits matching the free ORS and
+# OpenWeatherMap quotas
+HTTP_POOL_SIZE = 16
+HTTP_BACKOFF_BASE = 0.5
+HTTP_BACKOFF_MAX = 8.0
+HTTP_RATE_LIMIT_MAX_WAIT = 10.0
+HTTP_DEFAULT_ENDPOINT = {
+    'connect_timeout': 3.05,
+    'read_timeout': 10,
+    'retries': 2,
+    'rate_per_minute': None,
+    'burst': None
+}
+HTTP_ENDPOINTS = {
+    'ors_geocode': {'read_timeout': 5, 'rate_per_minute': 100, 'burst': 20},
+    'ors_directions': {'read_timeout': 15, 'rate_per_minute': 40, 'burst': 10},
+    'ors_matrix': {'read_timeout': 30, 'rate_per_minute': 40, 'burst': 10},
+    'weather': {'read_timeout': 5, 'retries': 1, 'rate_per_minute': 60, 'burst': 10}
+}
+
+# Matrix requests: maximum sources x destinations per request (ORS limit) and number
+# of blocks fetched in parallel
+MATRIX_MAX_ELEMENTS = 3500
+MATRIX_MAX_WORKERS = 4
+
+# From this many points on, only pairs of nearby points (each point's nearest
+# neighbours by straight-line distance) are requested from the matrix API
+MATRIX_PREFILTER_MIN_LOCATIONS = 60
+MATRIX_PREFILTER_NEIGHBOURS = 12
+
+# Offline estimates: road distance = straight-line distance * detour factor,
+# travel speed by location category
+ESTIMATE_DETOUR_FACTOR = 1.3
+ESTIMATE_CATEGORY_SPEEDS_KMH = {
+    'home': 25,
+    'office': 30,
+    'business': 30,
+    'pickup_point': 35,
+    'current_location': 30,
+    'other': 30
+}
+
+# Geocoding cache: in-memory LRU size and lifetime of stored results
+GEOCODE_CACHE_SIZE = 2048
+GEOCODE_CACHE_TTL = 90 * 24 * 3600  # seconds
+
+# Number of addresses geocoded concurrently in one request
+GEOCODE_MAX_WORKERS = 8
+
+# Persistent cache of pairwise durations/distances: coordinates are rounded to
+# this many decimals (~1 m) for the cache key, entries expire after the TTL
+MATRIX_CACHE_ENABLED = True
+MATRIX_CACHE_PRECISION = 5
+MATRIX_CACHE_TTL = 7 * 24 * 3600  # seconds
+
+# Number of concurrent directions/weather requests when building route details
+ROUTE_DETAILS_CONCURRENCY = 8
+
+# Directions requests: 'multi' asks for the whole route in one call and splits it
+# into legs (up to DIRECTIONS_MAX_WAYPOINTS points, the ORS limit), 'per_leg'
+# makes one call per pair of consecutive points
+DIRECTIONS_MODE = "multi"
+DIRECTIONS_MAX_WAYPOINTS = 50
+DIRECTIONS_PREFERENCE = "recommended"
+
+# Directions cache (geometry, instructions and base duration per leg), keyed by
+# leg endpoints rounded to DIRECTIONS_CACHE_PRECISION decimal places; the traffic
+# overlay is recomputed on every request and is not cached
+DIRECTIONS_CACHE_SIZE = 4096
+DIRECTIONS_CACHE_TTL = 7 * 24 * 3600  # 7 days
+DIRECTIONS_CACHE_PRECISION = 5
+
+# Route geometry: encoded polylines with this many decimal places, simplified
+# for zoom levels below GEOMETRY_FULL_DETAIL_ZOOM to about GEOMETRY_PIXEL_TOLERANCE
+# screen pixels
+GEOMETRY_POLYLINE_PRECISION = 5
+GEOMETRY_FULL_DETAIL_ZOOM = 17
+GEOMETRY_PIXEL_TOLERANCE = 1.0
+GEOMETRY_CACHE_SIZE = 2048
 
 # Maximum number of locations the form can handle
 MAX_LOCATIONS = 15
 
+# Routes up to this many points (form locations plus the current location)
+# are solved exactly with Held-Karp; larger sets fall back to heuristics
+EXACT_SOLVER_MAX_LOCATIONS = 16
+
+# Time budget (seconds) for 2-opt / Or-opt improvement of heuristic routes
+LOCAL_SEARCH_TIME_BUDGET = 2.0
+
+# Time budget (seconds) for splitting stops between several couriers
+FLEET_TIME_BUDGET = 5.0
+
+# Keep writing route coordinates as JSON next to the packed column, so earlier
+# versions of the app can still read them. Set to False once rolling back is no
+# longer needed: the startup migration then clears the JSON copies
+KEEP_COORDINATES_JSON = True
+
+# Saved routes listed per page on the main page
+ROUTES_PAGE_SIZE = 20
+
+# Maximum number of routes saved by one /save_routes request
+SAVE_ROUTES_MAX_BATCH = 500
+
 # Weather API configuration
 WEATHER_API_KEY = os.environ.get("WEATHER_API_KEY", "")
 WEATHER_API_URL = "https://api.openweathermap.org/data/2.5/weather"
 
+# Traffic model: length of the time buckets traffic is evaluated for (minutes), and
+# smoothing weight of observed travel times when calibrating it
+TRAFFIC_BUCKET_MINUTES = 15
+TRAFFIC_CALIBRATION_WEIGHT = 0.2
+
+# Background traffic refresh of active routes (seconds), routes not requested for
+# ACTIVE_ROUTE_TTL are no longer refreshed
+TRAFFIC_REFRESH_INTERVAL = 60
+ACTIVE_ROUTE_TTL = 30 * 60
+TRAFFIC_MAX_ACTIVE_ROUTES = 500
+
+# Server-side store of users' current routes: in-memory LRU size and lifetime of
+# routes not saved again (seconds)
+ROUTE_STORE_CACHE_SIZE = 256
+ROUTE_STORE_TTL = 7 * 24 * 3600  # 7 days
+
+# Response compression: minimum body size (bytes) and compression levels
+COMPRESSION_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Server-Sent Events: keep-alive comment interval and stream lifetime (seconds);
+# browsers reconnect after SSE_RETRY_MS
+SSE_HEARTBEAT_SECONDS = 15
+SSE_MAX_STREAM_SECONDS = 300
+SSE_RETRY_MS = 5000
+# Every open stream holds one worker thread (the Procfile runs one gthread worker
+# with 16 threads): streams above this limit are refused with 503 and those
+# clients poll /get_route instead. Keep it well below the number of threads
+SSE_MAX_STREAMS = 8
+
+# Weather cache: one upstream call per geohash tile (precision 5 is about 5 x 5 km),
+# kept for the provider's update interval
+WEATHER_GEOHASH_PRECISION = 5
+WEATHER_CACHE_SIZE = 1024
+WEATHER_CACHE_TTL = 10 * 60  # 10 minutes
+WEATHER_FAILURE_TTL = 60  # 1 minute
+
 # Category icons mapping
 CATEGORY_ICONS = {
     'home': 'fa-home',
@@ -0,0 +1,97 @@
+"""
+Offline travel estimates from straight-line distances.
+
+Used as a fallback when the matrix API is unavailable, and as a cheap
+pre-filter that tells which pairs of points are worth asking the API about.
+"""
+import numpy as np
+
+import config
+
+# Earth radius in km
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_matrix(coordinates):
+    """
+    Straight-line distances in km between all [longitude, latitude] points
+
+    Returns:
+        N x N NumPy array
+    """
+    points = np.radians(np.asarray(coordinates, dtype=float).reshape(-1, 2))
+    lon, lat = points[:, 0], points[:, 1]
+    dlon = lon[None, :] - lon[:, None]
+    dlat = lat[None, :] - lat[:, None]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def estimate_matrix(coordinates, categories=None, detour_factor=None):
+    """
+    Estimate road distances and durations without any network call
+
+    Road distance is the straight-line distance times a detour factor; travel
+    speed is the average of both endpoints' category speeds
+    (config.ESTIMATE_CATEGORY_SPEEDS_KMH).
+
+    Args:
+        coordinates: List of longitude/latitude pairs
+        categories: Location category per point (default: unknown)
+        detour_factor: Road / straight-line distance ratio (default: config.ESTIMATE_DETOUR_FACTOR)
+
+    Returns:
+        Dictionary with 'durations' (seconds) and 'distances' (km) N x N arrays
+    """
+    if detour_factor is None:
+        detour_factor = config.ESTIMATE_DETOUR_FACTOR
+    distances = haversine_matrix(coordinates) * detour_factor
+
+    speeds = config.ESTIMATE_CATEGORY_SPEEDS_KMH
+    default_speed = speeds.get('other', 30)
+    point_speeds = np.array([speeds.get(category, default_speed) for category in categories]
+                            if categories else [default_speed] * len(distances), dtype=float)
+    pair_speeds = (point_speeds[:, None] + point_speeds[None, :]) / 2
+
+    return {
+        'durations': distances / pair_speeds * 3600,
+        'distances': distances
+    }
+
+
+def candidate_pairs(coordinates, neighbours=None):
+    """
+    Pairs of points that can plausibly follow each other in a good route: each
+    point with its nearest neighbours by straight-line distance (in both directions)
+
+    Returns:
+        N x N boolean NumPy array
+    """
+    if neighbours is None:
+        neighbours = config.MATRIX_PREFILTER_NEIGHBOURS
+    distances = haversine_matrix(coordinates)
+    n = len(distances)
+    count = min(neighbours + 1, n)  # +1 because every point is its own nearest point
+    nearest = np.argpartition(distances, count - 1, axis=1)[:, :count]
+    mask = np.zeros((n, n), dtype=bool)
+    mask[np.repeat(np.arange(n), count), nearest.ravel()] = True
+    return mask | mask.T
+
+
+def spatial_order(coordinates):
+    """
+    Indices of points sorted along a Z-order (Morton) curve, so that points close
+    on the list are also close on the map
+    """
+    points = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+    if len(points) == 0:
+        return np.array([], dtype=int)
+    span = np.ptp(points, axis=0)
+    span[span == 0] = 1.0
+    cells = ((points - points.min(axis=0)) / span * 0xFFFF).astype(np.uint64)
+
+    code = np.zeros(len(points), dtype=np.uint64)
+    for bit in range(16):
+        for axis in range(2):
+            code |= ((cells[:, axis] >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2 * bit + axis)
+    return np.argsort(code, kind='stable')
@@ -0,0 +1,242 @@
+"""
+Multi-courier planning: split a pool of stops between several couriers and
+order each courier's stops, using one shared duration matrix.
+
+The plan is built in three steps:
+1. Clustering - stops are grouped around well separated seed stops, respecting
+   courier capacities (maximum number of stops).
+2. Routing - every group is ordered with the single-route solvers from tsp_solver.
+3. Exchange - stops are relocated or swapped between routes while that shortens
+   the plan or reduces shift overruns, re-ordering the routes that changed.
+"""
+import time
+
+import numpy as np
+
+import config
+import tsp_solver
+
+# Weight of one second over a courier's shift relative to one second of driving
+SHIFT_OVERRUN_WEIGHT = 10.0
+
+
+def _overrun(duration, shift):
+    return np.maximum(0.0, duration - shift)
+
+
+def _seed_stops(distance, depot, stops, count):
+    """Pick `count` mutually distant stops, starting with the one farthest from the depot"""
+    seeds = [stops[int(np.argmax(distance[depot, stops]))]]
+    nearest_seed = distance[seeds[0], stops].copy()
+    while len(seeds) < count:
+        seeds.append(stops[int(np.argmax(nearest_seed))])
+        nearest_seed = np.minimum(nearest_seed, distance[seeds[-1], stops])
+    return seeds
+
+
+def _assign(distance, stops, centres, capacities):
+    """
+    Assign stops to the closest centre with free capacity; stops with the biggest
+    difference between their best and second best centre go first.
+    """
+    cost = distance[np.ix_(stops, centres)]
+    ranked = np.sort(cost, axis=1)
+    regret = ranked[:, 1] - ranked[:, 0] if len(centres) > 1 else ranked[:, 0]
+
+    free = np.array(capacities, dtype=float)
+    groups = [[] for _ in centres]
+    unassigned = []
+    for position in np.argsort(-regret):
+        choices = np.where(free > 0, cost[position], np.inf)
+        group = int(np.argmin(choices))
+        if not np.isfinite(choices[group]):
+            unassigned.append(stops[position])
+            continue
+        groups[group].append(stops[position])
+        free[group] -= 1
+    return groups, unassigned
+
+
+def _cluster(distance, depot, stops, capacities, rounds=3):
+    """Capacity-aware k-medoids clustering of stops"""
+    count = min(len(capacities), len(stops))
+    centres = _seed_stops(distance, depot, stops, count)
+    capacities = list(capacities[:count]) + [0] * (len(capacities) - count)
+    centres = centres + [depot] * (len(capacities) - count)
+
+    groups, unassigned = _assign(distance, stops, centres, capacities)
+    for _ in range(rounds):
+        new_centres = []
+        for group, centre in zip(groups, centres):
+            if group:
+                members = np.array(group)
+                new_centres.append(int(members[np.argmin(distance[np.ix_(members, members)].sum(axis=1))]))
+            else:
+                new_centres.append(centre)
+        if new_centres == centres:
+            break
+        centres = new_centres
+        groups, unassigned = _assign(distance, stops, centres, capacities)
+    return groups, unassigned
+
+
+def _order_stops(matrix, depot, end, stops, time_budget, exact=True):
+    """Order one courier's stops; returns the full route [depot, ..., end]"""
+    if not stops:
+        return [depot, end]
+    points = [depot] + list(stops)
+    sub = matrix[np.ix_(points, points)]
+    round_trip = end == depot
+    if exact and len(points) <= config.EXACT_SOLVER_MAX_LOCATIONS:
+        order, _ = tsp_solver.held_karp(sub, round_trip=round_trip)
+    else:
+        if exact:
+            order = tsp_solver.nearest_neighbour(sub, round_trip=round_trip)
+        else:
+            order = list(range(len(points))) + ([0] if round_trip else [])
+        order = tsp_solver.improve_route(sub, order, round_trip=round_trip, time_budget=time_budget)['route']
+    route = [points[i] for i in order]
+    return route if round_trip else route + [end]
+
+
+def _route_durations(matrix, routes, service):
+    return np.array([matrix[route[:-1], route[1:]].sum() + service[route[1:-1]].sum() for route in routes])
+
+
+def plan_fleet(matrix, couriers, depot=0, service_times=None, round_trip=True, time_budget=None):
+    """
+    Split stops between couriers and order each courier's route
+
+    Args:
+        matrix: N x N duration matrix (seconds) covering the depot and all stops
+        couriers: List of dictionaries with optional 'capacity' (maximum number of
+            stops) and 'shift_seconds' (maximum route duration including service);
+            None or missing means no limit
+        depot: Index of the point every courier starts from
+        service_times: Service duration per point in seconds
+        round_trip: Whether couriers return to the depot
+        time_budget: Maximum time in seconds (default: config.FLEET_TIME_BUDGET)
+
+    Returns:
+        Dictionary with one route per courier (in the order of `couriers`), the
+        stops that did not fit into any courier's capacity, and the plan totals
+    """
+    if time_budget is None:
+        time_budget = config.FLEET_TIME_BUDGET
+    deadline = time.monotonic() + time_budget
+
+    original = tsp_solver.to_matrix(matrix)
+    n = len(original)
+    search = tsp_solver.penalize_unreachable(original)
+
+    # Open routes end at a dummy point that is free to reach from anywhere
+    if round_trip:
+        end = depot
+    else:
+        end = n
+        padded = np.zeros((n + 1, n + 1))
+        padded[:n, :n] = search
+        search = padded
+
+    service = np.zeros(len(search))
+    if service_times is not None:
+        service[:n] = service_times
+    # Missing limits mean unlimited; 0 is a real limit
+    capacities = [n if c.get('capacity') is None else c['capacity'] for c in couriers]
+    shifts = np.array([np.inf if c.get('shift_seconds') is None else c['shift_seconds'] for c in couriers],
+                      dtype=float)
+
+    stops = [i for i in range(n) if i != depot]
+    symmetric = (search[:n, :n] + search[:n, :n].T) / 2
+    groups, unassigned = _cluster(symmetric, depot, stops, capacities) if stops else ([[] for _ in couriers], [])
+
+    route_budget = max(0.05, time_budget / (2 * max(1, len(couriers))))
+    routes = [_order_stops(search, depot, end, group, route_budget) for group in groups]
+
+    moves = 0
+    while time.monotonic() < deadline:
+        durations = _route_durations(search, routes, service)
+        counts = np.array([len(route) - 2 for route in routes])
+
+        # Every stop with its neighbours and every edge it could be inserted into
+        stop_route = np.concatenate([[r] * (len(route) - 2) for r, route in enumerate(routes)] + [[]]).astype(int)
+        if len(stop_route) == 0:
+            break
+        stop = np.concatenate([route[1:-1] for route in routes]).astype(int)
+        before = np.concatenate([route[:-2] for route in routes]).astype(int)
+        after = np.concatenate([route[2:] for route in routes]).astype(int)
+        stop_position = np.concatenate([np.arange(1, len(route) - 1) for route in routes]).astype(int)
+        edge_route = np.concatenate([[r] * (len(route) - 1) for r, route in enumerate(routes)]).astype(int)
+        edge_from = np.concatenate([route[:-1] for route in routes]).astype(int)
+        edge_to = np.concatenate([route[1:] for route in routes]).astype(int)
+        edge_position = np.concatenate([np.arange(len(route) - 1) for route in routes]).astype(int)
+
+        removal = search[before, stop] + search[stop, after] - search[before, after] + service[stop]
+        source_old = durations[stop_route]
+        source_new = source_old - removal
+        source_change = source_new - source_old + SHIFT_OVERRUN_WEIGHT * (
+            _overrun(source_new, shifts[stop_route]) - _overrun(source_old, shifts[stop_route]))
+
+        # Relocate: move a stop into an edge of another route
+        insertion = (search[edge_from[None, :], stop[:, None]] + search[stop[:, None], edge_to[None, :]]
+                     - search[edge_from, edge_to][None, :] + service[stop][:, None])
+        target_old = durations[edge_route][None, :]
+        target_new = target_old + insertion
+        relocate = source_change[:, None] + target_new - target_old + SHIFT_OVERRUN_WEIGHT * (
+            _overrun(target_new, shifts[edge_route][None, :]) - _overrun(target_old, shifts[edge_route][None, :]))
+        relocate[stop_route[:, None] == edge_route[None, :]] = np.inf
+        relocate[:, counts[edge_route] >= np.array(capacities)[edge_route]] = np.inf
+
+        # Swap: exchange two stops of different routes
+        replace = (search[before[:, None], stop[None, :]] + search[stop[None, :], after[:, None]]
+                   - search[before, stop][:, None] - search[stop, after][:, None]
+                   + service[stop][None, :] - service[stop][:, None])
+        first_new = source_old[:, None] + replace
+        second_new = source_old[None, :] + replace.T
+        swap = (replace + replace.T + SHIFT_OVERRUN_WEIGHT * (
+            _overrun(first_new, shifts[stop_route][:, None]) - _overrun(source_old, shifts[stop_route])[:, None]
+            + _overrun(second_new, shifts[stop_route][None, :]) - _overrun(source_old, shifts[stop_route])[None, :]))
+        swap[stop_route[:, None] == stop_route[None, :]] = np.inf
+
+        best_relocate = int(np.argmin(relocate))
+        best_swap = int(np.argmin(swap))
+        relocate_delta = relocate.flat[best_relocate]
+        swap_delta = swap.flat[best_swap]
+        if min(relocate_delta, swap_delta) >= -1e-6:
+            break
+
+        if relocate_delta <= swap_delta:
+            s, e = np.unravel_index(best_relocate, relocate.shape)
+            source, target = stop_route[s], edge_route[e]
+            routes[target].insert(edge_position[e] + 1, int(stop[s]))
+            del routes[source][stop_position[s]]
+            changed = (source, target)
+        else:
+            a, b = np.unravel_index(best_swap, swap.shape)
+            routes[stop_route[a]][stop_position[a]] = int(stop[b])
+            routes[stop_route[b]][stop_position[b]] = int(stop[a])
+            changed = (stop_route[a], stop_route[b])
+
+        for r in changed:
+            routes[r] = _order_stops(search, depot, end, routes[r][1:-1], route_budget, exact=False)
+        moves += 1
+
+    plan_routes = []
+    durations = _route_durations(search, routes, service)
+    for courier, route, duration, shift in zip(couriers, routes, durations, shifts):
+        route = route if round_trip else route[:-1]
+        plan_routes.append({
+            'courier': courier,
+            'route': [int(i) for i in route],
+            'stops': [int(i) for i in route[1:-1]] if round_trip else [int(i) for i in route[1:]],
+            'duration': float(duration),
+            'travel_duration': tsp_solver.route_cost(original, route),
+            'over_shift': bool(duration > shift)
+        })
+
+    return {
+        'routes': plan_routes,
+        'unassigned': [int(i) for i in unassigned],
+        'total_duration': float(durations.sum()),
+        'exchange_moves': moves
+    }
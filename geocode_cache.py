@@ -0,0 +1,141 @@
+"""
+Geocoding cache: an in-memory LRU in front of the GeocodeCacheEntry table.
+
+Addresses are keyed by a normalized "street number city" string, so that
+"ul. Marszałkowska 10, Warszawa" and "marszalkowska 10 warszawa" share one entry.
+The table is seeded from the coordinates already stored on saved Locations
+(see migrations.seed_geocode_cache).
+"""
+import logging
+import re
+import threading
+import unicodedata
+from datetime import datetime, timedelta
+
+from flask import has_app_context
+from sqlalchemy import select
+
+import config
+from caching import TTLCache
+from extensions import db
+from models import GeocodeCacheEntry
+
+_memory = TTLCache(maxsize=config.GEOCODE_CACHE_SIZE)
+_lock = threading.Lock()
+_stats = {'memory_hits': 0, 'database_hits': 0, 'misses': 0}
+
+# Street type prefixes that do not change the address
+_STREET_PREFIXES = re.compile(r'\b(ul|ulica|al|aleja|aleje|pl|plac|os|osiedle)\b\.?\s*')
+
+
+def normalize_address(address):
+    """Normalized cache key of an address: lowercase, no diacritics, punctuation or street prefixes"""
+    text = (address or '').lower().replace('ł', 'l')
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    text = _STREET_PREFIXES.sub('', text)
+    text = re.sub(r'[^\w/]+', ' ', text)
+    return ' '.join(text.split())
+
+
+def _count(name, amount=1):
+    with _lock:
+        _stats[name] += amount
+
+
+def _fresh_after():
+    return datetime.utcnow() - timedelta(seconds=config.GEOCODE_CACHE_TTL)
+
+
+def lookup_many(addresses):
+    """
+    Cached geocoding results for several addresses with one database query
+
+    Returns:
+        Dictionary address -> {'coordinates', 'formatted_address'} for cached addresses only
+    """
+    found = {}
+    pending = {}
+    for address in addresses:
+        key = normalize_address(address)
+        result = _memory.get(key)
+        if result is not None:
+            found[address] = result
+            _count('memory_hits')
+        else:
+            pending.setdefault(key, []).append(address)
+
+    if pending and has_app_context():
+        try:
+            rows = db.session.execute(
+                select(GeocodeCacheEntry.key, GeocodeCacheEntry.longitude,
+                       GeocodeCacheEntry.latitude, GeocodeCacheEntry.formatted_address)
+                .where(GeocodeCacheEntry.key.in_(list(pending)),
+                       GeocodeCacheEntry.created_at >= _fresh_after())
+            ).all()
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Error reading geocode cache: {str(e)}")
+            rows = []
+        for key, longitude, latitude, formatted_address in rows:
+            result = {'coordinates': [longitude, latitude], 'formatted_address': formatted_address}
+            _memory.set(key, result)
+            for address in pending.pop(key):
+                found[address] = result
+                _count('database_hits')
+
+    _count('misses', sum(len(group) for group in pending.values()))
+    return found
+
+
+def lookup(address):
+    """Cached geocoding result for one address, or None"""
+    return lookup_many([address]).get(address)
+
+
+def store_many(results):
+    """
+    Remember geocoding results
+
+    Args:
+        results: Dictionary address -> {'coordinates', 'formatted_address'}
+    """
+    entries = {}
+    for address, result in results.items():
+        if not result:
+            continue
+        key = normalize_address(address)
+        _memory.set(key, result)
+        entries[key] = (address, result)
+
+    if not entries or not has_app_context():
+        return
+    try:
+        # Replace older entries with the same keys
+        GeocodeCacheEntry.query.filter(GeocodeCacheEntry.key.in_(list(entries))).delete(synchronize_session=False)
+        for key, (address, result) in entries.items():
+            db.session.add(GeocodeCacheEntry(
+                key=key,
+                address=address,
+                longitude=result['coordinates'][0],
+                latitude=result['coordinates'][1],
+                formatted_address=result['formatted_address']
+            ))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error storing geocode cache: {str(e)}")
+
+
+def store(address, result):
+    store_many({address: result})
+
+
+def stats():
+    """Hit/miss counters of the geocoding cache"""
+    with _lock:
+        counters = dict(_stats)
+    lookups = sum(counters.values())
+    counters['hit_rate'] = round((counters['memory_hits'] + counters['database_hits']) / lookups, 3) if lookups else None
+    counters['memory'] = _memory.stats()
+    return counters
@@ -0,0 +1,158 @@
+"""
+Compact route geometry: encoded polylines and zoom-dependent simplification.
+
+Route lines are stored once per segment as an encoded polyline (the Google
+format: latitude/longitude pairs, delta- and varint-encoded as ASCII). Lower
+zoom levels are served simplified with Douglas-Peucker; the significance of
+every vertex is computed once per line, so each tolerance is only a mask.
+"""
+import numpy as np
+
+import config
+from caching import TTLCache
+
+# Decoded line and vertex significance per encoded polyline
+_significance_cache = TTLCache(maxsize=config.GEOMETRY_CACHE_SIZE)
+# Simplified encoded polyline per (encoded polyline, zoom)
+_level_cache = TTLCache(maxsize=config.GEOMETRY_CACHE_SIZE)
+
+
+def encode_polyline(points, precision=None):
+    """
+    Encode [longitude, latitude] points as a polyline string
+
+    Args:
+        points: List of longitude/latitude pairs
+        precision: Number of decimal places kept (default: config.GEOMETRY_POLYLINE_PRECISION)
+    """
+    if precision is None:
+        precision = config.GEOMETRY_POLYLINE_PRECISION
+    if len(points) == 0:
+        return ''
+    values = np.round(np.asarray(points, dtype=float).reshape(-1, 2)[:, ::-1] * 10 ** precision).astype(np.int64)
+    deltas = np.diff(values, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    # Zig-zag: sign moved to the lowest bit
+    deltas = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+
+    chunks = []
+    for value in deltas.tolist():
+        while value >= 0x20:
+            chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chunks.append(chr(value + 63))
+    return ''.join(chunks)
+
+
+def decode_polyline(encoded, precision=None):
+    """
+    Decode a polyline string
+
+    Returns:
+        List of [longitude, latitude] pairs
+    """
+    if precision is None:
+        precision = config.GEOMETRY_POLYLINE_PRECISION
+    values = []
+    value = shift = 0
+    for char in encoded:
+        byte = ord(char) - 63
+        value |= (byte & 0x1f) << shift
+        shift += 5
+        if byte < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+
+    coords = np.cumsum(np.array(values, dtype=np.int64).reshape(-1, 2), axis=0) / 10 ** precision
+    return coords[:, ::-1].tolist()
+
+
+def vertex_significance(points):
+    """
+    Douglas-Peucker significance of every vertex: the line simplified with tolerance
+    t keeps exactly the vertices whose significance is greater than t
+
+    Distances are in degrees of latitude, with longitudes scaled by cos(latitude).
+
+    Returns:
+        NumPy array with one value per point (infinity for both endpoints)
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    n = len(points)
+    significance = np.zeros(n)
+    if n == 0:
+        return significance
+    significance[[0, -1]] = np.inf
+    xy = points * np.array([np.cos(np.radians(points[:, 1].mean())), 1.0])
+
+    stack = [(0, n - 1, np.inf)]
+    while stack:
+        first, last, parent = stack.pop()
+        if last - first < 2:
+            continue
+        inner = xy[first + 1:last]
+        start, end = xy[first], xy[last]
+        direction = end - start
+        length = np.hypot(*direction)
+        if length > 0:
+            offsets = inner - start
+            distances = np.abs(direction[0] * offsets[:, 1] - direction[1] * offsets[:, 0]) / length
+        else:
+            distances = np.hypot(*(inner - start).T)
+        split = int(np.argmax(distances))
+        # A vertex is only reached if its parent split survived the same tolerance
+        value = min(distances[split], parent)
+        index = first + 1 + split
+        significance[index] = value
+        stack.append((first, index, value))
+        stack.append((index, last, value))
+    return significance
+
+
+def zoom_tolerance(zoom):
+    """Simplification tolerance in degrees for a web map zoom level"""
+    return config.GEOMETRY_PIXEL_TOLERANCE * 360.0 / (256 * 2 ** zoom)
+
+
+def simplify(points, tolerance):
+    """Douglas-Peucker simplification of [longitude, latitude] points"""
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    return points[vertex_significance(points) > tolerance].tolist()
+
+
+def simplified_polyline(encoded, zoom=None):
+    """
+    Encoded polyline simplified for a zoom level
+
+    Args:
+        encoded: Full-resolution encoded polyline
+        zoom: Web map zoom level (None or >= config.GEOMETRY_FULL_DETAIL_ZOOM = no simplification)
+    """
+    if zoom is None or zoom >= config.GEOMETRY_FULL_DETAIL_ZOOM or not encoded:
+        return encoded
+    zoom = max(0, int(zoom))
+    simplified = _level_cache.get((encoded, zoom))
+    if simplified is None:
+        entry = _significance_cache.get(encoded)
+        if entry is None:
+            points = np.array(decode_polyline(encoded)).reshape(-1, 2)
+            entry = (points, vertex_significance(points))
+            _significance_cache.set(encoded, entry)
+        points, significance = entry
+        simplified = encode_polyline(points[significance > zoom_tolerance(zoom)])
+        _level_cache.set((encoded, zoom), simplified)
+    return simplified
+
+
+def serve_geometry(geometry, zoom=None, encoded=True):
+    """
+    Segment geometry for a response
+
+    Args:
+        geometry: Encoded polyline (or a list of [longitude, latitude] points)
+        zoom: Web map zoom level to simplify for (default: full resolution)
+        encoded: Return an encoded polyline (True) or a list of [longitude, latitude] points
+    """
+    if not isinstance(geometry, str):
+        geometry = encode_polyline(geometry or [])
+    geometry = simplified_polyline(geometry, zoom)
+    return geometry if encoded else decode_polyline(geometry)
@@ -0,0 +1,147 @@
+"""
+Shared HTTP client for the upstream APIs (OpenRouteService, OpenWeatherMap).
+
+Every request goes through a named endpoint from config.HTTP_ENDPOINTS, which
+sets its timeouts, retries and rate limit. Connections are pooled and kept
+alive in one requests.Session per host. Failed requests (connection errors,
+timeouts, 429 and 5xx responses) are retried with exponential backoff and full
+jitter. A token bucket per endpoint keeps calls within the provider quotas.
+"""
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+
+# Response codes worth retrying
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_sessions = {}
+_buckets = {}
+_lock = threading.Lock()
+
+
+class RateLimited(requests.exceptions.RequestException):
+    """No request token became available within config.HTTP_RATE_LIMIT_MAX_WAIT"""
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket
+
+    Args:
+        rate: Tokens added per second
+        capacity: Maximum number of tokens (the allowed burst)
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, max_wait=None):
+        """Take one token, waiting for it at most max_wait seconds; returns False on timeout"""
+        deadline = None if max_wait is None else time.monotonic() + max_wait
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+def _endpoint(name):
+    settings = dict(config.HTTP_DEFAULT_ENDPOINT)
+    settings.update(config.HTTP_ENDPOINTS.get(name, {}))
+    return settings
+
+
+def _session(url):
+    """Keep-alive session for the URL's host"""
+    host = urlsplit(url).netloc
+    with _lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.HTTP_POOL_SIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[host] = session
+    return session
+
+
+def _bucket(name, settings):
+    with _lock:
+        bucket = _buckets.get(name)
+        if bucket is None and settings.get('rate_per_minute'):
+            bucket = TokenBucket(settings['rate_per_minute'] / 60.0, settings.get('burst') or 1)
+            _buckets[name] = bucket
+    return bucket
+
+
+def _backoff(attempt, response=None):
+    """Seconds to wait before the next attempt: Retry-After if given, else exponential with full jitter"""
+    if response is not None and response.headers.get('Retry-After', '').isdigit():
+        return min(float(response.headers['Retry-After']), config.HTTP_BACKOFF_MAX)
+    return random.uniform(0, min(config.HTTP_BACKOFF_MAX, config.HTTP_BACKOFF_BASE * 2 ** attempt))
+
+
+def request(endpoint, method, url, **kwargs):
+    """
+    Send a request to an upstream API
+
+    Args:
+        endpoint: Name of the endpoint settings in config.HTTP_ENDPOINTS
+        method: HTTP method
+        url: Request URL
+        **kwargs: Passed to requests (params, json, headers, ...)
+
+    Returns:
+        The last requests.Response (callers still check its status)
+
+    Raises:
+        requests.exceptions.RequestException if the request failed on every attempt
+    """
+    settings = _endpoint(endpoint)
+    kwargs.setdefault('timeout', (settings['connect_timeout'], settings['read_timeout']))
+    bucket = _bucket(endpoint, settings)
+    session = _session(url)
+
+    retries = settings['retries']
+    for attempt in range(retries + 1):
+        if bucket is not None and not bucket.acquire(config.HTTP_RATE_LIMIT_MAX_WAIT):
+            raise RateLimited(f"Rate limit of {endpoint} exceeded")
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if attempt == retries:
+                raise
+            delay = _backoff(attempt)
+            logging.warning(f"{endpoint} request failed (attempt {attempt + 1}), retrying in {delay:.1f}s: {str(e)}")
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+            delay = _backoff(attempt, response)
+            logging.warning(f"{endpoint} returned {response.status_code} (attempt {attempt + 1}), retrying in {delay:.1f}s")
+        time.sleep(delay)
+
+
+def get(endpoint, url, **kwargs):
+    return request(endpoint, 'GET', url, **kwargs)
+
+
+def post(endpoint, url, **kwargs):
+    return request(endpoint, 'POST', url, **kwargs)
@@ -2,11 +2,13 @@ import os
 import csv
 import io
 import json
+import hashlib
 import time
 import logging
+import threading
 from datetime import datetime
 
-from flask import render_template, request, jsonify, flash, redirect, url_for, session, make_response
+from flask import render_template, request, jsonify, flash, redirect, url_for, session, make_response, Response, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
 
 from app import app
@@ -14,7 +16,15 @@ from extensions import db
 from forms import LoginForm, RegistrationForm
 from models import Courier, Route, Location, CourierRouteAssignment
 import config
-from route_optimizer import optimize_route, geocode_address, get_route_details, check_for_traffic_updates
+import geocode_cache
+import route_store
+import traffic_refresher
+import weather_cache
+from geometry import serve_geometry
+from route_persistence import RouteValidationError, prepare_route, save_routes
+from route_queries import assignment_status_counts, count_routes, courier_assignments, parse_date, route_summaries
+from route_optimizer import optimize_route, optimize_route_with_time_windows, optimize_fleet, geocode_addresses, get_route_details, directions_cache_stats, route_details_from_snapshot, snapshot_route_details
+from route_versions import route_delta, stamp_route_version, update_route_totals
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -24,17 +34,37 @@ db_connected = True
 
 @app.route('/')
 def index():
-    """Display the main page with the navigation form"""
+    """Display the main page with the navigation form and a page of saved routes"""
     saved_routes = []
+    route_filters = {
+        'courier': request.args.get('courier', type=int),
+        'date_from': request.args.get('date_from', ''),
+        'date_to': request.args.get('date_to', '')
+    }
+    route_page = {'cursor': request.args.get('cursor'), 'next_cursor': None, 'total': 0,
+                  'filters': {name: value for name, value in route_filters.items() if value}}
     
     if db_connected:
         try:
-            # Get saved routes from the database
-            saved_routes = Route.query.order_by(Route.created_at.desc()).all()
+            # Get one page of saved route summaries from the database
+            filters = {
+                'courier_id': route_filters['courier'],
+                'date_from': parse_date(route_filters['date_from']),
+                'date_to': parse_date(route_filters['date_to'])
+            }
+            try:
+                saved_routes, route_page['next_cursor'] = route_summaries(route_page['cursor'], **filters)
+            except ValueError:
+                # Malformed cursor: start from the newest routes
+                route_page['cursor'] = None
+                saved_routes, route_page['next_cursor'] = route_summaries(**filters)
+            route_page['total'] = count_routes(**filters)
         except Exception as e:
+            db.session.rollback()
             logging.error(f"Error loading saved routes: {str(e)}")
     
-    return render_template('index.html', api_key=config.OPENROUTE_API_KEY, saved_routes=saved_routes)
+    return render_template('index.html', api_key=config.OPENROUTE_API_KEY, saved_routes=saved_routes,
+                           route_page=route_page)
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -92,9 +122,11 @@ def logout():
 @login_required
 def profile():
     """Display user profile and routes"""
-    # Fetch user's assigned routes
-    assigned_routes = CourierRouteAssignment.query.filter_by(courier_id=current_user.id).all()
-    return render_template('profile.html', courier=current_user, assignments=assigned_routes)
+    # Fetch user's assigned routes with their routes, and the number per status
+    assigned_routes = courier_assignments(current_user.id)
+    status_counts = assignment_status_counts(current_user.id)
+    return render_template('profile.html', courier=current_user, assignments=assigned_routes,
+                           status_counts=status_counts)
 
 @app.route('/optimize', methods=['POST'])
 def optimize():
@@ -106,6 +138,7 @@ def optimize():
         locations = []
         location_details = []
         use_current_location = request.form.get('use_current_location') == 'on'
+        round_trip = request.form.get('round_trip') == 'on'
         current_location_coords = None
         
         if use_current_location:
@@ -171,37 +204,59 @@ def optimize():
             flash("Proszę wprowadzić co najmniej dwie lokalizacje do optymalizacji trasy.", "danger")
             return redirect(url_for('index'))
 
-        # Geocode addresses to coordinates
+        # Geocode all addresses to coordinates at once
+        has_current_location = use_current_location and current_location_coords is not None
+        first_address = 1 if has_current_location else 0
+        geocode_results, failed_addresses = geocode_addresses(locations[first_address:])
+        
+        if failed_addresses:
+            flash(f"Nie udało się odnaleźć adresów: {'; '.join(failed_addresses)}", "danger")
+            return redirect(url_for('index'))
+        
         coords = []
         formatted_addresses = []
-        for idx, address in enumerate(locations):
+        if has_current_location:
             # Jeśli to aktualna lokalizacja, użyj przekazanych współrzędnych
-            if idx == 0 and use_current_location and current_location_coords:
-                coords.append(current_location_coords)
-                formatted_addresses.append("Aktualna lokalizacja")
-                # Dodaj współrzędne do location_details
-                location_details[idx]['longitude'] = current_location_coords[0]
-                location_details[idx]['latitude'] = current_location_coords[1]
-                location_details[idx]['formatted_address'] = "Aktualna lokalizacja"
-            else:
-                geocode_result = geocode_address(address)
-                if geocode_result and 'coordinates' in geocode_result:
-                    coords.append(geocode_result['coordinates'])
-                    formatted_addresses.append(geocode_result['formatted_address'])
-                    # Add coordinates to location details
-                    location_details[idx]['longitude'] = geocode_result['coordinates'][0]
-                    location_details[idx]['latitude'] = geocode_result['coordinates'][1]
-                    location_details[idx]['formatted_address'] = geocode_result['formatted_address']
-                else:
-                    flash(f"Nie udało się odnaleźć adresu: {address}", "danger")
-                    return redirect(url_for('index'))
+            geocode_results.insert(0, {
+                'coordinates': current_location_coords,
+                'formatted_address': "Aktualna lokalizacja"
+            })
+        for idx, geocode_result in enumerate(geocode_results):
+            coords.append(geocode_result['coordinates'])
+            formatted_addresses.append(geocode_result['formatted_address'])
+            # Add coordinates to location details
+            location_details[idx]['longitude'] = geocode_result['coordinates'][0]
+            location_details[idx]['latitude'] = geocode_result['coordinates'][1]
+            location_details[idx]['formatted_address'] = geocode_result['formatted_address']
 
-        # Optimize route
-        optimized_route, total_time, total_distance = optimize_route(coords)
+        # Optimize route, respecting delivery time windows if any were given
+        has_time_windows = any(
+            detail.get('time_window_start') or detail.get('time_window_end')
+            for detail in location_details[1:]
+        )
+        schedule = None
+        if has_time_windows:
+            optimized_route, total_time, total_distance, schedule = optimize_route_with_time_windows(
+                coords, location_details, round_trip=round_trip
+            )
+        else:
+            optimized_route, total_time, total_distance = optimize_route(coords, round_trip=round_trip)
         
         if not optimized_route:
             flash("Could not optimize route. Please try different locations.", "danger")
             return redirect(url_for('index'))
+        
+        if schedule:
+            # Keep addresses and details in visiting order and attach ETAs
+            location_details = [dict(location_details[i]) for i in schedule['order']]
+            formatted_addresses = [formatted_addresses[i] for i in schedule['order']]
+            for detail, stop in zip(location_details, schedule['stops']):
+                detail['estimated_arrival'] = stop['service_start']
+                detail['late_minutes'] = stop['late_minutes']
+            if schedule.get('unreachable'):
+                flash(f"Brak czasu przejazdu do {len(schedule['unreachable'])} przystanków - ich godziny przyjazdu są nieznane.", "warning")
+            if schedule['violations']:
+                flash(f"Nie wszystkie okna czasowe mogą zostać dotrzymane ({len(schedule['violations'])} przystanków z opóźnieniem).", "warning")
 
         # Get route details with real-time traffic information
         include_traffic = request.form.get('include_traffic', 'true').lower() == 'true'
@@ -210,11 +265,10 @@ def optimize():
         # Sprawdź, czy mamy geometrię tras
         for i, segment in enumerate(route_details.get('segments', [])):
             if 'geometry' in segment:
-                num_points = len(segment['geometry'])
-                logging.debug(f"Segment {i} ma {num_points} punktów geometrycznych")
+                logging.debug(f"Segment {i} ma {len(segment['geometry'])} znaków zakodowanej geometrii")
         
-        # Store in session for display
-        session['optimized_route'] = {
+        # Keep in the route store for display; the session only holds its handle
+        route_data = {
             'coordinates': optimized_route,
             'addresses': [formatted_addresses[i] for i in range(len(formatted_addresses))],
             'total_time': route_details['total_duration'],
@@ -226,9 +280,11 @@ def optimize():
             'has_traffic_data': route_details.get('has_traffic_data', False),
             'traffic_conditions': route_details.get('traffic_conditions', []),
             'last_traffic_update': int(time.time()),
-            # Dodatkowo wyciągamy segmenty trasy na górny poziom dla łatwiejszego dostępu w JavaScript
-            'segments': route_details.get('segments', [])
+            'schedule': schedule
         }
+        stamp_route_version(route_data)
+        track_route(route_data)
+        store_session_route(route_data)
         
         flash("Route optimized successfully!", "success")
         return redirect(url_for('index'))
@@ -238,48 +294,183 @@ def optimize():
         flash(f"An error occurred: {str(e)}", "danger")
         return redirect(url_for('index'))
 
+def serialize_route_data(route_data, zoom=None, encoded=True):
+    """Copy of session route data with segment geometry prepared for the client"""
+    route_details = route_data.get('route_details')
+    if not route_details or not route_details.get('segments'):
+        return route_data
+    
+    segments = [
+        dict(segment, geometry=serve_geometry(segment.get('geometry'), zoom=zoom, encoded=encoded))
+        for segment in route_details['segments']
+    ]
+    data = dict(route_data)
+    data.pop('segments', None)  # duplicate kept by older sessions
+    data['route_details'] = dict(route_details, segments=segments, geometry_format='polyline' if encoded else 'lonlat')
+    return data
+
+def track_route(route_data):
+    """Register session route data with the background traffic refresher"""
+    route_data['route_key'] = traffic_refresher.register(route_data['coordinates'], route_data['route_details'])
+    route_data['route_version'] = 0
+
+def load_session_route():
+    """
+    Current route of the session from the route store
+    
+    Returns:
+        Tuple (route data or an empty dictionary, version)
+    """
+    route_data, version = route_store.load(session.get('route_handle'))
+    if route_data is None and session.get('optimized_route'):
+        # Route kept in the session cookie by an older version of the app: move it to the store
+        route_data = session.pop('optimized_route')
+        version = store_session_route(route_data)
+    return route_data or {}, version
+
+def store_session_route(route_data):
+    """Save the session's current route in the route store; returns its new version"""
+    handle = session.get('route_handle')
+    if not handle:
+        handle = session['route_handle'] = route_store.new_handle()
+    return route_store.save(handle, route_data)
+
+def sync_session_route(route_data):
+    """
+    Copy the latest background traffic refresh of a route into its session data
+    
+    Returns:
+        True if route_data changed and should be stored
+    """
+    route_key = route_data.get('route_key')
+    live = traffic_refresher.get(route_key) if route_key else None
+    had_traffic_update = route_data.get('has_traffic_update', False)
+    changed = False
+    
+    if live is None:
+        # Not tracked by this process (yet): the refresher takes it from here
+        route_data['has_traffic_update'] = False
+        route_data['traffic_update_reason'] = ''
+        if route_data.get('route_details'):
+            track_route(route_data)
+            changed = True
+        else:
+            changed = had_traffic_update
+    elif live['version'] != route_data.get('route_version'):
+        # Refreshed since this session last saw it
+        update_route_totals(route_data, live['route_details'])
+        last_event = live['last_event'] or {}
+        route_data['has_traffic_update'] = last_event.get('needs_update', False)
+        route_data['traffic_update_reason'] = last_event.get('reason', '')
+        route_data['route_version'] = live['version']
+        changed = True
+    else:
+        route_data['has_traffic_update'] = False
+        changed = had_traffic_update
+    
+    if route_data.get('has_traffic_update'):
+        logging.debug(f"Traffic update needed: {route_data['traffic_update_reason']}")
+    if changed:
+        route_data['last_traffic_update'] = int(time.time())
+    return changed
+
 @app.route('/get_route')
 def get_route():
-    """Return the optimized route data for AJAX requests"""
-    import time
+    """
+    Return the optimized route data for AJAX requests
+    Answers conditional requests (If-None-Match) with 304 while the route is unchanged;
+    with since_version only the segments changed since that version are returned
+    """
+    route_data, version = load_session_route()
     
-    route_data = session.get('optimized_route', {})
-    
-    # Check if we need to update for traffic changes
+    # Traffic is refreshed in the background (traffic_refresher), never in the request;
+    # pick up its latest state (check_traffic=true needs nothing more)
     if route_data and 'coordinates' in route_data:
-        # Check if route is older than 2 minutes or check_traffic parameter is provided
-        current_time = int(time.time())
-        last_update = route_data.get('last_traffic_update', 0)
-        force_check = request.args.get('check_traffic', 'false').lower() == 'true'
-        
-        if force_check or (current_time - last_update > 120):  # 2 minutes
-            logging.debug("Checking for traffic updates...")
-            traffic_update = check_for_traffic_updates(route_data)
-            
-            if traffic_update.get('needs_update', False):
-                logging.debug(f"Traffic update needed: {traffic_update['reason']}")
-                
-                # Update the route with new traffic data
-                new_route = traffic_update.get('new_route')
-                if new_route:
-                    # Update duration and traffic information
-                    route_data['total_time'] = new_route['total_duration']
-                    route_data['total_duration_seconds'] = new_route['total_duration_seconds']
-                    route_data['traffic_delay_text'] = new_route.get('traffic_delay_text', '')
-                    route_data['traffic_conditions'] = new_route.get('traffic_conditions', [])
-                    route_data['route_details'] = new_route
-                    route_data['last_traffic_update'] = current_time
-                    route_data['has_traffic_update'] = True
-                    route_data['traffic_update_reason'] = traffic_update['reason']
-                    
-                    # Store the updated route back in the session
-                    session['optimized_route'] = route_data
-            else:
-                # Still update the last check timestamp
-                route_data['last_traffic_update'] = current_time
-                session['optimized_route'] = route_data
+        # Store the updated route; an unchanged route keeps its version (and ETag)
+        if sync_session_route(route_data):
+            version = store_session_route(route_data)
+    
+    # Clients that already have a version of this route can ask for the changes only
+    since_version = request.args.get('since_version', type=int)
+    delta = route_delta(route_data, since_version) if since_version is not None else None
+    
+    # Segment lines are stored once, as encoded polylines; serve them simplified for
+    # the client's zoom level, and as [lon, lat] lists only if asked to (encoded=false)
+    zoom = request.args.get('zoom', type=int)
+    encoded = request.args.get('encoded', 'true').lower() == 'true'
+    response = jsonify(delta if delta is not None else serialize_route_data(route_data, zoom=zoom, encoded=encoded))
+    if version is not None:
+        etag = f"{session['route_handle']}:{version}:{zoom}:{encoded}:{since_version if delta is not None else ''}"
+        response.set_etag(hashlib.sha1(etag.encode()).hexdigest()[:20])
+        response.headers['Cache-Control'] = 'no-cache'
+        response = response.make_conditional(request)
+    return response
+
+# Open event streams, each holding a worker thread (see config.SSE_MAX_STREAMS)
+_event_stream_slots = threading.BoundedSemaphore(config.SSE_MAX_STREAMS)
+
+@app.route('/route_events')
+def route_events():
+    """
+    Server-Sent Events stream of traffic updates of the session's route
+    Each 'traffic' event carries the changed segments and new totals of one
+    background refresh, or 'reload' when the client should fetch /get_route again.
+    Above config.SSE_MAX_STREAMS open streams the request is refused with 503,
+    and the client polls /get_route instead
+    """
+    route_data, _ = load_session_route()
+    route_key = route_data.get('route_key')
+    if not route_key or traffic_refresher.get(route_key) is None:
+        return jsonify({'error': 'No active route'}), 404
+    if not _event_stream_slots.acquire(blocking=False):
+        response = jsonify({'error': 'Too many open event streams'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(config.SSE_MAX_STREAM_SECONDS)
+        return response
+    
+    # Reconnecting browsers send the last event id they received
+    version = request.headers.get('Last-Event-ID', type=int)
+    if version is None:
+        version = request.args.get('version', route_data.get('route_version', 0), type=int)
+    
+    def stream(version):
+        yield f"retry: {config.SSE_RETRY_MS}\n\n"
+        deadline = time.monotonic() + config.SSE_MAX_STREAM_SECONDS
+        with traffic_refresher.viewer(route_key):
+            while time.monotonic() < deadline:
+                event = traffic_refresher.wait_for_update(route_key, version, timeout=config.SSE_HEARTBEAT_SECONDS)
+                if event is None:
+                    yield ": keep-alive\n\n"
+                elif event.get('expired'):
+                    yield "event: expired\ndata: {}\n\n"
+                    return
+                else:
+                    version = event['version']
+                    # Keep the stored route in step, so the client's next /get_route
+                    # (since_version=data_version) only gets later changes
+                    current, _ = route_store.load(handle)
+                    if current and current.get('route_key') == route_key:
+                        if sync_session_route(current):
+                            route_store.save(handle, current)
+                        event = dict(event, data_version=current.get('version'))
+                    yield f"id: {version}\nevent: traffic\ndata: {json.dumps(event)}\n\n"
     
-    return jsonify(route_data)
+    handle = session.get('route_handle')
+    response = Response(stream_with_context(stream(version)), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Called when the stream ends or the client disconnects, even before the first event
+    response.call_on_close(_event_stream_slots.release)
+    return response
+
+@app.route('/cache_stats')
+@login_required
+def cache_stats():
+    """Return hit/miss statistics of the upstream API caches"""
+    return jsonify({
+        'geocode': geocode_cache.stats(),
+        'directions': directions_cache_stats(),
+        'weather': weather_cache.stats()
+    })
 
 @app.route('/get_navigation')
 def get_navigation():
@@ -311,6 +502,165 @@ def get_navigation():
         logging.error(f"Error in navigation: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def _non_negative_int(value, name, optional=False):
+    """
+    Whole non-negative number from JSON input (an int or a numeric string)
+    
+    Raises:
+        ValueError with a message naming the field if the value is invalid
+    """
+    if value is None or value == '':
+        if optional:
+            return None
+        raise ValueError(f'{name} is required')
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f'{name} must be a non-negative whole number')
+    try:
+        number = float(value)
+    except ValueError:
+        raise ValueError(f'{name} must be a non-negative whole number')
+    if not number.is_integer() or number < 0:
+        raise ValueError(f'{name} must be a non-negative whole number')
+    return int(number)
+
+@app.route('/optimize_fleet', methods=['POST'])
+@login_required
+def optimize_fleet_routes():
+    """
+    Split a pool of stops between several couriers in one optimization call
+    
+    Expects JSON: {"depot": point, "stops": [point, ...], "couriers": [{"courier_id": 1,
+    "capacity": 20, "shift_minutes": 480}, ...], "round_trip": true, "save": false,
+    "name": "..."} where a point is {"city", "street", "number", "category",
+    "estimated_duration"} or {"coordinates": [lon, lat]}.
+    With "save": true every non-empty route is stored and assigned to its courier.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        depot = data.get('depot')
+        stops = data.get('stops', [])
+        couriers_data = data.get('couriers', [])
+        round_trip = bool(data.get('round_trip', True))
+        
+        if not depot or not stops or not couriers_data:
+            return jsonify({'error': 'Missing depot, stops or couriers'}), 400
+        
+        # Validate courier settings before they reach the planner
+        try:
+            if not isinstance(couriers_data, list) or not all(isinstance(c, dict) for c in couriers_data):
+                raise ValueError('couriers must be a list of objects')
+            courier_ids = []
+            limits = []
+            for i, courier_data in enumerate(couriers_data):
+                courier_ids.append(_non_negative_int(courier_data.get('courier_id'), f'couriers[{i}].courier_id'))
+                limits.append((
+                    _non_negative_int(courier_data.get('capacity'), f'couriers[{i}].capacity', optional=True),
+                    _non_negative_int(courier_data.get('shift_minutes'), f'couriers[{i}].shift_minutes', optional=True)
+                ))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Resolve couriers
+        known_couriers = {c.id: c for c in Courier.query.filter(Courier.id.in_(courier_ids)).all()}
+        missing = [courier_id for courier_id in courier_ids if courier_id not in known_couriers]
+        if missing:
+            return jsonify({'error': f'Unknown couriers: {missing}'}), 400
+        
+        couriers = []
+        for courier_id, (capacity, shift_minutes) in zip(courier_ids, limits):
+            couriers.append({
+                'courier_id': courier_id,
+                'username': known_couriers[courier_id].username,
+                'capacity': capacity,
+                'shift_seconds': shift_minutes * 60 if shift_minutes is not None else None
+            })
+        
+        # Geocode the depot and all stops at once
+        points = [depot] + stops
+        location_details = []
+        to_geocode = {}
+        for idx, point in enumerate(points):
+            location_details.append({
+                'city': point.get('city', ''),
+                'street': point.get('street', ''),
+                'number': point.get('number', ''),
+                'category': point.get('category', 'home'),
+                'estimated_duration': point.get('estimated_duration', 10)
+            })
+            if not point.get('coordinates'):
+                detail = location_details[-1]
+                to_geocode[idx] = point.get('address') or f"{detail['street']} {detail['number']}, {detail['city']}".strip()
+        
+        geocode_results, failed = geocode_addresses(list(to_geocode.values()))
+        if failed:
+            return jsonify({'error': 'Could not geocode some addresses', 'addresses': failed}), 400
+        geocoded = dict(zip(to_geocode, geocode_results))
+        
+        coords = []
+        for idx, (point, detail) in enumerate(zip(points, location_details)):
+            if idx in geocoded:
+                lon, lat = geocoded[idx]['coordinates']
+                detail['formatted_address'] = geocoded[idx]['formatted_address']
+            else:
+                lon, lat = float(point['coordinates'][0]), float(point['coordinates'][1])
+                detail['formatted_address'] = point.get('address', f"{lat:.5f}, {lon:.5f}")
+            detail['longitude'] = lon
+            detail['latitude'] = lat
+            coords.append([lon, lat])
+        
+        service_times = [0]
+        for detail in location_details[1:]:
+            try:
+                detail['estimated_duration'] = int(detail['estimated_duration'])
+            except (TypeError, ValueError):
+                detail['estimated_duration'] = 10
+            service_times.append(detail['estimated_duration'] * 60)
+        
+        plan = optimize_fleet(
+            coords, couriers, service_times=service_times, round_trip=round_trip,
+            categories=[detail['category'] for detail in location_details]
+        )
+        if not plan:
+            return jsonify({'error': 'Could not optimize fleet routes'}), 500
+        
+        routes = []
+        for planned in plan['routes']:
+            courier = planned['courier']
+            routes.append({
+                'courier_id': courier['courier_id'],
+                'username': courier['username'],
+                'coordinates': planned['coordinates'],
+                'addresses': [location_details[i]['formatted_address'] for i in planned['order']],
+                'location_details': [location_details[i] for i in planned['order']],
+                'total_time': planned['total_time'],
+                'total_distance': planned['total_distance'],
+                'stop_count': len(planned['stops']),
+                'over_shift': planned['over_shift']
+            })
+        
+        if data.get('save'):
+            base_name = data.get('name') or datetime.now().strftime('%Y-%m-%d')
+            to_save = [route_entry for route_entry in routes if route_entry['stop_count']]
+            # The return to the depot repeats the first point, so it is not stored as a stop
+            route_ids = save_routes([
+                prepare_route(route_entry, name=f"{base_name} - {route_entry['username']}",
+                              courier_id=route_entry['courier_id'])
+                for route_entry in to_save
+            ])
+            for route_entry, route_id in zip(to_save, route_ids):
+                route_entry['route_id'] = route_id
+            db.session.commit()
+        
+        return jsonify({
+            'routes': routes,
+            'unassigned': [location_details[i]['formatted_address'] for i in plan['unassigned']]
+        })
+    
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error in fleet optimization: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/save_route', methods=['POST'])
 @login_required
 def save_route():
@@ -333,91 +683,24 @@ def save_route():
             flash("Invalid route data.", "warning")
             return redirect(url_for('index'))
             
-        # Create new route
-        new_route = Route(
-            name=route_name,
-            total_distance=route_data.get('total_distance', 0),
-            total_time=route_data.get('total_time', '0m'),
-            coordinates_json=json.dumps(route_data.get('coordinates', []))
-        )
+        # Keep the route details computed for this route (same stops in the same order),
+        # so loading it later needs no directions requests
+        details_snapshot = None
+        stored_route, _ = load_session_route()
+        if stored_route.get('route_details') and stored_route.get('coordinates') == route_data.get('coordinates'):
+            details_snapshot = snapshot_route_details(stored_route['route_details'])
         
-        db.session.add(new_route)
-        db.session.flush()  # Get the ID for the new route
-        
-        # Add locations
-        for i, coords in enumerate(route_data.get('coordinates', [])):
-            # Skip the last point if it's the same as the first (return to start)
-            if i == len(route_data.get('coordinates', [])) - 1 and i > 0:
-                if coords[0] == route_data['coordinates'][0][0] and coords[1] == route_data['coordinates'][0][1]:
-                    continue
-            
-            # Get location details if available
-            location_detail = None
-            if route_data.get('location_details') and i < len(route_data.get('location_details')):
-                location_detail = route_data['location_details'][i]
-            
-            # Get address if available
-            formatted_address = ''
-            if route_data.get('addresses') and i < len(route_data.get('addresses')):
-                formatted_address = route_data['addresses'][i]
-            
-            # Create location entry
-            city = location_detail.get('city', '') if location_detail else ''
-            street = location_detail.get('street', '') if location_detail else ''
-            number = location_detail.get('number', '') if location_detail else ''
-            category = location_detail.get('category', 'home') if location_detail else 'home'
-            
-            # Parse time windows if present
-            time_window_start = None
-            time_window_end = None
-            estimated_duration = 10
-            
-            if location_detail:
-                if location_detail.get('time_window_start'):
-                    try:
-                        time_window_start = datetime.strptime(location_detail.get('time_window_start'), '%H:%M').time()
-                    except:
-                        pass
-                        
-                if location_detail.get('time_window_end'):
-                    try:
-                        time_window_end = datetime.strptime(location_detail.get('time_window_end'), '%H:%M').time()
-                    except:
-                        pass
-                        
-                if location_detail.get('estimated_duration'):
-                    try:
-                        estimated_duration = int(location_detail.get('estimated_duration'))
-                    except:
-                        pass
-            
-            # Create location
-            location = Location(
-                route_id=new_route.id,
-                city=city,
-                street=street,
-                number=number,
-                position=i,
-                formatted_address=formatted_address,
-                longitude=coords[0],
-                latitude=coords[1],
-                category=category,
-                time_window_start=time_window_start,
-                time_window_end=time_window_end,
-                estimated_duration=estimated_duration
-            )
-            
-            db.session.add(location)
-        
-        # Assign the route to the current user if logged in
-        if current_user.is_authenticated:
-            assignment = CourierRouteAssignment(
-                courier_id=current_user.id,
-                route_id=new_route.id,
-                status='assigned'
+        try:
+            prepared = prepare_route(
+                route_data, name=route_name,
+                courier_id=current_user.id if current_user.is_authenticated else None,
+                details_snapshot=details_snapshot
             )
-            db.session.add(assignment)
+        except RouteValidationError as e:
+            flash(f"Invalid route data: {str(e)}", "warning")
+            return redirect(url_for('index'))
         
+        save_routes([prepared])
         db.session.commit()
         flash("Route saved successfully!", "success")
         return redirect(url_for('index'))
@@ -428,6 +711,64 @@ def save_route():
         flash(f"An error occurred while saving the route: {str(e)}", "danger")
         return redirect(url_for('index'))
 
+@app.route('/save_routes', methods=['POST'])
+@login_required
+def save_routes_bulk():
+    """
+    Save many routes at once (dispatch imports)
+    
+    Expects JSON: {"routes": [{"name": "...", "coordinates": [[lon, lat], ...],
+    "addresses": [...], "location_details": [...], "total_distance": 12.3,
+    "total_time": "1h 5m", "courier_id": 1}, ...]}. Routes without "courier_id"
+    are assigned to the current user. All routes are validated before any is
+    written; one invalid route rejects the request.
+    """
+    if not db_connected:
+        return jsonify({'error': 'Route saving is currently unavailable due to database issues'}), 503
+    
+    try:
+        data = request.get_json(silent=True) or {}
+        routes_data = data.get('routes')
+        if not isinstance(routes_data, list) or not routes_data:
+            return jsonify({'error': 'Missing routes'}), 400
+        if len(routes_data) > config.SAVE_ROUTES_MAX_BATCH:
+            return jsonify({'error': f'At most {config.SAVE_ROUTES_MAX_BATCH} routes per request'}), 400
+        
+        # Validate and convert every route before writing any
+        prepared = []
+        try:
+            for i, route_data in enumerate(routes_data):
+                label = f"routes[{i}]"
+                if not isinstance(route_data, dict):
+                    raise RouteValidationError(f"{label}: route data must be an object")
+                try:
+                    courier_id = int(route_data.get('courier_id') or current_user.id)
+                except (TypeError, ValueError):
+                    raise RouteValidationError(f"{label}: invalid courier_id")
+                prepared.append(prepare_route(route_data, courier_id=courier_id, label=label))
+        except RouteValidationError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        courier_ids = {courier_id for _, _, courier_id in prepared}
+        known_couriers = {courier_id for (courier_id,) in
+                          db.session.query(Courier.id).filter(Courier.id.in_(courier_ids))}
+        missing = sorted(courier_ids - known_couriers)
+        if missing:
+            return jsonify({'error': f'Unknown couriers: {missing}'}), 400
+        
+        route_ids = save_routes(prepared)
+        db.session.commit()
+        return jsonify({
+            'saved': len(route_ids),
+            'route_ids': route_ids,
+            'locations': sum(len(locations) for _, locations, _ in prepared)
+        })
+    
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error saving routes: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/load_route/<int:route_id>')
 def load_route(route_id):
     """Load a route from the database"""
@@ -459,12 +800,23 @@ def load_route(route_id):
             })
             formatted_addresses.append(loc.formatted_address)
             
-        # Get the latest route details with current traffic conditions
-        route_details = get_route_details(route.coordinates)
+        # Serve the saved snapshot with current traffic; weather is added by the
+        # background refresher. Routes without a usable snapshot are fetched again
+        # and get one for the next time
+        coordinates = route.coordinates
+        route_details = route_details_from_snapshot(route.details_snapshot, coordinates)
+        if route_details is None:
+            route_details = get_route_details(coordinates)
+            try:
+                route.details_snapshot = snapshot_route_details(route_details)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logging.error(f"Error storing route details snapshot: {str(e)}")
         
         # Store in session
-        session['optimized_route'] = {
-            'coordinates': route.coordinates,
+        route_data = {
+            'coordinates': coordinates,
             'addresses': formatted_addresses,
             'total_time': route_details['total_duration'],
             'total_distance': route_details['total_distance'],
@@ -475,10 +827,12 @@ def load_route(route_id):
             'has_traffic_data': route_details.get('has_traffic_data', False),
             'traffic_conditions': route_details.get('traffic_conditions', []),
             'last_traffic_update': int(time.time()),
-            'segments': route_details.get('segments', []),
             'loaded_route_id': route.id,
             'loaded_route_name': route.name
         }
+        stamp_route_version(route_data)
+        track_route(route_data)
+        store_session_route(route_data)
         
         flash(f"Route '{route.name}' loaded successfully!", "success")
         return redirect(url_for('index'))
@@ -0,0 +1,174 @@
+"""
+Persistent cache of pairwise travel durations and distances.
+
+Entries live in the DistanceMatrixEntry table, keyed by travel profile and the
+rounded coordinates of both points, and expire after config.MATRIX_CACHE_TTL.
+For a new set of points only the rows and columns of points with missing pairs
+are requested upstream, so repeated depots and regular customers cost nothing.
+"""
+import logging
+from datetime import datetime, timedelta
+
+import numpy as np
+from flask import has_app_context
+from sqlalchemy import and_, delete, insert, or_, select
+
+import config
+from extensions import db
+from models import DistanceMatrixEntry
+
+
+def coordinate_key(coords):
+    """Cache key of a [longitude, latitude] pair"""
+    precision = config.MATRIX_CACHE_PRECISION
+    return f"{coords[0]:.{precision}f},{coords[1]:.{precision}f}"
+
+
+def _load(keys, profile):
+    """Load fresh cached pairs between the given keys into (durations, distances, known) arrays"""
+    n = len(keys)
+    durations = np.full((n, n), np.nan)
+    distances = np.full((n, n), np.nan)
+    known = np.zeros((n, n), dtype=bool)
+    np.fill_diagonal(durations, 0.0)
+    np.fill_diagonal(distances, 0.0)
+    np.fill_diagonal(known, True)
+
+    index = {key: i for i, key in enumerate(keys)}
+    cutoff = datetime.utcnow() - timedelta(seconds=config.MATRIX_CACHE_TTL)
+    with db.engine.connect() as connection:
+        rows = connection.execute(
+            select(DistanceMatrixEntry.origin, DistanceMatrixEntry.destination,
+                   DistanceMatrixEntry.duration, DistanceMatrixEntry.distance)
+            .where(DistanceMatrixEntry.profile == profile,
+                   DistanceMatrixEntry.origin.in_(keys),
+                   DistanceMatrixEntry.destination.in_(keys),
+                   DistanceMatrixEntry.fetched_at >= cutoff)
+        ).all()
+
+    for origin, destination, duration, distance in rows:
+        i, j = index[origin], index[destination]
+        durations[i, j] = np.nan if duration is None else duration
+        distances[i, j] = np.nan if distance is None else distance
+        known[i, j] = True
+    return durations, distances, known
+
+
+def _store(keys, durations, distances, estimated, blocks, profile):
+    """Replace cached entries for the fetched (sources, destinations) blocks, skipping estimates"""
+    if not blocks:
+        return
+    now = datetime.utcnow()
+    cutoff = now - timedelta(seconds=config.MATRIX_CACHE_TTL)
+    rows = [{
+        'profile': profile,
+        'origin': keys[i],
+        'destination': keys[j],
+        'duration': None if np.isnan(durations[i, j]) else float(durations[i, j]),
+        'distance': None if np.isnan(distances[i, j]) else float(distances[i, j]),
+        'fetched_at': now
+    } for sources, destinations in blocks for i in sources for j in destinations
+        if i != j and not estimated[i, j]]
+
+    try:
+        # Drop the old versions of these pairs and anything expired, then insert in one batch.
+        # Written in a transaction of its own, so the caller's session is left alone
+        stale = [DistanceMatrixEntry.fetched_at < cutoff]
+        for sources, destinations in blocks:
+            stale.append(and_(DistanceMatrixEntry.origin.in_([keys[i] for i in sources]),
+                              DistanceMatrixEntry.destination.in_([keys[j] for j in destinations])))
+        with db.engine.begin() as connection:
+            connection.execute(delete(DistanceMatrixEntry).where(
+                DistanceMatrixEntry.profile == profile, or_(*stale)
+            ))
+            if rows:
+                connection.execute(insert(DistanceMatrixEntry), rows)
+    except Exception as e:
+        logging.error(f"Error storing distance matrix cache: {str(e)}")
+
+
+def _points_to_fetch(missing):
+    """Greedily pick points whose rows and columns cover every missing pair"""
+    missing = missing.copy()
+    points = []
+    while missing.any():
+        point = int(np.argmax(missing.sum(axis=0) + missing.sum(axis=1)))
+        points.append(point)
+        missing[point, :] = False
+        missing[:, point] = False
+    return sorted(points)
+
+
+def _as_lists(matrix):
+    return [[None if np.isnan(value) else float(value) for value in row] for row in matrix]
+
+
+def get_matrix(coordinates, fetch, profile=None):
+    """
+    Distance/duration matrix served from the cache, fetching only what is missing
+
+    Args:
+        coordinates: List of longitude/latitude pairs
+        fetch: Function (coordinates, sources, destinations) returning a dictionary
+            with 'durations' and 'distances' rows for sources x destinations
+            (None for all points), or None on failure
+        profile: Travel profile (default: config.OPENROUTE_PROFILE)
+
+    Returns:
+        Dictionary with 'durations' (seconds) and 'distances' (km) as lists of lists,
+        or None if the upstream request failed
+    """
+    if profile is None:
+        profile = config.OPENROUTE_PROFILE
+    if not config.MATRIX_CACHE_ENABLED or not has_app_context():
+        return fetch(coordinates, None, None)
+
+    # Work on unique points so repeated coordinates share one row
+    keys = [coordinate_key(c) for c in coordinates]
+    unique_keys = list(dict.fromkeys(keys))
+    unique_coords = [coordinates[keys.index(key)] for key in unique_keys]
+    n = len(unique_keys)
+
+    try:
+        durations, distances, known = _load(unique_keys, profile)
+    except Exception as e:
+        logging.error(f"Error reading distance matrix cache: {str(e)}")
+        return fetch(coordinates, None, None)
+
+    points = _points_to_fetch(~known)
+    logging.debug(f"Distance matrix cache: {int(known.sum())}/{n * n} pairs cached, "
+                  f"fetching {len(points)} of {n} points")
+
+    fetched_blocks = []
+    estimated = np.zeros((n, n), dtype=bool)
+    # Covering all but one point fetches the same pairs as the full matrix, in one request
+    if len(points) >= n - 1 and points:
+        blocks = [(list(range(n)), list(range(n)))]
+    else:
+        others = [i for i in range(n) if i not in points]
+        # Rows of the points to fetch (to everyone), then columns (from everyone else)
+        blocks = [(points, list(range(n))), (others, points)] if points else []
+
+    for sources, destinations in blocks:
+        full = len(blocks) == 1 and len(sources) == n and len(destinations) == n
+        result = fetch(unique_coords, None, None) if full else fetch(unique_coords, sources, destinations)
+        if not result:
+            return None
+        block = np.ix_(sources, destinations)
+        durations[block] = np.array(result['durations'], dtype=float)
+        distances[block] = np.array(result['distances'], dtype=float)
+        if result.get('estimated') is not None:
+            estimated[block] = result['estimated']
+        fetched_blocks.append((sources, destinations))
+
+    _store(unique_keys, durations, distances, estimated, fetched_blocks, profile)
+
+    # Expand back to the requested (possibly repeated) coordinates
+    order = [unique_keys.index(key) for key in keys]
+    matrix = {
+        'durations': _as_lists(durations[np.ix_(order, order)]),
+        'distances': _as_lists(distances[np.ix_(order, order)])
+    }
+    if estimated.any():
+        matrix['estimated'] = estimated[np.ix_(order, order)]
+    return matrix
@@ -0,0 +1,218 @@
+"""
+Schema updates for existing databases.
+
+db.create_all() only creates missing tables, so columns added to a model after
+its table was created are added here with ALTER TABLE, and indexes declared
+on the models are created where they are missing. Data moved to a new column
+is copied in batches on startup; old columns are only cleared by separate
+cleanup steps, so the previous version of the app keeps working. Tables
+filled from existing rows, like the geocode cache from saved locations, resume
+from the last row handled (MigrationState).
+"""
+import json
+import logging
+from datetime import datetime
+
+from sqlalchemy import bindparam, func, insert, inspect, or_, select, text, update
+
+import config
+import geocode_cache
+from extensions import db
+from models import GeocodeCacheEntry, Location, MigrationState, Route
+
+# Columns added after the first release: table -> [(column, column type)]
+ADDED_COLUMNS = {
+    'route': [
+        ('details_snapshot_json', db.Text()),
+        ('details_version', db.Integer()),
+        ('details_fetched_at', db.DateTime()),
+        ('coordinates_blob', db.LargeBinary())
+    ]
+}
+
+# Rows converted per statement when packing JSON coordinates or seeding the geocode cache
+BACKFILL_BATCH_SIZE = 500
+
+
+def ensure_schema():
+    """
+    Add missing columns and indexes to existing tables
+    Must be called within an application context, after db.create_all()
+
+    Returns:
+        List of "table.column" and index names that were added
+    """
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    added = []
+    for table, columns in ADDED_COLUMNS.items():
+        if table not in tables:
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table)}
+        for name, column_type in columns:
+            if name not in existing:
+                sql_type = column_type.compile(dialect=db.engine.dialect)
+                db.session.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {sql_type}'))
+                added.append(f"{table}.{name}")
+    db.session.commit()
+
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+                added.append(index.name)
+    if added:
+        logging.info(f"Added database columns and indexes: {', '.join(added)}")
+
+    filled = fill_route_created_at()
+    if filled:
+        logging.info(f"Set the missing creation time of {filled} saved routes")
+
+    packed = pack_route_coordinates()
+    if packed:
+        logging.info(f"Packed the coordinates of {packed} saved routes")
+    if not config.KEEP_COORDINATES_JSON:
+        cleared = clear_coordinates_json()
+        if cleared:
+            logging.info(f"Cleared the JSON coordinates of {cleared} saved routes")
+    return added
+
+
+def fill_route_created_at():
+    """
+    Give routes without a creation time the oldest one of any route (so they are
+    listed last) and make the column NOT NULL where the database can alter it;
+    route listings paginate on created_at (see route_queries.py)
+
+    Returns:
+        Number of routes updated
+    """
+    route = Route.__table__
+    oldest = db.session.execute(select(func.min(route.c.created_at))).scalar()
+    result = db.session.execute(
+        update(route)
+        .where(route.c.created_at.is_(None))
+        .values(created_at=oldest or datetime.utcnow())
+    )
+    if db.engine.dialect.name == 'postgresql':
+        columns = {column['name']: column for column in inspect(db.engine).get_columns('route')}
+        if columns['created_at']['nullable']:
+            db.session.execute(text('ALTER TABLE route ALTER COLUMN created_at SET NOT NULL'))
+    db.session.commit()
+    return result.rowcount
+
+
+def pack_route_coordinates(batch_size=BACKFILL_BATCH_SIZE):
+    """
+    Copy the JSON coordinates of routes saved before coordinates_blob existed
+    into the packed column, one batched UPDATE per batch_size routes.
+    The JSON is left in place (see clear_coordinates_json)
+
+    Returns:
+        Number of routes converted
+    """
+    route = Route.__table__
+    converted = 0
+    while True:
+        rows = db.session.execute(
+            select(route.c.id, route.c.coordinates_json)
+            .where(route.c.coordinates_blob.is_(None))
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        values = []
+        for route_id, coordinates_json in rows:
+            try:
+                coordinates = json.loads(coordinates_json or '[]')
+            except ValueError:
+                logging.error(f"Route {route_id} has invalid coordinates JSON, storing no coordinates")
+                coordinates = []
+            values.append({'b_id': route_id, 'b_blob': Route.pack_coordinates(coordinates)})
+        db.session.execute(
+            update(route).where(route.c.id == bindparam('b_id'))
+            .values(coordinates_blob=bindparam('b_blob')),
+            values
+        )
+        db.session.commit()
+        converted += len(rows)
+    return converted
+
+
+def clear_coordinates_json():
+    """
+    Cleanup after pack_route_coordinates, run once config.KEEP_COORDINATES_JSON
+    is off: empty the JSON copies of routes whose coordinates are packed.
+    Versions of the app before the packed column can no longer read them
+
+    Returns:
+        Number of routes cleared
+    """
+    route = Route.__table__
+    result = db.session.execute(
+        update(route)
+        .where(route.c.coordinates_blob.is_not(None), route.c.coordinates_json != '')
+        .values(coordinates_json='')
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def seed_geocode_cache(batch_size=BACKFILL_BATCH_SIZE):
+    """
+    Add the addresses of saved Locations with coordinates to the geocode cache
+    table, batch_size locations at a time. Progress is kept as the last Location.id
+    seen (MigrationState 'geocode_seed'), so each location is read once and
+    later runs only look at locations saved since
+    Must be called within an application context
+
+    Returns:
+        Number of new cache entries
+    """
+    state = MigrationState.query.filter_by(name='geocode_seed').first()
+    if state is None:
+        state = MigrationState(name='geocode_seed', value=0)
+        db.session.add(state)
+    added = 0
+    while True:
+        rows = db.session.execute(
+            select(Location.id, Location.city, Location.street, Location.number,
+                   Location.formatted_address, Location.longitude, Location.latitude)
+            .where(Location.id > state.value, Location.longitude.is_not(None), Location.latitude.is_not(None),
+                   or_(Location.category.is_(None), Location.category != 'current_location'))
+            .order_by(Location.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+
+        entries = {}
+        for _, city, street, number, formatted_address, longitude, latitude in rows:
+            if not city or not street:
+                continue
+            # Same address format as the /optimize form; the first location of an address wins
+            address = f"{street} {number}, {city}" if number else f"{street}, {city}"
+            key = geocode_cache.normalize_address(address)
+            entries.setdefault(key, {
+                'key': key,
+                'address': address,
+                'longitude': longitude,
+                'latitude': latitude,
+                'formatted_address': formatted_address or address
+            })
+        if entries:
+            existing = set(db.session.execute(
+                select(GeocodeCacheEntry.key).where(GeocodeCacheEntry.key.in_(list(entries)))
+            ).scalars())
+            new_entries = [entry for key, entry in entries.items() if key not in existing]
+            if new_entries:
+                db.session.execute(insert(GeocodeCacheEntry), new_entries)
+                added += len(new_entries)
+
+        state.value = rows[-1].id
+        db.session.commit()
+    db.session.commit()
+    return added
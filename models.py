@@ -1,10 +1,15 @@
 from datetime import datetime
 import json
 import uuid
+import numpy as np
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
+import config
 from extensions import db
 
+# Stored coordinate values: little-endian float64, exact for coordinates read back from JSON
+COORDINATE_DTYPE = np.dtype('<f8')
+
 class Courier(UserMixin, db.Model):
     """Model representing a courier user"""
     id = db.Column(db.Integer, primary_key=True)
@@ -37,35 +42,98 @@ class Route(db.Model):
     """Model representing an optimized route"""
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # keyset pagination needs it
     total_distance = db.Column(db.Float, nullable=False)  # in km
     total_time = db.Column(db.String(20), nullable=False)  # stored as string like "2h 30m"
     
-    # Store coordinates as JSON string
-    coordinates_json = db.Column(db.Text, nullable=False)
+    # Coordinates as packed little-endian float64 [longitude, latitude] pairs.
+    # coordinates_json keeps a JSON copy while config.KEEP_COORDINATES_JSON is set,
+    # so earlier versions of the app can still read the routes (see migrations.py)
+    coordinates_blob = db.Column(db.LargeBinary, nullable=True)
+    coordinates_json = db.Column(db.Text, nullable=False, default='')
+    
+    # Snapshot of segment geometry, instructions and base durations (see
+    # route_optimizer.snapshot_route_details), so loading needs no directions calls
+    details_snapshot_json = db.Column(db.Text, nullable=True)
+    details_version = db.Column(db.Integer, nullable=True)
+    details_fetched_at = db.Column(db.DateTime, nullable=True)
     
-    # Relationship with locations
-    locations = db.relationship('Location', backref='route', lazy=True, cascade="all, delete-orphan")
+    # Relationship with locations, in route order
+    locations = db.relationship('Location', backref='route', lazy=True, cascade="all, delete-orphan",
+                                order_by='Location.position')
     
     # Route assignments
     assigned_couriers = db.relationship('CourierRouteAssignment', backref='route', lazy=True, cascade="all, delete-orphan")
     
+    __table_args__ = (
+        # Newest-first keyset pagination of saved routes (see route_queries.py)
+        db.Index('ix_route_created_at_id', 'created_at', 'id'),
+    )
+    
+    def _coordinate_source(self):
+        return self.coordinates_blob if self.coordinates_blob is not None else self.coordinates_json
+    
     @property
     def coordinates(self):
-        """Deserialize coordinates from JSON string"""
-        return json.loads(self.coordinates_json)
+        """Coordinates as a list of [longitude, latitude], cached until they change; do not modify it in place"""
+        source = self._coordinate_source()
+        cached = getattr(self, '_coordinate_cache', None)
+        if cached is None or cached[0] is not source:
+            if self.coordinates_blob is not None:
+                coords = np.frombuffer(self.coordinates_blob, dtype=COORDINATE_DTYPE).reshape(-1, 2).tolist()
+            else:
+                coords = json.loads(self.coordinates_json or '[]')
+            cached = self._coordinate_cache = (source, coords)
+        return cached[1]
     
     @coordinates.setter
     def coordinates(self, coords):
-        """Serialize coordinates to JSON string"""
-        self.coordinates_json = json.dumps(coords)
+        """Pack coordinates into the binary column"""
+        for column, value in Route.coordinate_columns(coords).items():
+            setattr(self, column, value)
+        self._coordinate_cache = None
+    
+    @staticmethod
+    def pack_coordinates(coords):
+        """Packed column value of a coordinate list"""
+        return np.asarray(coords, dtype=COORDINATE_DTYPE).reshape(-1, 2).tobytes()
+    
+    @staticmethod
+    def coordinate_columns(coords):
+        """Column values storing a coordinate list"""
+        return {
+            'coordinates_blob': Route.pack_coordinates(coords),
+            'coordinates_json': json.dumps(coords) if config.KEEP_COORDINATES_JSON else ''
+        }
+    
+    @staticmethod
+    def snapshot_columns(snapshot):
+        """Column values storing a route details snapshot (all None without one)"""
+        if snapshot is None:
+            return {'details_snapshot_json': None, 'details_version': None, 'details_fetched_at': None}
+        return {
+            'details_snapshot_json': json.dumps({'segments': snapshot['segments']}, separators=(',', ':')),
+            'details_version': snapshot['version'],
+            'details_fetched_at': datetime.utcnow()
+        }
+    
+    @property
+    def details_snapshot(self):
+        """Deserialize the route details snapshot, or None if there is none"""
+        if not self.details_snapshot_json:
+            return None
+        snapshot = json.loads(self.details_snapshot_json)
+        snapshot['version'] = self.details_version
+        return snapshot
+    
+    @details_snapshot.setter
+    def details_snapshot(self, snapshot):
+        """Store a route details snapshot with its format version and the current time"""
+        for column, value in Route.snapshot_columns(snapshot).items():
+            setattr(self, column, value)
     
     def to_dict(self):
         """Convert route to dictionary for API responses"""
-        locations_list = []
-        for loc in sorted(self.locations, key=lambda x: x.position):
-            locations_list.append(loc.to_dict())
-            
         return {
             'id': self.id,
             'name': self.name,
@@ -73,7 +141,7 @@ class Route(db.Model):
             'total_distance': self.total_distance,
             'total_time': self.total_time,
             'coordinates': self.coordinates,
-            'locations': locations_list
+            'locations': [loc.to_dict() for loc in self.locations]
         }
     
     def __repr__(self):
@@ -83,7 +151,7 @@ class Route(db.Model):
 class Location(db.Model):
     """Model representing a location in a route"""
     id = db.Column(db.Integer, primary_key=True)
-    route_id = db.Column(db.Integer, db.ForeignKey('route.id'), nullable=False)
+    route_id = db.Column(db.Integer, db.ForeignKey('route.id'), nullable=False, index=True)
     city = db.Column(db.String(100), nullable=False)
     street = db.Column(db.String(100), nullable=False)
     number = db.Column(db.String(20), nullable=True)
@@ -133,8 +201,8 @@ class Location(db.Model):
 class CourierRouteAssignment(db.Model):
     """Model representing assignment of routes to couriers"""
     id = db.Column(db.Integer, primary_key=True)
-    courier_id = db.Column(db.Integer, db.ForeignKey('courier.id'), nullable=False)
-    route_id = db.Column(db.Integer, db.ForeignKey('route.id'), nullable=False)
+    courier_id = db.Column(db.Integer, db.ForeignKey('courier.id'), nullable=False, index=True)
+    route_id = db.Column(db.Integer, db.ForeignKey('route.id'), nullable=False, index=True)
     assigned_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Route status tracking
@@ -144,3 +212,58 @@ class CourierRouteAssignment(db.Model):
     
     def __repr__(self):
         return f"<Assignment Courier:{self.courier_id} to Route:{self.route_id}>"
+
+
+class DistanceMatrixEntry(db.Model):
+    """Cached travel duration and distance between two points (see matrix_cache.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    profile = db.Column(db.String(32), nullable=False)  # Travel profile, e.g. driving-car
+    origin = db.Column(db.String(32), nullable=False)  # Rounded "lon,lat"
+    destination = db.Column(db.String(32), nullable=False)  # Rounded "lon,lat"
+    duration = db.Column(db.Float, nullable=True)  # seconds, None = unreachable
+    distance = db.Column(db.Float, nullable=True)  # km
+    fetched_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    __table_args__ = (
+        db.UniqueConstraint('profile', 'origin', 'destination', name='uq_distance_matrix_pair'),
+    )
+    
+    def __repr__(self):
+        return f"<DistanceMatrixEntry {self.origin} -> {self.destination}>"
+
+
+class GeocodeCacheEntry(db.Model):
+    """Cached geocoding result for a normalized address (see geocode_cache.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(255), unique=True, nullable=False)  # Normalized address
+    address = db.Column(db.String(255), nullable=False)  # Address as first requested
+    longitude = db.Column(db.Float, nullable=False)
+    latitude = db.Column(db.Float, nullable=False)
+    formatted_address = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<GeocodeCacheEntry {self.key}>"
+
+
+class StoredRouteData(db.Model):
+    """Route data of a user's current route, referenced by a handle in the session (see route_store.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    handle = db.Column(db.String(32), unique=True, nullable=False)
+    data_json = db.Column(db.Text, nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f"<StoredRouteData {self.handle} v{self.version}>"
+
+
+class MigrationState(db.Model):
+    """Progress of a data migration that runs in batches, e.g. the last row it handled (see migrations.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), unique=True, nullable=False)
+    value = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<MigrationState {self.name}={self.value}>"
@@ -1,22 +1,48 @@
-import requests
 import logging
 import json
 import math
 import time
-import random
-from itertools import permutations
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 import config
+import distance_estimator
+from caching import TTLCache
+import fleet_planner
+import geocode_cache
+import geometry as route_geometry
+import http_client
+import matrix_cache
+import traffic_model
+import tsp_solver
+import weather_cache
 from datetime import datetime
 
-def geocode_address(address):
+# Directions results per leg (geometry, instructions, base duration); the traffic
+# overlay is computed on top of them on every call
+_directions_cache = TTLCache(maxsize=config.DIRECTIONS_CACHE_SIZE, ttl=config.DIRECTIONS_CACHE_TTL)
+
+def geocode_address(address, use_cache=True):
     """Convert address to coordinates using OpenRouteService Geocoding API"""
+    if use_cache:
+        cached = geocode_cache.lookup(address)
+        if cached:
+            return cached
+    
+    result = fetch_geocode(address)
+    if result and use_cache:
+        geocode_cache.store(address, result)
+    return result
+
+def fetch_geocode(address):
+    """Geocode an address with the OpenRouteService Geocoding API, bypassing the cache"""
     try:
         params = {
             'api_key': config.OPENROUTE_API_KEY,
             'text': address
         }
         
-        response = requests.get(config.OPENROUTE_GEOCODE_URL, params=params)
+        response = http_client.get('ors_geocode', config.OPENROUTE_GEOCODE_URL, params=params)
         response.raise_for_status()
         
         data = response.json()
@@ -35,42 +61,206 @@ def geocode_address(address):
         logging.error(f"Error geocoding address {address}: {str(e)}")
         return None
 
-def get_distance_matrix(coordinates):
-    """Get distance and duration matrix between all points using OpenRouteService API"""
+def geocode_addresses(addresses, use_cache=True):
+    """
+    Geocode many addresses at once
+    Cached addresses are answered with one cache lookup, the rest are requested
+    concurrently (config.GEOCODE_MAX_WORKERS at a time)
+    
+    Args:
+        addresses: List of address strings
+        use_cache: Whether to use the geocoding cache
+    
+    Returns:
+        Tuple (results, failed): results aligned with addresses (None where geocoding
+        failed) and the list of addresses that could not be resolved
+    """
+    found = geocode_cache.lookup_many(addresses) if use_cache else {}
+    missing = [address for address in dict.fromkeys(addresses) if address not in found]
+    
+    if missing:
+        fetched = {}
+        with ThreadPoolExecutor(max_workers=min(config.GEOCODE_MAX_WORKERS, len(missing))) as executor:
+            for address, result in zip(missing, executor.map(fetch_geocode, missing)):
+                fetched[address] = result
+        if use_cache:
+            geocode_cache.store_many(fetched)
+        found.update(fetched)
+    
+    results = [found.get(address) for address in addresses]
+    failed = [address for address, result in zip(addresses, results) if not result]
+    return results, failed
+
+def get_distance_matrix(coordinates, use_cache=True, categories=None):
+    """
+    Get distance and duration matrix between all points
+    Pairs already known from the persistent matrix cache are not requested again.
+    For large point sets only pairs of nearby points are requested, the rest is
+    estimated offline; if the API fails entirely, the whole matrix is estimated.
+    
+    Args:
+        coordinates: List of longitude/latitude pairs
+        use_cache: Whether to use the persistent matrix cache
+        categories: Location category per point, used by the offline speed model
+    """
+    fetch = fetch_distance_matrix
+    if len(coordinates) >= config.MATRIX_PREFILTER_MIN_LOCATIONS:
+        fetch = partial(fetch_distance_matrix, prefilter=True)
+    
+    matrix = matrix_cache.get_matrix(coordinates, fetch) if use_cache else fetch(coordinates)
+    if matrix:
+        return matrix
+    
+    logging.warning("Distance matrix API unavailable, using offline estimates")
+    estimate = distance_estimator.estimate_matrix(coordinates, categories)
+    return {
+        'durations': estimate['durations'].tolist(),
+        'distances': estimate['distances'].tolist(),
+        'estimated': np.ones((len(coordinates), len(coordinates)), dtype=bool)
+    }
+
+def _matrix_blocks(sources, destinations):
+    """
+    Split sources x destinations into blocks that fit the upstream request limit
+    (config.MATRIX_MAX_ELEMENTS pairs per request)
+    """
+    max_elements = config.MATRIX_MAX_ELEMENTS
+    cols = min(len(destinations), max(1, int(math.sqrt(max_elements))))
+    rows = min(len(sources), max(1, max_elements // cols))
+    return [
+        (sources[r:r + rows], destinations[c:c + cols])
+        for r in range(0, len(sources), rows)
+        for c in range(0, len(destinations), cols)
+    ]
+
+def _fetch_matrix_block(coordinates, sources, destinations):
+    """
+    Request one block of the matrix from OpenRouteService (retried by http_client)
+    Only the block's own points are sent, so every request stays within the limit
+    
+    Returns:
+        Dictionary with 'durations' and 'distances' rows for sources x destinations
+    """
+    headers = {
+        'Authorization': config.OPENROUTE_API_KEY,
+        'Content-Type': 'application/json; charset=utf-8',
+        'Accept': 'application/json, application/geo+json, application/gpx+xml'
+    }
+    
+    if sources == destinations:
+        locations = [coordinates[i] for i in sources]
+        body_sources, body_destinations = None, None
+    else:
+        locations = [coordinates[i] for i in sources] + [coordinates[j] for j in destinations]
+        body_sources = list(range(len(sources)))
+        body_destinations = list(range(len(sources), len(locations)))
+    
+    body = {
+        'locations': locations,
+        'metrics': ['distance', 'duration'],
+        'units': 'km'
+    }
+    if body_sources is not None:
+        body['sources'] = body_sources
+        body['destinations'] = body_destinations
+    
+    response = http_client.post(
+        'ors_matrix',
+        config.OPENROUTE_MATRIX_URL,
+        headers=headers,
+        json=body
+    )
+    response.raise_for_status()
+    
+    data = response.json()
+    return {
+        'durations': data['durations'],
+        'distances': data['distances']
+    }
+
+def fetch_distance_matrix(coordinates, sources=None, destinations=None, prefilter=False):
+    """
+    Get distance and duration matrix using OpenRouteService API
+    Large matrices are split into blocks within the per-request limit that are
+    fetched in parallel (config.MATRIX_MAX_WORKERS at a time) and stitched together
+    
+    Args:
+        coordinates: List of longitude/latitude pairs
+        sources: Indices of coordinates used as rows (default: all)
+        destinations: Indices of coordinates used as columns (default: all)
+        prefilter: Only request blocks containing pairs of nearby points and
+            estimate the rest offline (see distance_estimator.candidate_pairs)
+    
+    Returns:
+        Dictionary with 'durations' and 'distances', plus an 'estimated' boolean
+        array when some pairs were estimated instead of fetched
+    """
     try:
-        headers = {
-            'Authorization': config.OPENROUTE_API_KEY,
-            'Content-Type': 'application/json; charset=utf-8',
-            'Accept': 'application/json, application/geo+json, application/gpx+xml'
-        }
+        sources = list(range(len(coordinates))) if sources is None else list(sources)
+        destinations = list(range(len(coordinates))) if destinations is None else list(destinations)
         
-        body = {
-            'locations': coordinates,
-            'metrics': ['distance', 'duration'],
-            'units': 'km'
-        }
+        required = None
+        if prefilter:
+            required = distance_estimator.candidate_pairs(coordinates)
+            # Sort points along the map so that nearby pairs fall into the same blocks
+            rank = np.empty(len(coordinates), dtype=int)
+            rank[distance_estimator.spatial_order(coordinates)] = np.arange(len(coordinates))
+            blocks = _matrix_blocks(sorted(sources, key=lambda i: rank[i]),
+                                    sorted(destinations, key=lambda i: rank[i]))
+            blocks = [block for block in blocks if required[np.ix_(block[0], block[1])].any()]
+        else:
+            blocks = _matrix_blocks(sources, destinations)
         
-        response = requests.post(
-            config.OPENROUTE_MATRIX_URL,
-            headers=headers,
-            json=body
-        )
-        response.raise_for_status()
+        if len(blocks) == 1 and required is None:
+            return _fetch_matrix_block(coordinates, sources, destinations)
         
-        data = response.json()
-        return {
-            'durations': data['durations'],
-            'distances': data['distances']
+        logging.debug(f"Fetching {len(sources)}x{len(destinations)} matrix in {len(blocks)} blocks")
+        durations = np.full((len(sources), len(destinations)), np.nan)
+        distances = np.full((len(sources), len(destinations)), np.nan)
+        estimated = np.zeros((len(sources), len(destinations)), dtype=bool)
+        row_offset = {index: row for row, index in enumerate(sources)}
+        col_offset = {index: col for col, index in enumerate(destinations)}
+        
+        if required is not None:
+            estimate = distance_estimator.estimate_matrix(coordinates)
+            durations[:] = estimate['durations'][np.ix_(sources, destinations)]
+            distances[:] = estimate['distances'][np.ix_(sources, destinations)]
+            estimated[:] = True
+        
+        with ThreadPoolExecutor(max_workers=config.MATRIX_MAX_WORKERS) as executor:
+            futures = {
+                executor.submit(_fetch_matrix_block, coordinates, block_sources, block_destinations):
+                    (block_sources, block_destinations)
+                for block_sources, block_destinations in blocks
+            }
+            for future in as_completed(futures):
+                block_sources, block_destinations = futures[future]
+                result = future.result()
+                block = np.ix_([row_offset[i] for i in block_sources], [col_offset[j] for j in block_destinations])
+                durations[block] = np.array(result['durations'], dtype=float)
+                distances[block] = np.array(result['distances'], dtype=float)
+                estimated[block] = False
+        
+        matrix = {
+            'durations': [[None if np.isnan(v) else float(v) for v in row] for row in durations],
+            'distances': [[None if np.isnan(v) else float(v) for v in row] for row in distances]
         }
+        if estimated.any():
+            matrix['estimated'] = estimated
+        return matrix
     except Exception as e:
         logging.error(f"Error getting distance matrix: {str(e)}")
         return None
 
-def optimize_route(coordinates):
+def optimize_route(coordinates, round_trip=False):
     """
-    Optimize route using a simple TSP solver with the distance matrix
-    For small number of points, we'll use brute force (permutations)
-    For larger sets, we'd need a more sophisticated algorithm
+    Optimize route order using the duration matrix
+    Up to config.EXACT_SOLVER_MAX_LOCATIONS points are solved exactly (Held-Karp),
+    larger sets use a nearest neighbour tour improved with 2-opt / Or-opt
+
+    Args:
+        coordinates: List of longitude/latitude pairs, the first one is the start
+        round_trip: Whether the courier returns to the starting point
     """
     try:
         if len(coordinates) <= 1:
@@ -82,81 +272,210 @@ def optimize_route(coordinates):
         if not matrix:
             return None, 0, 0
             
-        durations = matrix['durations']
+        durations = tsp_solver.to_matrix(matrix['durations'])
         distances = matrix['distances']
         
-        # For small number of points (<=10), use brute force approach
-        if len(coordinates) <= 8:
-            # Try all permutations starting with the first point
-            start = 0
-            min_duration = float('inf')
-            best_route_indices = None
-            
-            # Generate all possible routes starting from the first location
-            for perm in permutations(range(1, len(coordinates))):
-                route = [start] + list(perm) + [start]  # Complete round trip
-                
-                # Calculate total duration for this route
-                total_duration = 0
-                for i in range(len(route) - 1):
-                    from_idx = route[i]
-                    to_idx = route[i + 1]
-                    total_duration += durations[from_idx][to_idx]
-                
-                if total_duration < min_duration:
-                    min_duration = total_duration
-                    best_route_indices = route
+        if len(coordinates) <= config.EXACT_SOLVER_MAX_LOCATIONS:
+            best_route_indices, min_duration = tsp_solver.held_karp(durations, round_trip=round_trip)
         else:
-            # For larger sets, use a greedy nearest neighbor approach
-            start = 0
-            current = start
-            route_indices = [current]
-            unvisited = set(range(1, len(coordinates)))
-            
-            while unvisited:
-                # Find nearest unvisited location
-                nearest = min(unvisited, key=lambda x: durations[current][x])
-                route_indices.append(nearest)
-                unvisited.remove(nearest)
-                current = nearest
-                
-            # Nie wracamy do początku, jeśli użytkownik tego nie oczekuje
-            # route_indices.append(start)  # Zakomentowane, aby usunąć powrót do punktu startowego
-            best_route_indices = route_indices
-            
-            # Calculate total duration
-            min_duration = 0
-            for i in range(len(best_route_indices) - 1):
-                from_idx = best_route_indices[i]
-                to_idx = best_route_indices[i + 1]
-                min_duration += durations[from_idx][to_idx]
+            initial_route = tsp_solver.nearest_neighbour(durations, round_trip=round_trip)
+            result = tsp_solver.improve_route(durations, initial_route, round_trip=round_trip)
+            logging.info(f"Local search improved route by {result['improvement_percent']:.1f}% "
+                         f"in {result['iterations']} moves")
+            best_route_indices = result['route']
+            min_duration = result['cost']
         
-        # Convert route indices to coordinates
-        optimized_route = [coordinates[i] for i in best_route_indices] if best_route_indices else []
-        
-        # Calculate total distance
-        total_distance = 0
-        if best_route_indices and distances:
-            for i in range(len(best_route_indices) - 1):
-                from_idx = best_route_indices[i]
-                to_idx = best_route_indices[i + 1]
-                total_distance += distances[from_idx][to_idx]
-            
-        # Convert seconds to hours:minutes format
-        hours = int(min_duration / 3600)
-        minutes = int((min_duration % 3600) / 60)
-        time_str = f"{hours}h {minutes}m"
+        if not math.isfinite(min_duration):
+            logging.error("Error optimizing route: some stops cannot be reached by road")
+            return None, 0, 0
         
-        # Round distance to 1 decimal place
-        distance_str = f"{total_distance:.1f}"
+        # Convert route indices to coordinates
+        optimized_route = [coordinates[i] for i in best_route_indices]
         
+        time_str, distance_str = _format_route_totals(min_duration, distances, best_route_indices)
         return optimized_route, time_str, distance_str
         
     except Exception as e:
         logging.error(f"Error optimizing route: {str(e)}")
         return None, 0, 0
 
+def _format_route_totals(duration, distances, route_indices):
+    """Format total duration (seconds) as "Xh Ym" and the route distance in km with one decimal"""
+    # Calculate total distance (legs without a known distance are left out)
+    total_distance = 0
+    if distances:
+        legs = tsp_solver.to_matrix(distances)[route_indices[:-1], route_indices[1:]]
+        total_distance = float(legs[np.isfinite(legs)].sum())
+        
+    # Convert seconds to hours:minutes format
+    hours = int(duration / 3600)
+    minutes = int((duration % 3600) / 60)
+    time_str = f"{hours}h {minutes}m"
+    
+    # Round distance to 1 decimal place
+    distance_str = f"{total_distance:.1f}"
+    
+    return time_str, distance_str
+
+def _parse_clock_time(value):
+    """Convert an "HH:MM" string to seconds since midnight, None if empty or invalid"""
+    try:
+        parsed = datetime.strptime(value, '%H:%M')
+        return parsed.hour * 3600 + parsed.minute * 60
+    except (TypeError, ValueError):
+        return None
+
+def _format_clock_time(seconds):
+    """Convert seconds since midnight to an "HH:MM" string"""
+    seconds = int(round(seconds)) % 86400
+    return f"{seconds // 3600:02d}:{(seconds % 3600) // 60:02d}"
+
+def optimize_route_with_time_windows(coordinates, location_details, round_trip=False, start_time=None):
+    """
+    Optimize route order respecting delivery time windows and stop durations
+    
+    Args:
+        coordinates: List of longitude/latitude pairs, the first one is the start
+        location_details: Dictionaries with 'time_window_start', 'time_window_end'
+            ("HH:MM" strings) and 'estimated_duration' (minutes), aligned with coordinates
+        round_trip: Whether the courier returns to the starting point
+        start_time: Departure time in seconds since midnight (default: now)
+    
+    Returns:
+        Tuple (optimized route, time string, distance string, plan) where plan holds
+        the visiting order, per-stop ETAs and time window violations
+    """
+    try:
+        if start_time is None:
+            now = datetime.now()
+            start_time = now.hour * 3600 + now.minute * 60 + now.second
+        
+        windows = [None]  # The starting point has no delivery window
+        service_times = [0]
+        for detail in location_details[1:]:
+            window_start = _parse_clock_time(detail.get('time_window_start'))
+            window_end = _parse_clock_time(detail.get('time_window_end'))
+            if window_start is not None and window_end is not None and window_end < window_start:
+                window_end += 86400  # Window past midnight
+            windows.append((window_start, window_end))
+            
+            try:
+                service_times.append(int(detail.get('estimated_duration') or 10) * 60)
+            except (TypeError, ValueError):
+                service_times.append(10 * 60)
+        
+        matrix = get_distance_matrix(
+            coordinates, categories=[detail.get('category') for detail in location_details]
+        )
+        
+        if not matrix:
+            return None, 0, 0, None
+        
+        result = tsp_solver.solve_time_windows(
+            matrix['durations'], service_times, windows, start_time, round_trip=round_trip
+        )
+        route_indices = result['route']
+        
+        # Stops after a leg the matrix has no duration for get no times
+        stops = []
+        for stop in result['schedule']:
+            reached = math.isfinite(stop['arrival'])
+            stops.append({
+                'index': stop['index'],
+                'arrival': _format_clock_time(stop['arrival']) if reached else None,
+                'service_start': _format_clock_time(stop['service_start']) if reached else None,
+                'departure': _format_clock_time(stop['departure']) if reached else None,
+                'wait_minutes': int(stop['wait'] / 60),
+                'late_minutes': int(math.ceil(stop['late'] / 60))
+            })
+        
+        plan = {
+            'order': route_indices,
+            'stops': stops,
+            'violations': [
+                {'index': v['index'], 'late_minutes': int(math.ceil(v['late'] / 60))}
+                for v in result['violations']
+            ],
+            'unreachable': result['unreachable'],
+            'feasible': result['feasible']
+        }
+        
+        duration = result['duration']
+        if result['unreachable']:
+            logging.warning(f"No travel time to stops {result['unreachable']}, route time covers the reachable part only")
+            durations = tsp_solver.to_matrix(matrix['durations'])
+            legs = durations[route_indices[:-1], route_indices[1:]]
+            duration = float(legs[np.isfinite(legs)].sum() + sum(service_times[i] for i in route_indices[1:]
+                                                                  if i != route_indices[0]))
+        
+        optimized_route = [coordinates[i] for i in route_indices]
+        time_str, distance_str = _format_route_totals(duration, matrix['distances'], route_indices)
+        return optimized_route, time_str, distance_str, plan
+        
+    except Exception as e:
+        logging.error(f"Error optimizing route with time windows: {str(e)}")
+        return None, 0, 0, None
+
+def optimize_fleet(coordinates, couriers, service_times=None, round_trip=True, categories=None):
+    """
+    Split stops between several couriers and optimize each courier's route
+    
+    Args:
+        coordinates: List of longitude/latitude pairs, the first one is the depot
+        couriers: List of dictionaries with optional 'capacity' (maximum number of stops)
+            and 'shift_seconds' (maximum route duration)
+        service_times: Service duration per point in seconds
+        round_trip: Whether couriers return to the depot
+        categories: Location category per point, used by offline estimates
+    
+    Returns:
+        Dictionary with one route per courier (indices, coordinates, time and distance
+        strings) and the indices of stops that could not be assigned, or None on failure
+    """
+    try:
+        matrix = get_distance_matrix(coordinates, categories=categories)
+        
+        if not matrix:
+            return None
+        
+        plan = fleet_planner.plan_fleet(
+            matrix['durations'], couriers, service_times=service_times, round_trip=round_trip
+        )
+        
+        routes = []
+        for planned in plan['routes']:
+            time_str, distance_str = _format_route_totals(
+                planned['duration'], matrix['distances'], planned['route']
+            )
+            routes.append({
+                'courier': planned['courier'],
+                'order': planned['route'],
+                'stops': planned['stops'],
+                'coordinates': [coordinates[i] for i in planned['route']],
+                'total_time': time_str,
+                'total_distance': distance_str,
+                'duration_seconds': planned['duration'],
+                'over_shift': planned['over_shift']
+            })
+        
+        return {
+            'routes': routes,
+            'unassigned': plan['unassigned']
+        }
+        
+    except Exception as e:
+        logging.error(f"Error optimizing fleet routes: {str(e)}")
+        return None
+
 def get_weather(coords):
+    """
+    Get current weather conditions for a location
+    Locations in one geohash tile share a cached OpenWeatherMap result
+    (see weather_cache)
+    """
+    return weather_cache.get(coords, fetch_weather)
+
+def fetch_weather(coords):
     """Get current weather conditions for a location using OpenWeatherMap API"""
     try:
         # Convert coordinates from [longitude, latitude] to [latitude, longitude]
@@ -170,7 +489,7 @@ def get_weather(coords):
             'units': 'metric'  # Use metric units (Celsius, km/h)
         }
         
-        response = requests.get(config.WEATHER_API_URL, params=params)
+        response = http_client.get('weather', config.WEATHER_API_URL, params=params)
         response.raise_for_status()
         
         data = response.json()
@@ -205,46 +524,6 @@ def get_weather(coords):
         logging.error(f"Error fetching weather data: {str(e)}")
         return None
 
-def simulate_traffic_conditions(start, end):
-    """
-    Simulates traffic conditions based on time of day and location
-    This is a placeholder for real traffic API data
-    
-    Returns:
-        Integer traffic level (0-3)
-        0 = Free flowing, 1 = Light traffic, 2 = Moderate traffic, 3 = Heavy traffic
-    """
-    # Get current hour (0-23)
-    current_hour = datetime.now().hour
-    
-    # Base probability based on time of day
-    if 7 <= current_hour <= 9:  # Morning rush hour
-        base_probability = 0.7
-    elif 16 <= current_hour <= 19:  # Evening rush hour
-        base_probability = 0.8
-    elif 10 <= current_hour <= 15:  # Midday
-        base_probability = 0.3
-    elif 20 <= current_hour <= 23:  # Evening
-        base_probability = 0.2
-    else:  # Late night/early morning
-        base_probability = 0.1
-    
-    # Add some randomness
-    random_factor = random.random() * 0.3 - 0.15  # -0.15 to +0.15
-    
-    # Calculate final probability
-    probability = base_probability + random_factor
-    
-    # Determine traffic level based on probability
-    if probability < 0.2:
-        return 0  # Free flowing
-    elif probability < 0.5:
-        return 1  # Light traffic
-    elif probability < 0.8:
-        return 2  # Moderate traffic
-    else:
-        return 3  # Heavy traffic
-
 def calculate_distance(point1, point2):
     """Calculate straight-line distance between two points in km"""
     # Earth radius in km
@@ -265,54 +544,169 @@ def calculate_distance(point1, point2):
     
     return distance
 
-def get_route_details(coordinates, include_traffic=True):
+def fetch_segment_directions(start, end):
+    """Call OpenRouteService Directions API for one leg and return the parsed response"""
+    headers = {
+        'Authorization': config.OPENROUTE_API_KEY,
+        'Content-Type': 'application/json; charset=utf-8'
+    }
+    
+    # Base parameters
+    body = {
+        "coordinates": [[start[0], start[1]], [end[0], end[1]]],
+        "instructions": True,
+        "format": "geojson",
+        "geometry": True,
+        "geometry_simplify": False,  # Nie upraszczaj geometrii trasy
+        "preference": config.DIRECTIONS_PREFERENCE,  # Preferowana trasa
+        "continue_straight": True,
+        "radiuses": [-1, -1]  # Użyj domyślnej (maksymalnej) odległości wyszukiwania
+    }
+    
+    response = http_client.post(
+        'ors_directions',
+        config.OPENROUTE_DIRECTIONS_URL,
+        json=body, 
+        headers=headers
+    )
+    response.raise_for_status()
+    return response.json()
+
+def fetch_route_directions(coordinates):
+    """Call OpenRouteService Directions API once for the whole sequence of points"""
+    headers = {
+        'Authorization': config.OPENROUTE_API_KEY,
+        'Content-Type': 'application/json; charset=utf-8'
+    }
+    
+    body = {
+        "coordinates": [[point[0], point[1]] for point in coordinates],
+        "instructions": True,
+        "format": "geojson",
+        "geometry": True,
+        "geometry_simplify": False,
+        "preference": config.DIRECTIONS_PREFERENCE,
+        "continue_straight": True,
+        "radiuses": [-1] * len(coordinates)
+    }
+    
+    response = http_client.post(
+        'ors_directions',
+        config.OPENROUTE_DIRECTIONS_URL,
+        json=body, 
+        headers=headers
+    )
+    response.raise_for_status()
+    return response.json()
+
+def split_route_directions(route_data, leg_count):
+    """
+    Split a multi-waypoint directions response into per-leg responses
+    The leg geometry is cut at the returned way_points indices; each leg keeps its
+    own summary and instructions, in the same format as a single-leg response
+    """
+    feature = route_data['features'][0]
+    properties = feature['properties']
+    line = feature['geometry']['coordinates']
+    way_points = properties['way_points']
+    segments = properties.get('segments', [])
+    
+    if len(way_points) != leg_count + 1 or len(segments) != leg_count:
+        raise ValueError(f"Expected {leg_count} legs, got {len(segments)} segments and {len(way_points)} way points")
+    
+    legs = []
+    for i, segment in enumerate(segments):
+        legs.append({
+            'features': [{
+                'properties': {
+                    'summary': {
+                        'distance': segment.get('distance', 0),
+                        'duration': segment.get('duration', 0)
+                    },
+                    'segments': [segment]
+                },
+                'geometry': {
+                    'coordinates': line[way_points[i]:way_points[i + 1] + 1]
+                }
+            }]
+        })
+    return legs
+
+def _directions_key(start, end):
+    """Cache key of a leg: rounded endpoints, travel profile and routing preference"""
+    precision = config.DIRECTIONS_CACHE_PRECISION
+    return (f"{start[0]:.{precision}f},{start[1]:.{precision}f}",
+            f"{end[0]:.{precision}f},{end[1]:.{precision}f}",
+            config.OPENROUTE_PROFILE, config.DIRECTIONS_PREFERENCE)
+
+def directions_cache_stats():
+    """Hit/miss counters of the directions cache"""
+    return _directions_cache.stats()
+
+def get_route_details(coordinates, include_traffic=True, mode=None):
     """
     Get detailed route information between consecutive points
+    Directions for all legs and weather for all stops are requested concurrently
+    (config.ROUTE_DETAILS_CONCURRENCY at a time); segments keep the route order
     
     Args:
         coordinates: List of longitude/latitude pairs
         include_traffic: Whether to include real-time traffic data (default: True)
+        mode: 'multi' to request all legs in one directions call (falls back to
+            per-leg calls above config.DIRECTIONS_MAX_WAYPOINTS points or on error),
+            'per_leg' for one call per leg (default: config.DIRECTIONS_MODE).
+            Legs found in the directions cache are not requested at all
     
     Returns:
         Dictionary with route segments, total distance, and duration
     """
     route_segments = []
-    total_distance = 0
-    total_duration = 0
-    traffic_conditions = []
-    traffic_delay_seconds = 0
     
-    # Calculate route between each consecutive point
-    for i in range(len(coordinates) - 1):
-        start = coordinates[i]
-        end = coordinates[i + 1]
+    if mode is None:
+        mode = config.DIRECTIONS_MODE
+    
+    legs = range(len(coordinates) - 1)
+    leg_keys = [_directions_key(coordinates[i], coordinates[i + 1]) for i in legs]
+    leg_responses = [_directions_cache.get(key) for key in leg_keys]
+    missing = [i for i in legs if leg_responses[i] is None]
+    logging.debug(f"Directions cache: {len(leg_keys) - len(missing)}/{len(leg_keys)} legs cached")
+    
+    directions_futures = {}
+    with ThreadPoolExecutor(max_workers=config.ROUTE_DETAILS_CONCURRENCY) as executor:
+        # Get weather data for each destination point, but not for the return to start;
+        # one lookup per weather tile
+        tile_futures = {}
+        weather_futures = {}
+        for i in legs:
+            if i < len(coordinates) - 2:
+                tile = weather_cache.geohash(coordinates[i + 1])
+                if tile not in tile_futures:
+                    tile_futures[tile] = executor.submit(get_weather, coordinates[i + 1])
+                weather_futures[i] = tile_futures[tile]
         
-        # Call OpenRouteService Directions API
-        headers = {
-            'Authorization': config.OPENROUTE_API_KEY,
-            'Content-Type': 'application/json; charset=utf-8'
-        }
+        if mode == 'multi' and len(missing) > 1 and len(coordinates) <= config.DIRECTIONS_MAX_WAYPOINTS:
+            try:
+                for i, leg in enumerate(split_route_directions(fetch_route_directions(coordinates), len(legs))):
+                    leg_responses[i] = leg
+                    _directions_cache.set(leg_keys[i], leg)
+                missing = []
+            except Exception as e:
+                logging.warning(f"Multi-waypoint directions failed, falling back to per-leg requests: {str(e)}")
         
-        # Base parameters
-        body = {
-            "coordinates": [[start[0], start[1]], [end[0], end[1]]],
-            "instructions": True,
-            "format": "geojson",
-            "geometry": True,
-            "geometry_simplify": False,  # Nie upraszczaj geometrii trasy
-            "preference": "recommended",  # Preferowana trasa
-            "continue_straight": True,
-            "radiuses": [-1, -1]  # Użyj domyślnej (maksymalnej) odległości wyszukiwania
+        directions_futures = {
+            i: executor.submit(fetch_segment_directions, coordinates[i], coordinates[i + 1]) for i in missing
         }
+    
+    # Calculate route between each consecutive point
+    for i in legs:
+        start = coordinates[i]
+        end = coordinates[i + 1]
         
         try:
-            response = requests.post(
-                config.OPENROUTE_DIRECTIONS_URL,
-                json=body, 
-                headers=headers
-            )
-            response.raise_for_status()
-            route_data = response.json()
+            route_data = leg_responses[i]
+            if route_data is None:
+                route_data = directions_futures[i].result()
+                _directions_cache.set(leg_keys[i], route_data)
             
             # Extract route details
             if 'features' in route_data and len(route_data['features']) > 0:
@@ -323,49 +717,20 @@ def get_route_details(coordinates, include_traffic=True):
                 # Log the number of geometry points for debugging
                 logging.debug(f"Segment {i}: Received {len(geometry['coordinates'])} geometry points from API")
                 
-                # Extract traffic conditions if available
-                # This is where you would parse traffic info from the API response
-                # For demonstration, we'll simulate traffic conditions
-                traffic_level = simulate_traffic_conditions(start, end)
-                
-                # Calculate simulated delay based on traffic level
-                # In a real implementation, this would come from the API
-                base_duration = properties['summary']['duration']
-                if include_traffic and traffic_level > 0:
-                    # Add delay based on traffic level (0-3)
-                    delay_factor = [0, 0.15, 0.3, 0.6][traffic_level]
-                    traffic_delay = base_duration * delay_factor
-                else:
-                    traffic_delay = 0
-                
-                # Store the adjusted duration
-                adjusted_duration = base_duration + traffic_delay
-                
-                # Set the color based on traffic level
-                if traffic_level == 0:
-                    traffic_color = 'green'  # Free flowing
-                elif traffic_level == 1:
-                    traffic_color = 'yellow'  # Light traffic
-                elif traffic_level == 2:
-                    traffic_color = 'orange'  # Moderate traffic
-                else:
-                    traffic_color = 'red'     # Heavy traffic
-                
-                # Get weather data for each destination point
-                weather_data = None
-                if i < len(coordinates) - 2:  # Don't get weather for the return to start
-                    weather_data = get_weather(end)
+                # Weather for the destination point (not for the return to start)
+                weather_data = weather_futures[i].result() if i in weather_futures else None
                 
+                # Traffic fields are filled in for all segments at once below
                 segment = {
                     'start_idx': i,
                     'end_idx': i + 1,
                     'distance': properties['summary']['distance'] / 1000,  # Convert to km
-                    'duration': adjusted_duration,  # seconds, including traffic delay
-                    'base_duration': base_duration,  # seconds, without traffic
-                    'traffic_delay': traffic_delay,  # seconds of delay due to traffic
-                    'traffic_level': traffic_level,  # 0-3 scale
-                    'traffic_color': traffic_color,  # Color to use when displaying on map
-                    'geometry': geometry['coordinates'],
+                    'duration': properties['summary']['duration'],  # seconds, including traffic delay
+                    'base_duration': properties['summary']['duration'],  # seconds, without traffic
+                    'traffic_delay': 0,  # seconds of delay due to traffic
+                    'traffic_level': 0,  # 0-3 scale
+                    'traffic_color': 'green',  # Color to use when displaying on map
+                    'geometry': route_geometry.encode_polyline(geometry['coordinates']),  # encoded polyline
                     'weather': weather_data
                 }
                 
@@ -380,16 +745,6 @@ def get_route_details(coordinates, include_traffic=True):
                                 'duration': step['duration']
                             })
                 segment['instructions'] = instructions
-                
-                total_distance += segment['distance']
-                total_duration += segment['duration']
-                traffic_delay_seconds += traffic_delay
-                traffic_conditions.append({
-                    'segment': i,
-                    'level': traffic_level,
-                    'color': traffic_color,
-                    'delay_seconds': traffic_delay
-                })
                 route_segments.append(segment)
         except Exception as e:
             logging.error(f"Error fetching route details: {str(e)}")
@@ -403,12 +758,72 @@ def get_route_details(coordinates, include_traffic=True):
                 'traffic_delay': 0,
                 'traffic_level': 0,
                 'traffic_color': 'gray',
-                'geometry': [[start[0], start[1]], [end[0], end[1]]],
+                'geometry': route_geometry.encode_polyline([start, end]),
                 'instructions': [],
                 'weather': None
             }
             route_segments.append(segment)
     
+    apply_traffic(route_segments, include_traffic=include_traffic)
+    return summarize_route(route_segments, include_traffic=include_traffic)
+
+# Segment fields set by the traffic overlay
+TRAFFIC_FIELDS = ('duration', 'traffic_delay', 'traffic_level', 'traffic_color', 'traffic_bucket')
+
+def apply_traffic(segments, include_traffic=True, when=None):
+    """
+    Set the traffic overlay of segments in place from the traffic model, for all
+    segments at once; straight-line fallback segments (gray) are left untouched
+    
+    Args:
+        segments: Route segments with 'distance' (km) and 'base_duration' (seconds)
+        include_traffic: Whether to add traffic delay to segment durations (default: True)
+        when: Moment to evaluate traffic for (default: now)
+    
+    Returns:
+        Time bucket the overlay was computed for
+    """
+    known = [segment for segment in segments if segment['traffic_color'] != 'gray']
+    traffic = traffic_model.evaluate(
+        [segment['distance'] for segment in known],
+        [segment['base_duration'] for segment in known],
+        when=when
+    )
+    for segment, delay, level in zip(known, traffic['delay'].tolist(), traffic['level'].tolist()):
+        traffic_delay = delay if include_traffic else 0
+        segment['duration'] = segment['base_duration'] + traffic_delay
+        segment['traffic_delay'] = traffic_delay
+        segment['traffic_level'] = level
+        segment['traffic_color'] = traffic_model.level_color(level)
+        segment['traffic_bucket'] = traffic['bucket']
+    return traffic['bucket']
+
+def summarize_route(route_segments, include_traffic=True):
+    """
+    Route totals and traffic summary of a list of segments
+    
+    Returns:
+        Dictionary with route segments, total distance, and duration
+    """
+    total_distance = 0
+    total_duration = 0
+    traffic_conditions = []
+    traffic_delay_seconds = 0
+    
+    for segment in route_segments:
+        # Straight-line fallback segments have no usable distance or duration
+        if segment['traffic_color'] == 'gray':
+            continue
+        total_distance += segment['distance']
+        total_duration += segment['duration']
+        traffic_delay_seconds += segment['traffic_delay']
+        traffic_conditions.append({
+            'segment': segment['start_idx'],
+            'level': segment['traffic_level'],
+            'color': segment['traffic_color'],
+            'delay_seconds': segment['traffic_delay']
+        })
+    
     # Format total_duration as a string (e.g., "2h 30m")
     hours = int(total_duration / 3600)
     minutes = int((total_duration % 3600) / 60)
@@ -434,65 +849,133 @@ def get_route_details(coordinates, include_traffic=True):
         'timestamp': int(time.time())
     }
 
+# Format version of route details snapshots stored with saved routes
+ROUTE_SNAPSHOT_VERSION = 1
+
+# Segment fields kept in a snapshot; traffic and weather are recomputed on load
+SNAPSHOT_FIELDS = ('start_idx', 'end_idx', 'distance', 'base_duration', 'geometry', 'instructions')
+
+def snapshot_route_details(route_details):
+    """
+    Compact snapshot of route details for storing with a saved route: segment
+    geometry, instructions and base durations, without traffic and weather
+    
+    Returns:
+        Dictionary with the snapshot 'version' and 'segments'
+    """
+    return {
+        'version': ROUTE_SNAPSHOT_VERSION,
+        'segments': [
+            {field: segment.get(field) for field in SNAPSHOT_FIELDS}
+            for segment in route_details.get('segments', [])
+            # Straight-line fallback segments are fetched again on load
+            if segment.get('traffic_color') != 'gray'
+        ]
+    }
+
+def route_details_from_snapshot(snapshot, coordinates, include_traffic=True):
+    """
+    Route details rebuilt from a snapshot without any upstream call; the traffic
+    overlay is computed for the current time and weather is marked as pending
+    (see fill_weather)
+    
+    Returns:
+        Route details like get_route_details, or None if the snapshot does not
+        cover every leg of the route
+    """
+    if not snapshot or snapshot.get('version') != ROUTE_SNAPSHOT_VERSION:
+        return None
+    segments = snapshot.get('segments') or []
+    if [segment['start_idx'] for segment in segments] != list(range(len(coordinates) - 1)):
+        return None
+    
+    route_segments = [dict(segment, duration=segment['base_duration'], traffic_delay=0, traffic_level=0,
+                           traffic_color='green', weather=None) for segment in segments]
+    apply_traffic(route_segments, include_traffic=include_traffic)
+    route_details = summarize_route(route_segments, include_traffic=include_traffic)
+    route_details['weather_pending'] = True
+    return route_details
+
+def fill_weather(route_details, coordinates):
+    """
+    Add weather of every stop to route details rebuilt from a snapshot
+    
+    Returns:
+        New route details (the segments are copied)
+    """
+    segments = [dict(segment) for segment in route_details['segments']]
+    weather_futures = {}
+    with ThreadPoolExecutor(max_workers=config.ROUTE_DETAILS_CONCURRENCY) as executor:
+        tile_futures = {}
+        for i, segment in enumerate(segments):
+            # Weather for the destination point, but not for the return to start
+            if segment['end_idx'] < len(coordinates) - 1:
+                end = coordinates[segment['end_idx']]
+                tile = weather_cache.geohash(end)
+                if tile not in tile_futures:
+                    tile_futures[tile] = executor.submit(get_weather, end)
+                weather_futures[i] = tile_futures[tile]
+    for i, future in weather_futures.items():
+        segments[i]['weather'] = future.result()
+    
+    route_details = dict(route_details, segments=segments)
+    route_details.pop('weather_pending', None)
+    return route_details
+
 def check_for_traffic_updates(route_data, threshold_percent=15):
     """
     Check if traffic conditions have changed significantly since route was created
+    Only the traffic overlay of segments computed for an older time bucket is
+    recomputed, without any upstream call; directions are requested again only
+    for routes without details, or for straight-line fallback segments once the
+    route details are over 10 minutes old
     
     Args:
         route_data: The original route data
         threshold_percent: Percentage change threshold to trigger update
         
     Returns:
-        Dictionary with update status and new route data if needed
+        Dictionary with update status; 'changes' (new traffic fields of the
+        refreshed segments) and 'totals' (new route totals) form the diff to apply
+        with apply_traffic_update, or 'new_route' if the route was rebuilt
     """
-    # If no timestamp or over 10 minutes old, always update
-    if 'timestamp' not in route_data or time.time() - route_data.get('timestamp', 0) > 600:
-        # Make sure we have coordinates to work with
-        if 'coordinates' not in route_data:
-            return {
-                'needs_update': False,
-                'reason': 'No coordinates available to check for updates'
-            }
-            
-        new_route = get_route_details(route_data['coordinates'])
-        return {
-            'needs_update': True,
-            'reason': 'Route information is outdated',
-            'new_route': new_route
-        }
+    route_details = route_data.get('route_details') or {}
+    segments = route_details.get('segments')
     
-    # Check each segment for traffic changes
-    if 'route_details' in route_data and 'segments' in route_data['route_details']:
-        segments = route_data['route_details']['segments']
-        coordinates = [segment['geometry'][0] for segment in segments]
-    else:
+    has_fallback = any(segment.get('traffic_color') == 'gray' for segment in segments or [])
+    if not segments or (has_fallback and time.time() - route_details.get('timestamp', 0) > 600):
         # If we don't have detailed segment information, use the original coordinates
         if 'coordinates' not in route_data:
             return {
                 'needs_update': False,
                 'reason': 'No route details available to check for updates'
             }
-        coordinates = route_data['coordinates']
-        updated_route = get_route_details(coordinates)
+        updated_route = get_route_details(route_data['coordinates'],
+                                          include_traffic=route_details.get('has_traffic_data', True))
         return {
             'needs_update': True,
             'reason': 'Route information needs to be refreshed',
             'new_route': updated_route
         }
     
-    # Get current traffic conditions
-    updated_route = get_route_details(coordinates)
+    # Recompute the traffic overlay of segments from an older time bucket only
+    bucket = traffic_model.time_bucket()
+    stale = [i for i, segment in enumerate(segments)
+             if segment.get('traffic_color') != 'gray' and segment.get('traffic_bucket') != bucket]
+    refreshed = [dict(segments[i]) for i in stale]
+    if refreshed:
+        apply_traffic(refreshed, include_traffic=route_details.get('has_traffic_data', True))
     
-    # Compare segment durations
+    changes = []
     duration_changes = []
     max_change_percent = 0
     changed_segment_idx = -1
     
-    for i, (old_segment, new_segment) in enumerate(zip(segments, updated_route['segments'])):
-        if 'duration' not in old_segment or 'duration' not in new_segment:
-            continue
-            
-        old_duration = old_segment['duration']
+    for i, new_segment in zip(stale, refreshed):
+        old_segment = segments[i]
+        changes.append({'index': i, **{field: new_segment[field] for field in TRAFFIC_FIELDS}})
+        
+        old_duration = old_segment.get('duration', 0)
         new_duration = new_segment['duration']
         
         if old_duration == 0:
@@ -517,32 +1000,58 @@ def check_for_traffic_updates(route_data, threshold_percent=15):
     
     if needs_update and changed_segment_idx >= 0:
         old_segment = segments[changed_segment_idx] 
-        new_segment = updated_route['segments'][changed_segment_idx]
+        new_segment = refreshed[stale.index(changed_segment_idx)]
         
         # Get the location names for better context
-        from_location = f"point {changed_segment_idx + 1}"
         to_location = f"point {changed_segment_idx + 2}"
         
-        if changed_segment_idx < len(segments) - 1 and 'weather' in segments[changed_segment_idx + 1] and segments[changed_segment_idx + 1]['weather']:
-            to_location = segments[changed_segment_idx + 1]['weather']['location_name']
+        if old_segment.get('weather'):
+            to_location = old_segment['weather']['location_name']
         
         # Create reason message
-        old_minutes = int(old_segment['duration'] / 60)
-        new_minutes = int(new_segment['duration'] / 60)
-        diff_minutes = new_minutes - old_minutes
+        diff_minutes = round((new_segment['duration'] - old_segment['duration']) / 60)
         
-        if diff_minutes > 0:
+        if new_segment['duration'] > old_segment['duration']:
             reason = f"Traffic increased on the route to {to_location} (+{diff_minutes} min)"
         else:
             reason = f"Traffic decreased on the route to {to_location} ({diff_minutes} min)"
     else:
         reason = "No significant traffic changes"
     
+    totals = None
+    if changes:
+        updated_segments = list(segments)
+        for i, new_segment in zip(stale, refreshed):
+            updated_segments[i] = new_segment
+        totals = summarize_route(updated_segments, include_traffic=route_details.get('has_traffic_data', True))
+        del totals['segments']
+    
     return {
         'needs_update': needs_update,
         'reason': reason,
         'max_change_percent': max_change_percent,
         'changed_segment': changed_segment_idx if needs_update else -1,
         'duration_changes': duration_changes,
-        'new_route': updated_route if needs_update else None
+        'traffic_bucket': bucket,
+        'changes': changes,
+        'totals': totals
     }
+
+def apply_traffic_update(route_details, update):
+    """
+    Apply the diff returned by check_for_traffic_updates to route details
+    
+    Returns:
+        Updated route details (the segments that changed are copied, not modified in place)
+    """
+    if update.get('new_route'):
+        return update['new_route']
+    if not update.get('changes'):
+        return route_details
+    
+    segments = list(route_details['segments'])
+    for change in update['changes']:
+        segment = dict(segments[change['index']])
+        segment.update({field: change[field] for field in TRAFFIC_FIELDS})
+        segments[change['index']] = segment
+    return dict(route_details, **update['totals'], segments=segments)
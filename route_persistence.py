@@ -0,0 +1,155 @@
+"""
+Set-based persistence of saved routes.
+
+The stops of every route in a request are validated and converted to plain
+row dictionaries first, so a bad route rejects the whole request before
+anything is written. The rows are then written with one executemany INSERT
+per table: routes (returning their ids), locations and courier assignments.
+"""
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from extensions import db
+from models import CourierRouteAssignment, Location, Route
+
+DEFAULT_STOP_DURATION = 10  # minutes
+
+
+class RouteValidationError(ValueError):
+    """Route data that cannot be saved"""
+
+
+def _parse_time(value):
+    """'HH:MM' time window bound, or None if missing or malformed"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%H:%M').time()
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_duration(value):
+    try:
+        return int(value) if value else DEFAULT_STOP_DURATION
+    except (TypeError, ValueError):
+        return DEFAULT_STOP_DURATION
+
+
+def _coordinates(route_data, label):
+    """Validated [[lon, lat], ...] of a route"""
+    coordinates = route_data.get('coordinates')
+    if not isinstance(coordinates, list) or not coordinates:
+        raise RouteValidationError(f"{label}: missing coordinates")
+    try:
+        coordinates = [[float(point[0]), float(point[1])] for point in coordinates]
+    except (TypeError, ValueError, IndexError, KeyError):
+        raise RouteValidationError(f"{label}: coordinates must be [longitude, latitude] pairs")
+    for lon, lat in coordinates:
+        if not (-180 <= lon <= 180 and -90 <= lat <= 90):
+            raise RouteValidationError(f"{label}: coordinates out of range: {[lon, lat]}")
+    return coordinates
+
+
+def prepare_route(route_data, name=None, courier_id=None, details_snapshot=None, label='route'):
+    """
+    Validate one route and convert it to rows
+
+    Args:
+        route_data: Route dictionary with 'coordinates' and optionally 'addresses',
+            'location_details', 'total_distance' and 'total_time'
+        name: Route name (default: route_data['name'])
+        courier_id: Courier to assign the route to, if any
+        details_snapshot: Route details snapshot to store with the route
+        label: Name of the route in error messages
+
+    Returns:
+        Tuple (route row, location rows without route_id, courier_id)
+
+    Raises:
+        RouteValidationError if the route cannot be saved
+    """
+    if not isinstance(route_data, dict):
+        raise RouteValidationError(f"{label}: route data must be an object")
+    coordinates = _coordinates(route_data, label)
+    try:
+        total_distance = float(route_data.get('total_distance') or 0)
+    except (TypeError, ValueError):
+        raise RouteValidationError(f"{label}: invalid total_distance")
+
+    route_row = {
+        'name': name if name is not None else route_data.get('name', ''),
+        'created_at': datetime.utcnow(),
+        'total_distance': total_distance,
+        'total_time': str(route_data.get('total_time') or '0m')
+    }
+    route_row.update(Route.coordinate_columns(coordinates))
+    route_row.update(Route.snapshot_columns(details_snapshot))
+
+    details = route_data.get('location_details') or []
+    addresses = route_data.get('addresses') or []
+    stop_count = len(coordinates)
+    # Skip the last point if it's the same as the first (return to start)
+    if stop_count > 1 and coordinates[-1] == coordinates[0]:
+        stop_count -= 1
+
+    location_rows = []
+    for i in range(stop_count):
+        lon, lat = coordinates[i]
+        detail = details[i] if i < len(details) and isinstance(details[i], dict) else {}
+        location_rows.append({
+            'city': detail.get('city') or '',
+            'street': detail.get('street') or '',
+            'number': detail.get('number') or '',
+            'position': i,
+            'formatted_address': addresses[i] if i < len(addresses) else '',
+            'longitude': lon,
+            'latitude': lat,
+            'category': detail.get('category') or 'home',
+            'time_window_start': _parse_time(detail.get('time_window_start')),
+            'time_window_end': _parse_time(detail.get('time_window_end')),
+            'estimated_duration': _parse_duration(detail.get('estimated_duration')),
+            'status': 'pending'
+        })
+    return route_row, location_rows, courier_id
+
+
+def save_routes(prepared):
+    """
+    Insert prepared routes with their locations and assignments
+    The caller commits (or rolls back) the session
+
+    Args:
+        prepared: List of prepare_route() results
+
+    Returns:
+        List of the new route ids, in the order of `prepared`
+    """
+    if not prepared:
+        return []
+    # Batched into one INSERT ... RETURNING on PostgreSQL; SQLite cannot guarantee the
+    # order of returned ids in a batch, so SQLAlchemy inserts routes one by one there
+    route_ids = db.session.execute(
+        insert(Route).returning(Route.id, sort_by_parameter_order=True),
+        [route_row for route_row, _, _ in prepared]
+    ).scalars().all()
+
+    location_rows = []
+    assignment_rows = []
+    now = datetime.utcnow()
+    for route_id, (_, locations, courier_id) in zip(route_ids, prepared):
+        location_rows.extend(dict(row, route_id=route_id) for row in locations)
+        if courier_id is not None:
+            assignment_rows.append({
+                'courier_id': courier_id,
+                'route_id': route_id,
+                'assigned_at': now,
+                'status': 'assigned'
+            })
+
+    if location_rows:
+        db.session.execute(insert(Location), location_rows)
+    if assignment_rows:
+        db.session.execute(insert(CourierRouteAssignment), assignment_rows)
+    return route_ids
@@ -0,0 +1,149 @@
+"""
+Read-side queries over saved routes.
+
+Saved routes are listed newest first with keyset pagination on
+(created_at, id): each page continues after the last row of the previous one
+via an opaque cursor, so deep pages cost the same as the first one and are
+served by the ix_route_created_at_id index. Listings return lightweight summary
+rows (no coordinate or snapshot columns) with the stop count taken from a
+correlated COUNT over the indexed location.route_id.
+
+Courier assignments are loaded with their routes (and optionally the routes'
+locations) eagerly, in a fixed number of queries however many there are.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import defer, joinedload
+
+import config
+from extensions import db
+from models import CourierRouteAssignment, Location, Route
+
+
+def encode_cursor(row):
+    """Cursor continuing after a summary row"""
+    return f"{row.created_at.isoformat()}_{row.id}"
+
+
+def decode_cursor(cursor):
+    """
+    (created_at, id) of a cursor
+
+    Raises:
+        ValueError if the cursor is malformed
+    """
+    created_at, _, route_id = (cursor or '').rpartition('_')
+    return datetime.fromisoformat(created_at), int(route_id)
+
+
+def parse_date(value):
+    """'YYYY-MM-DD' as a date, or None if missing or malformed"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def _filters(courier_id=None, date_from=None, date_to=None):
+    """WHERE clauses for the route listing filters"""
+    clauses = []
+    if courier_id is not None:
+        clauses.append(Route.id.in_(
+            select(CourierRouteAssignment.route_id).where(CourierRouteAssignment.courier_id == courier_id)
+        ))
+    if date_from is not None:
+        clauses.append(Route.created_at >= datetime.combine(date_from, datetime.min.time()))
+    if date_to is not None:
+        clauses.append(Route.created_at < datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+    return clauses
+
+
+def route_summaries(cursor=None, limit=None, courier_id=None, date_from=None, date_to=None):
+    """
+    One page of saved routes, newest first
+
+    Args:
+        cursor: Cursor returned with the previous page (None for the first page)
+        limit: Page size (default: config.ROUTES_PAGE_SIZE)
+        courier_id: Only routes assigned to this courier
+        date_from: Only routes created on or after this date
+        date_to: Only routes created on or before this date
+
+    Returns:
+        Tuple (rows, next cursor or None on the last page); rows have id, name,
+        created_at, total_distance, total_time and stop_count attributes
+    """
+    limit = limit or config.ROUTES_PAGE_SIZE
+    stop_count = (
+        select(func.count(Location.id))
+        .where(Location.route_id == Route.id)
+        .correlate(Route)
+        .scalar_subquery()
+    )
+    query = (
+        select(Route.id, Route.name, Route.created_at, Route.total_distance, Route.total_time,
+               stop_count.label('stop_count'))
+        .where(*_filters(courier_id, date_from, date_to))
+        .order_by(Route.created_at.desc(), Route.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        created_at, route_id = decode_cursor(cursor)
+        query = query.where(or_(
+            Route.created_at < created_at,
+            and_(Route.created_at == created_at, Route.id < route_id)
+        ))
+
+    rows = db.session.execute(query).all()
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def count_routes(courier_id=None, date_from=None, date_to=None):
+    """Number of saved routes matching the listing filters"""
+    return db.session.execute(
+        select(func.count(Route.id)).where(*_filters(courier_id, date_from, date_to))
+    ).scalar()
+
+
+def courier_assignments(courier_id, with_locations=False, status=None):
+    """
+    Route assignments of a courier, newest first, with their routes loaded
+
+    Args:
+        courier_id: Courier ID
+        with_locations: Also load every route's locations (ordered by position)
+            and coordinates, e.g. for Route.to_dict()
+        status: Only assignments with this status
+
+    Returns:
+        List of CourierRouteAssignment; one query, plus one for the locations
+    """
+    route = joinedload(CourierRouteAssignment.route)
+    if with_locations:
+        route = route.options(defer(Route.details_snapshot_json)).selectinload(Route.locations)
+    else:
+        route = route.options(defer(Route.coordinates_blob), defer(Route.coordinates_json),
+                              defer(Route.details_snapshot_json))
+    query = (
+        select(CourierRouteAssignment)
+        .where(CourierRouteAssignment.courier_id == courier_id)
+        .options(route)
+        .order_by(CourierRouteAssignment.assigned_at.desc(), CourierRouteAssignment.id.desc())
+    )
+    if status:
+        query = query.where(CourierRouteAssignment.status == status)
+    return db.session.execute(query).scalars().all()
+
+
+def assignment_status_counts(courier_id):
+    """Number of a courier's assignments by status, e.g. {'assigned': 3, 'completed': 120}"""
+    rows = db.session.execute(
+        select(CourierRouteAssignment.status, func.count(CourierRouteAssignment.id))
+        .where(CourierRouteAssignment.courier_id == courier_id)
+        .group_by(CourierRouteAssignment.status)
+    ).all()
+    return {status: count for status, count in rows}
@@ -0,0 +1,119 @@
+"""
+Server-side store of the route data users are working with.
+
+The session only keeps a route handle; the route itself (coordinates, details,
+geometry, weather) is kept in the StoredRouteData table behind an in-process
+LRU. Every save bumps the route's version, which /get_route uses as its ETag.
+Entries not saved for config.ROUTE_STORE_TTL are deleted.
+
+Values returned by load() are shared with the cache: replace top-level keys of
+the returned dictionary, but do not modify nested values in place.
+"""
+import json
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from flask import has_app_context
+
+import config
+from caching import TTLCache
+from extensions import db
+from models import StoredRouteData
+
+# handle -> (version, route data)
+_memory = TTLCache(maxsize=config.ROUTE_STORE_CACHE_SIZE, ttl=config.ROUTE_STORE_TTL)
+_last_purge = 0.0
+
+
+def new_handle():
+    return uuid.uuid4().hex
+
+
+def load(handle):
+    """
+    Route data and version stored under a handle
+
+    Returns:
+        Tuple (route data, version), or (None, None) if there is no such route
+    """
+    if not handle:
+        return None, None
+    cached = _memory.get(handle)
+    if cached is not None:
+        version, data = cached
+        return dict(data), version
+
+    if not has_app_context():
+        return None, None
+    try:
+        entry = StoredRouteData.query.filter_by(handle=handle).first()
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error loading stored route: {str(e)}")
+        return None, None
+    if entry is None:
+        return None, None
+    data = json.loads(entry.data_json)
+    _memory.set(handle, (entry.version, data))
+    return dict(data), entry.version
+
+
+def save(handle, route_data):
+    """
+    Store route data under a handle, replacing the previous version
+
+    Returns:
+        The new version number
+    """
+    cached = _memory.get(handle)
+    version = (cached[0] if cached else 0) + 1
+    _memory.set(handle, (version, route_data))
+
+    if not has_app_context():
+        return version
+    try:
+        entry = StoredRouteData.query.filter_by(handle=handle).first()
+        if entry is None:
+            entry = StoredRouteData(handle=handle)
+            db.session.add(entry)
+        elif not cached:
+            version = entry.version + 1
+            _memory.set(handle, (version, route_data))
+        entry.data_json = json.dumps(route_data)
+        entry.version = version
+        entry.updated_at = datetime.utcnow()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error saving stored route: {str(e)}")
+    _purge_expired()
+    return version
+
+
+def delete(handle):
+    _memory.pop(handle)
+    if not has_app_context():
+        return
+    try:
+        StoredRouteData.query.filter_by(handle=handle).delete()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error deleting stored route: {str(e)}")
+
+
+def _purge_expired():
+    """Delete expired routes, at most once an hour"""
+    global _last_purge
+    if time.monotonic() - _last_purge < 3600:
+        return
+    _last_purge = time.monotonic()
+    try:
+        cutoff = datetime.utcnow() - timedelta(seconds=config.ROUTE_STORE_TTL)
+        StoredRouteData.query.filter(StoredRouteData.updated_at < cutoff).delete()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error purging stored routes: {str(e)}")
@@ -0,0 +1,75 @@
+"""
+Version numbering of a user's current route, for delta updates.
+
+A route starts at version 1 (stamp_route_version). Each traffic or weather
+refresh copied into it (update_route_totals) bumps the version and stamps the
+segments that changed with it; unchanged segments keep their version. New
+segment geometry starts a new base version, before which no delta can be
+computed. route_delta returns the segments changed since a version the client
+already has.
+"""
+from route_optimizer import TRAFFIC_FIELDS
+
+def stamp_route_version(route_data):
+    """Start version numbering of a new route: every segment is new in version 1"""
+    route_data['version'] = route_data['base_version'] = 1
+    route_details = route_data.get('route_details') or {}
+    route_details['segments'] = [dict(segment, version=1) for segment in route_details.get('segments', [])]
+
+
+def update_route_totals(route_data, route_details):
+    """
+    Copy refreshed route details and their totals into session route data
+    The route version is increased and changed segments are stamped with it;
+    if the segments themselves were replaced, the route starts a new base version
+    """
+    version = route_data.get('version', 0) + 1
+    old_segments = (route_data.get('route_details') or {}).get('segments') or []
+    new_segments = route_details.get('segments') or []
+    if len(old_segments) != len(new_segments) or any(
+            old.get('geometry') != new.get('geometry') for old, new in zip(old_segments, new_segments)):
+        route_data['base_version'] = version
+        segments = [dict(new, version=version) for new in new_segments]
+    else:
+        segments = []
+        for old, new in zip(old_segments, new_segments):
+            if all(new.get(field) == old.get(field) for field in new if field != 'version'):
+                segments.append(dict(new, version=old.get('version', route_data.get('base_version', 1))))
+            else:
+                segments.append(dict(new, version=version))
+    
+    route_data['version'] = version
+    route_data['total_time'] = route_details['total_duration']
+    route_data['total_duration_seconds'] = route_details['total_duration_seconds']
+    route_data['traffic_delay_text'] = route_details.get('traffic_delay_text', '')
+    route_data['traffic_conditions'] = route_details.get('traffic_conditions', [])
+    route_data['route_details'] = dict(route_details, segments=segments)
+
+
+# Segment fields sent in deltas: the traffic overlay, and weather filled in after loading
+DELTA_FIELDS = TRAFFIC_FIELDS + ('weather',)
+
+
+def route_delta(route_data, since_version):
+    """
+    Changes of a route since a version the client already has: the traffic fields
+    of segments changed since then and the current totals
+    
+    Returns:
+        Delta dictionary, or None if the client needs the full route
+    """
+    if not route_data or since_version < route_data.get('base_version', 1) or since_version > route_data.get('version', 1):
+        return None
+    route_details = route_data['route_details']
+    return {
+        'delta': True,
+        'version': route_data.get('version', 1),
+        'changes': [
+            {'index': i, 'version': segment['version'], **{field: segment.get(field) for field in DELTA_FIELDS}}
+            for i, segment in enumerate(route_details.get('segments', [])) if segment.get('version', 0) > since_version
+        ],
+        'totals': {key: value for key, value in route_details.items() if key != 'segments'},
+        'has_traffic_update': route_data.get('has_traffic_update', False),
+        'traffic_update_reason': route_data.get('traffic_update_reason', ''),
+        'route_version': route_data.get('route_version')
+    }
@@ -7,6 +7,9 @@ let userLocationMarker = null;
 let userLocation = null;
 let isLocationTrackingEnabled = false;
 let locationUpdateTimer = null;
+let routeGeometryZoom = null; // Zoom level the displayed route geometry was simplified for
+let routeEvents = null; // Server-Sent Events stream of traffic updates
+let currentRouteData = null;
 
 function initMap() {
     // Initialize map
@@ -59,13 +62,60 @@ function initMap() {
         }, 1000);
     }
     
+    // Fetch more detailed route geometry when zooming in past the loaded level
+    map.on('zoomend', function() {
+        if (routeGeometryZoom !== null && map.getZoom() > routeGeometryZoom) {
+            fetch(routeUrl())
+                .then(response => response.json())
+                .then(data => {
+                    if (data && data.coordinates) {
+                        displayRoute(data, false);
+                    }
+                })
+                .catch(error => console.error('Error fetching route geometry:', error));
+        }
+    });
+    
     // Set up automatic traffic updates
     setupTrafficUpdates();
 }
 
+function routeUrl(params = '') {
+    // Route geometry is served simplified for the current map zoom level
+    const zoom = map ? map.getZoom() : 13;
+    return `/get_route?zoom=${zoom}${params ? '&' + params : ''}`;
+}
+
+function decodePolyline(encoded, precision = 5) {
+    // Decode an encoded polyline into [lat, lon] points
+    const factor = Math.pow(10, precision);
+    const points = [];
+    let index = 0, lat = 0, lon = 0;
+    
+    while (index < encoded.length) {
+        const values = [0, 0];
+        for (let k = 0; k < 2; k++) {
+            let result = 0, shift = 0, byte;
+            do {
+                byte = encoded.charCodeAt(index++) - 63;
+                result |= (byte & 0x1f) << shift;
+                shift += 5;
+            } while (byte >= 0x20);
+            values[k] = (result & 1) ? ~(result >> 1) : (result >> 1);
+        }
+        lat += values[0];
+        lon += values[1];
+        points.push([lat / factor, lon / factor]);
+    }
+    return points;
+}
+
 function setupTrafficUpdates() {
-    // Check for traffic updates every 30 seconds
-    trafficUpdateTimer = setInterval(checkTrafficUpdates, 30000);
+    // Traffic updates are pushed by the server (see subscribeRouteEvents);
+    // browsers without EventSource check for them every 30 seconds instead
+    if (!window.EventSource) {
+        startTrafficPolling();
+    }
     
     // Also attach event listener for page visibility
     document.addEventListener('visibilitychange', function() {
@@ -82,6 +132,86 @@ function setupTrafficUpdates() {
     setTimeout(checkTrafficUpdates, 5000); // Check after 5 seconds initially
 }
 
+function startTrafficPolling() {
+    if (!trafficUpdateTimer) {
+        trafficUpdateTimer = setInterval(checkTrafficUpdates, 30000);
+    }
+}
+
+function subscribeRouteEvents(routeData) {
+    // Listen for traffic updates of the current route pushed by the server
+    if (!window.EventSource || routeEvents || !routeData.route_key) {
+        return;
+    }
+    
+    routeEvents = new EventSource(`/route_events?version=${routeData.route_version || 0}`);
+    
+    routeEvents.addEventListener('traffic', function(event) {
+        const update = JSON.parse(event.data);
+        if (update.reload || !currentRouteData) {
+            // Too many missed updates or new geometry - fetch the whole route
+            fetch(routeUrl())
+                .then(response => response.json())
+                .then(data => {
+                    if (data && data.coordinates) {
+                        displayRoute(data, false);
+                    }
+                })
+                .catch(error => console.error('Error fetching route:', error));
+        } else {
+            applyTrafficChanges(currentRouteData, update);
+            currentRouteData.route_version = update.version;
+            if (update.data_version) {
+                // Version of the stored route with this update applied, for later polls
+                currentRouteData.version = update.data_version;
+            }
+            displayRoute(currentRouteData, false);
+        }
+        
+        if (update.needs_update) {
+            showTrafficUpdateNotification(update.reason);
+        }
+    });
+    
+    routeEvents.addEventListener('expired', function() {
+        routeEvents.close();
+        routeEvents = null;
+        startTrafficPolling();
+    });
+    
+    routeEvents.onerror = function() {
+        // The browser reconnects by itself unless the stream was refused
+        if (routeEvents && routeEvents.readyState === EventSource.CLOSED) {
+            routeEvents = null;
+            startTrafficPolling();
+        }
+    };
+}
+
+function applyTrafficChanges(routeData, update) {
+    // Apply the changed segments and new totals of a traffic update
+    const details = routeData.route_details;
+    if (!details || !details.segments) {
+        return;
+    }
+    
+    for (const change of update.changes || []) {
+        const segment = details.segments[change.index];
+        if (segment) {
+            const { index, ...fields } = change;
+            Object.assign(segment, fields);
+        }
+    }
+    
+    if (update.totals) {
+        Object.assign(details, update.totals);
+        routeData.total_time = update.totals.total_duration;
+        routeData.total_duration_seconds = update.totals.total_duration_seconds;
+        routeData.traffic_delay_text = update.totals.traffic_delay_text;
+        routeData.traffic_conditions = update.totals.traffic_conditions;
+    }
+}
+
 function checkTrafficUpdates() {
     // Don't check too frequently
     const now = Date.now();
@@ -91,16 +221,30 @@ function checkTrafficUpdates() {
     
     lastTrafficUpdateTime = now;
     
-    // Make AJAX request to get updated route information
-    fetch('/get_route?check_traffic=true')
+    // Make AJAX request to get updated route information; with a route already
+    // displayed, only the segments changed since its version are sent
+    const since = currentRouteData && currentRouteData.version ? `&since_version=${currentRouteData.version}` : '';
+    fetch(routeUrl('check_traffic=true' + since))
         .then(response => response.json())
         .then(data => {
+            if (data && data.delta) {
+                applyTrafficChanges(currentRouteData, data);
+                currentRouteData.version = data.version;
+                currentRouteData.route_version = data.route_version;
+                currentRouteData.has_traffic_update = data.has_traffic_update;
+                currentRouteData.traffic_update_reason = data.traffic_update_reason;
+                if (data.changes.length > 0) {
+                    displayRoute(currentRouteData, false);
+                }
+            }
             if (data && data.has_traffic_update) {
                 // Show notification about traffic update
                 showTrafficUpdateNotification(data.traffic_update_reason);
                 
                 // Update the displayed route with new traffic information
-                displayRoute(data);
+                if (!data.delta) {
+                    displayRoute(data);
+                }
             }
         })
         .catch(error => console.error('Error checking for traffic updates:', error));
@@ -149,9 +293,11 @@ function playNotificationSound() {
     }
 }
 
-function displayRoute(routeData) {
+function displayRoute(routeData, fitBounds = true) {
     // Clear existing markers and polyline
     clearMap();
+    routeGeometryZoom = map ? map.getZoom() : null;
+    currentRouteData = routeData;
     
     if (!routeData || !routeData.coordinates || routeData.coordinates.length === 0) {
         console.error('No valid route data provided');
@@ -314,23 +460,12 @@ function displayRoute(routeData) {
             // Get route data for this segment
             let segmentPoints = [];
             
-            if (segment.geometry && Array.isArray(segment.geometry)) {
-                console.log(`Segment [${segment.start_idx}-${segment.end_idx}] geometria:`, segment.geometry);
-                
-                // Sprawdzamy, czy mamy pełną geometrię (wszystkie punkty pośrednie)
-                if (segment.geometry.length > 2) {
-                    console.log(`Segment ma ${segment.geometry.length} punktów geometrycznych - rysujemy precyzyjną trasę`, segment.geometry);
-                    // Konwertujemy wszystkie punkty z [lon, lat] na [lat, lon]
-                    segmentPoints = segment.geometry.map(coord => {
-                        console.log("Przetwarzanie punktu geometrii:", coord);
-                        return [coord[1], coord[0]];
-                    });
-                    console.log("Punkty po konwersji:", segmentPoints);
-                } else {
-                    console.log("Segment ma tylko początki i koniec - linia prosta");
-                    // Tylko punkty początkowy i końcowy - linia prosta
-                    segmentPoints = segment.geometry.map(coord => [coord[1], coord[0]]);
-                }
+            if (typeof segment.geometry === 'string') {
+                // Zakodowana polilinia (punkty już w kolejności [lat, lon])
+                segmentPoints = decodePolyline(segment.geometry);
+            } else if (segment.geometry && Array.isArray(segment.geometry)) {
+                // Konwertujemy wszystkie punkty z [lon, lat] na [lat, lon]
+                segmentPoints = segment.geometry.map(coord => [coord[1], coord[0]]);
             } else {
                 console.error("Brak danych geometrycznych dla segmentu");
                 return;
@@ -415,7 +550,7 @@ function displayRoute(routeData) {
     }
     
     // Fit the map bounds to show all markers
-    if (routePolylines.length > 0) {
+    if (fitBounds && routePolylines.length > 0) {
         // Create a feature group with all polylines
         const featureGroup = L.featureGroup(routePolylines);
         map.fitBounds(featureGroup.getBounds(), {
@@ -436,6 +571,9 @@ function displayRoute(routeData) {
     // Pokaż przyciski nawigacyjne
     document.getElementById('start-navigation-btn').classList.remove('d-none');
     document.getElementById('add-all-points-btn').classList.remove('d-none');
+    
+    // Receive traffic updates of this route from the server
+    subscribeRouteEvents(routeData);
 }
 
 // Funkcja aktualizacji lokalizacji użytkownika
@@ -1215,9 +1353,12 @@ function updateRouteSummary(routeData) {
             
             // Add estimated arrival if available
             if (locationDetail.estimated_arrival) {
+                const lateText = locationDetail.late_minutes > 0
+                    ? `<span class="text-danger ms-2"><i class="fas fa-exclamation-triangle me-1"></i>+${locationDetail.late_minutes} min</span>`
+                    : '';
                 estimatedArrival = `
                     <div class="small text-info mt-1">
-                        <i class="fas fa-clock me-1"></i>ETA: ${locationDetail.estimated_arrival}
+                        <i class="fas fa-clock me-1"></i>ETA: ${locationDetail.estimated_arrival}${lateText}
                     </div>
                 `;
             }
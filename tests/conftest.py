@@ -0,0 +1,27 @@
+import os
+import tempfile
+
+import pytest
+
+# The app connects to DATABASE_URL when it is imported: tests that need it run
+# against an SQLite file of their own
+_database = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+_database.close()
+os.environ['DATABASE_URL'] = f"sqlite:///{_database.name}"
+
+
+@pytest.fixture
+def app():
+    """The application, with empty tables, inside an application context"""
+    from app import app
+    from extensions import db
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+def pytest_unconfigure(config):
+    os.unlink(_database.name)
@@ -0,0 +1,52 @@
+import numpy as np
+
+import fleet_planner
+
+
+def _matrix(n, seed=0):
+    points = np.random.default_rng(seed).uniform(0, 10000, size=(n, 2))
+    return np.linalg.norm(points[:, None, :] - points[None, :, :], axis=2)
+
+
+def _assigned(plan):
+    return [stop for route in plan['routes'] for stop in route['stops']]
+
+
+def test_every_stop_assigned_once():
+    matrix = _matrix(13)
+    for round_trip in (True, False):
+        plan = fleet_planner.plan_fleet(matrix, [{}, {}, {}], round_trip=round_trip, time_budget=0.5)
+        assigned = _assigned(plan)
+        assert sorted(assigned) == list(range(1, 13))
+        assert plan['unassigned'] == []
+        for route in plan['routes']:
+            assert route['route'][0] == 0
+            if round_trip:
+                assert route['route'][-1] == 0
+
+
+def test_capacities_respected_including_zero():
+    matrix = _matrix(11, seed=1)
+    couriers = [{'capacity': 0}, {'capacity': 5}, {'capacity': 3}]
+    plan = fleet_planner.plan_fleet(matrix, couriers, time_budget=0.5)
+    counts = [len(route['stops']) for route in plan['routes']]
+    assert counts[0] == 0
+    assert counts[1] <= 5 and counts[2] <= 3
+    assert sum(counts) == 8
+
+
+def test_unassigned_stops_reported():
+    matrix = _matrix(11, seed=2)
+    plan = fleet_planner.plan_fleet(matrix, [{'capacity': 2}, {'capacity': 4}], time_budget=0.5)
+    assigned = _assigned(plan)
+    assert len(plan['unassigned']) == 4
+    assert sorted(assigned + plan['unassigned']) == list(range(1, 11))
+    assert not set(assigned) & set(plan['unassigned'])
+
+
+def test_zero_shift_is_a_limit():
+    matrix = _matrix(6, seed=3)
+    plan = fleet_planner.plan_fleet(matrix, [{'shift_seconds': 0}, {}], time_budget=0.5)
+    # Every stop on the zero-length shift would be an overrun, so they all move to the other courier
+    assert plan['routes'][0]['stops'] == []
+    assert sorted(plan['routes'][1]['stops']) == list(range(1, 6))
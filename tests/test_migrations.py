@@ -0,0 +1,45 @@
+from sqlalchemy import insert
+
+import migrations
+from extensions import db
+from models import GeocodeCacheEntry, Location, MigrationState, Route
+
+
+def _add_locations(locations):
+    route_id = db.session.execute(
+        insert(Route).returning(Route.id),
+        {'name': 'route', 'total_distance': 1.0, 'total_time': '1m'}
+    ).scalar()
+    db.session.execute(insert(Location), [
+        dict({'route_id': route_id, 'position': i, 'number': '', 'longitude': 19.0 + i / 100,
+              'latitude': 50.0 + i / 100}, **location)
+        for i, location in enumerate(locations)
+    ])
+    db.session.commit()
+
+
+def _cached():
+    return {entry.key: entry.address for entry in GeocodeCacheEntry.query.all()}
+
+
+def test_seed_geocode_cache_once_per_location(app):
+    _add_locations([
+        {'city': 'Warszawa', 'street': 'ul. Marszałkowska', 'number': '10'},
+        {'city': 'warszawa', 'street': 'Marszalkowska', 'number': '10'},
+        {'city': 'Kraków', 'street': 'Floriańska'},
+        {'city': 'Kraków', 'street': 'Długa', 'number': '1', 'category': 'current_location'},
+        {'city': 'Kraków', 'street': 'Basztowa', 'longitude': None},
+        {'city': '', 'street': 'Basztowa', 'number': '2'}
+    ])
+
+    assert migrations.seed_geocode_cache(batch_size=2) == 2
+    assert _cached() == {'marszalkowska 10 warszawa': 'ul. Marszałkowska 10, Warszawa',
+                         'florianska krakow': 'Floriańska, Kraków'}
+    assert MigrationState.query.filter_by(name='geocode_seed').one().value == db.session.query(db.func.max(Location.id)).scalar()
+
+    # Later runs only read locations saved since
+    assert migrations.seed_geocode_cache(batch_size=2) == 0
+    _add_locations([{'city': 'Gdańsk', 'street': 'Długa', 'number': '5'},
+                    {'city': 'Kraków', 'street': 'Floriańska'}])
+    assert migrations.seed_geocode_cache(batch_size=2) == 1
+    assert set(_cached()) == {'marszalkowska 10 warszawa', 'florianska krakow', 'dluga 5 gdansk'}
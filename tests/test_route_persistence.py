@@ -0,0 +1,116 @@
+from datetime import time
+
+import pytest
+
+import route_persistence
+from extensions import db
+from models import Courier, CourierRouteAssignment, Location, Route
+
+
+def _route(n, closed=False, **fields):
+    coordinates = [[19.0 + i / 100, 50.0 + i / 100] for i in range(n)]
+    if closed:
+        coordinates.append(list(coordinates[0]))
+    return dict({'name': f"{n} stops", 'coordinates': coordinates,
+                 'addresses': [f"Street {i}" for i in range(len(coordinates))],
+                 'total_distance': 2.5, 'total_time': '15m'}, **fields)
+
+
+@pytest.fixture
+def courier(app):
+    courier = Courier(username='courier', email='courier@example.com')
+    courier.set_password('secret')
+    db.session.add(courier)
+    db.session.commit()
+    return courier
+
+
+@pytest.fixture
+def client(app, courier):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(courier.id)
+        session['_fresh'] = True
+    return client
+
+
+def test_return_to_start_is_not_a_stop():
+    _, locations, _ = route_persistence.prepare_route(_route(4, closed=True))
+    assert [row['position'] for row in locations] == [0, 1, 2, 3]
+
+    _, locations, _ = route_persistence.prepare_route(_route(4))
+    assert len(locations) == 4
+
+    # A single point is a stop even though it is its own first point
+    _, locations, _ = route_persistence.prepare_route({'coordinates': [[19.0, 50.0]]})
+    assert len(locations) == 1
+
+
+def test_time_windows_and_durations():
+    details = [
+        {'time_window_start': '08:30', 'time_window_end': '09:15', 'estimated_duration': '5'},
+        {'time_window_start': '8.30', 'time_window_end': 930, 'estimated_duration': 'soon'},
+        {},
+        'not a dict'
+    ]
+    _, locations, _ = route_persistence.prepare_route(_route(4, location_details=details))
+
+    assert (locations[0]['time_window_start'], locations[0]['time_window_end']) == (time(8, 30), time(9, 15))
+    assert locations[0]['estimated_duration'] == 5
+    for row in locations[1:]:
+        assert row['time_window_start'] is None and row['time_window_end'] is None
+        assert row['estimated_duration'] == route_persistence.DEFAULT_STOP_DURATION
+
+
+@pytest.mark.parametrize('route_data', [
+    {'coordinates': []},
+    {'coordinates': [[19.0]]},
+    {'coordinates': [['east', 50.0]]},
+    {'coordinates': [[190.0, 50.0]]},
+    {'coordinates': [[19.0, 50.0]], 'total_distance': 'far'},
+    ['not', 'an', 'object']
+])
+def test_invalid_routes_are_rejected(route_data):
+    with pytest.raises(route_persistence.RouteValidationError):
+        route_persistence.prepare_route(route_data)
+
+
+def test_saved_ids_follow_the_request_order(app, courier):
+    routes = [_route(n) for n in (3, 1, 4, 2, 5)]
+    route_ids = route_persistence.save_routes(
+        [route_persistence.prepare_route(route_data, courier_id=courier.id) for route_data in routes]
+    )
+    db.session.commit()
+
+    assert len(set(route_ids)) == len(routes)
+    for route_id, route_data in zip(route_ids, routes):
+        route = db.session.get(Route, route_id)
+        assert route.name == route_data['name']
+        assert route.coordinates == route_data['coordinates']
+        assert [location.position for location in route.locations] == list(range(len(route_data['coordinates'])))
+    assert db.session.query(CourierRouteAssignment).count() == len(routes)
+
+
+def test_save_routes_endpoint(client, courier):
+    response = client.post('/save_routes', json={'routes': [_route(3), _route(2, closed=True)]})
+
+    assert response.status_code == 200
+    assert response.json['saved'] == 2
+    assert response.json['locations'] == 5
+    names = [db.session.get(Route, route_id).name for route_id in response.json['route_ids']]
+    assert names == ['3 stops', '2 stops']
+
+
+@pytest.mark.parametrize('bad_route', [
+    {'coordinates': [[190.0, 50.0]]},
+    {'coordinates': [[19.0, 50.0]], 'courier_id': 'someone'},
+    {'coordinates': [[19.0, 50.0]], 'courier_id': 12345}
+])
+def test_one_invalid_route_rejects_the_request(client, bad_route):
+    response = client.post('/save_routes', json={'routes': [_route(3), bad_route, _route(2)]})
+
+    assert response.status_code == 400
+    assert 'error' in response.json
+    assert db.session.query(Route).count() == 0
+    assert db.session.query(Location).count() == 0
+    assert db.session.query(CourierRouteAssignment).count() == 0
@@ -0,0 +1,56 @@
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import insert
+
+import route_queries
+from extensions import db
+from models import Route
+
+
+def _add_routes(created_at):
+    db.session.execute(insert(Route), [
+        {'name': f"route {i}", 'created_at': when, 'total_distance': 1.0, 'total_time': '1m'}
+        for i, when in enumerate(created_at)
+    ])
+    db.session.commit()
+    return db.session.execute(
+        db.select(Route.id, Route.created_at).order_by(Route.created_at.desc(), Route.id.desc())
+    ).all()
+
+
+def _walk(limit, **filters):
+    ids = []
+    cursor = None
+    while True:
+        rows, cursor = route_queries.route_summaries(cursor, limit, **filters)
+        assert len(rows) <= limit
+        ids.extend(row.id for row in rows)
+        if cursor is None:
+            return ids
+
+
+def test_pages_cover_every_route_once_with_ties(app):
+    start = datetime(2024, 5, 1, 8, 30)
+    # Groups of routes saved at the same moment, longer than a page, in mixed order
+    created_at = [start + timedelta(minutes=(i * 7) % 4) for i in range(23)]
+    expected = [row.id for row in _add_routes(created_at)]
+
+    for limit in (1, 3, 5, 23, 50):
+        ids = _walk(limit)
+        assert ids == expected
+        assert len(set(ids)) == len(ids) == route_queries.count_routes()
+
+
+def test_pages_with_date_filter(app):
+    start = datetime(2024, 5, 1, 23, 0)
+    rows = _add_routes([start + timedelta(hours=i) for i in range(5)] * 2)
+    expected = [row.id for row in rows if row.created_at.date() == date(2024, 5, 2)]
+
+    ids = _walk(3, date_from=date(2024, 5, 2), date_to=date(2024, 5, 2))
+    assert ids == expected
+    assert route_queries.count_routes(date_from=date(2024, 5, 2), date_to=date(2024, 5, 2)) == len(expected)
+
+
+def test_cursor_round_trip(app):
+    (row,) = _add_routes([datetime(2024, 5, 1, 8, 30, 15, 250)])
+    assert route_queries.decode_cursor(route_queries.encode_cursor(row)) == (row.created_at, row.id)
@@ -0,0 +1,62 @@
+import route_versions
+
+
+def _segment(geometry, duration=60.0, delay=0.0):
+    return {'geometry': geometry, 'duration': duration, 'traffic_delay': delay,
+            'traffic_level': 0, 'traffic_color': 'green', 'traffic_bucket': 0}
+
+
+def _details(segments):
+    return {'segments': segments, 'total_duration': '3m', 'total_duration_seconds': 180.0,
+            'traffic_delay_text': 'No delays', 'traffic_conditions': []}
+
+
+def _route():
+    route_data = {'route_details': _details([_segment('a'), _segment('b'), _segment('c')])}
+    route_versions.stamp_route_version(route_data)
+    return route_data
+
+
+def test_new_route_starts_at_version_1():
+    route_data = _route()
+    assert route_data['version'] == route_data['base_version'] == 1
+    assert [s['version'] for s in route_data['route_details']['segments']] == [1, 1, 1]
+
+
+def test_unchanged_segments_keep_their_version():
+    route_data = _route()
+    route_versions.update_route_totals(route_data, _details([_segment('a'), _segment('b', 90.0, 30.0), _segment('c')]))
+    route_versions.update_route_totals(route_data, _details([_segment('a', 75.0, 15.0), _segment('b', 90.0, 30.0), _segment('c')]))
+
+    assert route_data['version'] == 3
+    assert route_data['base_version'] == 1
+    assert [s['version'] for s in route_data['route_details']['segments']] == [3, 2, 1]
+
+    delta = route_versions.route_delta(route_data, 2)
+    assert delta['version'] == 3
+    assert [change['index'] for change in delta['changes']] == [0]
+    assert delta['changes'][0]['traffic_delay'] == 15.0
+    assert [change['index'] for change in route_versions.route_delta(route_data, 1)['changes']] == [0, 1]
+    assert route_versions.route_delta(route_data, 3)['changes'] == []
+
+
+def test_new_geometry_starts_a_new_base_version():
+    route_data = _route()
+    route_versions.update_route_totals(route_data, _details([_segment('a'), _segment('b', 90.0, 30.0), _segment('c')]))
+    route_versions.update_route_totals(route_data, _details([_segment('a'), _segment('x')]))
+
+    assert route_data['version'] == route_data['base_version'] == 3
+    assert [s['version'] for s in route_data['route_details']['segments']] == [3, 3]
+
+
+def test_versions_outside_the_base_range_need_the_full_route():
+    route_data = _route()
+    route_versions.update_route_totals(route_data, _details([_segment('a'), _segment('x')]))
+    route_versions.update_route_totals(route_data, _details([_segment('a'), _segment('x', 90.0, 30.0)]))
+    assert (route_data['base_version'], route_data['version']) == (2, 3)
+
+    assert route_versions.route_delta(route_data, 1) is None
+    assert route_versions.route_delta(route_data, 4) is None
+    assert route_versions.route_delta(route_data, 2) is not None
+    assert route_versions.route_delta(route_data, 3) is not None
+    assert route_versions.route_delta({}, 1) is None
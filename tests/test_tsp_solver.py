@@ -0,0 +1,100 @@
+import itertools
+import threading
+
+import numpy as np
+import pytest
+
+import tsp_solver
+
+
+def _solve_with_timeout(matrix, timeout=10, **kwargs):
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(value=tsp_solver.held_karp(matrix, **kwargs)), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "held_karp did not finish"
+    return result['value']
+
+
+def test_held_karp_with_unreachable_stop():
+    # Stop 2 could not be snapped to the road network: its column is all None
+    matrix = [
+        [0, 10, None, 20],
+        [10, 0, None, 15],
+        [30, 25, 0, 12],
+        [20, 15, None, 0],
+    ]
+    for round_trip in (False, True):
+        route, cost = _solve_with_timeout(matrix, round_trip=round_trip)
+        assert route[0] == 0
+        assert sorted(set(route)) == [0, 1, 2, 3]
+        assert cost == np.inf
+
+
+def test_held_karp_finite_matrix():
+    matrix = [
+        [0, 1, 5, 4],
+        [1, 0, 1, 5],
+        [5, 1, 0, 1],
+        [4, 5, 1, 0],
+    ]
+    route, cost = tsp_solver.held_karp(matrix, round_trip=True)
+    assert route in ([0, 1, 2, 3, 0], [0, 3, 2, 1, 0])
+    assert cost == 7
+
+
+def test_solve_time_windows_with_unreachable_stop():
+    inf = np.inf
+    result = tsp_solver.solve_time_windows([[0, 10, inf], [10, 0, inf], [inf, inf, 0]],
+                                           windows=[None, (0, 100), (0, 100)])
+    assert result['route'] == [0, 1, 2]
+    assert result['unreachable'] == [2]
+    assert not result['feasible']
+    assert result['schedule'][1]['service_start'] == 10
+
+
+def _brute_force_schedule(matrix, order, service, windows, start_time):
+    """(feasible, finish, service start per stop) of visiting stops in `order` from 0"""
+    now, current, starts = start_time, 0, {}
+    feasible = True
+    for stop in order:
+        arrival = now + matrix[current][stop]
+        earliest, latest = windows[stop] or (None, None)
+        service_start = max(arrival, earliest) if earliest is not None else arrival
+        if latest is not None and service_start > latest:
+            feasible = False
+        starts[stop] = service_start
+        now, current = service_start + service[stop], stop
+    return feasible, now, starts
+
+
+@pytest.mark.parametrize('seed', [2, 7, 10, 14])
+def test_solve_time_windows_matches_brute_force(seed):
+    # Seeds 2, 10 and 14 have an order meeting every window, seed 7 does not
+    rng = np.random.default_rng(seed)
+    n = 7
+    points = rng.uniform(0, 600, size=(n, 2))
+    matrix = np.linalg.norm(points[:, None, :] - points[None, :, :], axis=2).round()
+    service = [0] + list(rng.integers(60, 180, size=n - 1))
+    windows = [None]
+    for _ in range(n - 1):
+        opens = int(rng.integers(0, 1500))
+        windows.append((opens, opens + int(rng.integers(300, 1500))))
+    start_time = 100
+
+    best = None
+    for order in itertools.permutations(range(1, n)):
+        feasible, finish, _ = _brute_force_schedule(matrix, order, service, windows, start_time)
+        if feasible and (best is None or finish < best):
+            best = finish
+
+    result = tsp_solver.solve_time_windows(matrix, service, windows, start_time)
+    assert result['route'][0] == 0 and sorted(result['route'][1:]) == list(range(1, n))
+    feasible, finish, starts = _brute_force_schedule(matrix, result['route'][1:], service, windows, start_time)
+    assert result['feasible'] == (best is not None) == feasible
+    if best is not None:
+        assert result['finish_time'] == pytest.approx(best)
+    # ETAs in the schedule match the brute-force simulation of the same order
+    for stop in result['schedule'][1:]:
+        assert stop['service_start'] == pytest.approx(starts[stop['index']])
+        assert stop['late'] == 0 or not feasible
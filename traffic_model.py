@@ -0,0 +1,153 @@
+"""
+Deterministic, table-driven traffic model.
+
+Traffic on a leg is a delay factor (extra travel time / free-flow travel time)
+looked up by hour of the week and road class. Road classes are told apart by
+the leg's free-flow average speed. Between full hours the factor is
+interpolated linearly and evaluated at the start of a config.TRAFFIC_BUCKET_MINUTES
+time bucket, so results only change when the bucket changes and can be cached
+per bucket. Observed travel times can calibrate the table with
+exponential smoothing.
+"""
+import threading
+from datetime import datetime
+
+import numpy as np
+
+import config
+
+ROAD_CLASSES = ('local', 'arterial', 'highway')
+
+# Lower bound of free-flow average speed (km/h) of each road class
+ROAD_CLASS_MIN_SPEED_KMH = (0, 35, 70)
+
+# Delay factor by hour of day for a typical urban arterial
+WEEKDAY_PROFILE = (0.02, 0.01, 0.01, 0.01, 0.02, 0.05, 0.15, 0.45, 0.60, 0.35, 0.20, 0.20,
+                   0.25, 0.22, 0.22, 0.30, 0.50, 0.65, 0.50, 0.30, 0.15, 0.10, 0.06, 0.03)
+SATURDAY_PROFILE = (0.03, 0.02, 0.01, 0.01, 0.01, 0.02, 0.04, 0.08, 0.12, 0.18, 0.25, 0.30,
+                    0.30, 0.28, 0.25, 0.22, 0.22, 0.20, 0.18, 0.15, 0.12, 0.10, 0.08, 0.05)
+SUNDAY_PROFILE = (0.04, 0.03, 0.02, 0.01, 0.01, 0.01, 0.02, 0.04, 0.06, 0.08, 0.12, 0.15,
+                  0.15, 0.14, 0.12, 0.12, 0.15, 0.18, 0.15, 0.10, 0.08, 0.06, 0.04, 0.03)
+
+# How strongly each road class follows the profile
+ROAD_CLASS_SENSITIVITY = (0.7, 1.0, 0.8)
+
+# Traffic level (0-3) thresholds on the delay factor, and the matching map colours
+LEVEL_THRESHOLDS = (0.10, 0.25, 0.45)
+LEVEL_COLORS = ('green', 'yellow', 'orange', 'red')
+
+HOURS_PER_WEEK = 7 * 24
+
+_lock = threading.Lock()
+# Multiplicative calibration per (road class, hour of week)
+_calibration = np.ones((len(ROAD_CLASSES), HOURS_PER_WEEK))
+_calibration_version = 0
+_bucket_cache = {}
+
+
+def _base_table():
+    """Uncalibrated delay factors, road classes x hours of week (Monday 0:00 first)"""
+    week = np.array([WEEKDAY_PROFILE] * 5 + [SATURDAY_PROFILE, SUNDAY_PROFILE]).ravel()
+    return np.array(ROAD_CLASS_SENSITIVITY)[:, None] * week[None, :]
+
+
+def time_bucket(when=None):
+    """Index of the time bucket within the week (0 = Monday 0:00)"""
+    when = when or datetime.now()
+    minute_of_week = (when.weekday() * 24 + when.hour) * 60 + when.minute
+    return minute_of_week // config.TRAFFIC_BUCKET_MINUTES
+
+
+def bucket_factors(bucket):
+    """
+    Delay factor of every road class in a time bucket (cached per bucket
+    and calibration version)
+
+    Returns:
+        NumPy array with one factor per road class
+    """
+    with _lock:
+        key = (bucket, _calibration_version)
+        factors = _bucket_cache.get(key)
+        if factors is None:
+            table = _base_table() * _calibration
+            hour = bucket * config.TRAFFIC_BUCKET_MINUTES / 60.0
+            first = int(hour) % HOURS_PER_WEEK
+            weight = hour - int(hour)
+            factors = table[:, first] * (1 - weight) + table[:, (first + 1) % HOURS_PER_WEEK] * weight
+            factors.setflags(write=False)
+            if len(_bucket_cache) > 4 * HOURS_PER_WEEK:
+                _bucket_cache.clear()
+            _bucket_cache[key] = factors
+    return factors
+
+
+def road_class(distances, base_durations):
+    """Road class index of every leg from its free-flow average speed"""
+    distances = np.asarray(distances, dtype=float)
+    base_durations = np.asarray(base_durations, dtype=float)
+    speeds = np.divide(distances * 3600, base_durations, out=np.zeros_like(distances), where=base_durations > 0)
+    return np.searchsorted(ROAD_CLASS_MIN_SPEED_KMH, speeds, side='right') - 1
+
+
+def evaluate(distances, base_durations, when=None, bucket=None):
+    """
+    Traffic on a set of legs at one moment
+
+    Args:
+        distances: Leg distances in km
+        base_durations: Free-flow leg durations in seconds
+        when: Moment to evaluate (default: now)
+        bucket: Time bucket to evaluate instead of `when`
+
+    Returns:
+        Dictionary of NumPy arrays with one value per leg: 'factor', 'delay'
+        (seconds), 'level' (0-3) and 'road_class', plus the 'bucket' used
+    """
+    if bucket is None:
+        bucket = time_bucket(when)
+    base_durations = np.asarray(base_durations, dtype=float)
+    classes = road_class(distances, base_durations)
+    factors = bucket_factors(bucket)[classes]
+    return {
+        'bucket': bucket,
+        'factor': factors,
+        'delay': base_durations * factors,
+        'level': np.searchsorted(LEVEL_THRESHOLDS, factors, side='right'),
+        'road_class': classes
+    }
+
+
+def level_color(level):
+    return LEVEL_COLORS[int(level)]
+
+
+def calibrate(distances, base_durations, observed_durations, when=None, weight=None):
+    """
+    Adjust the model towards observed travel times of legs driven at one moment
+
+    Args:
+        distances: Leg distances in km
+        base_durations: Free-flow leg durations in seconds
+        observed_durations: Actual leg durations in seconds
+        when: When the legs were driven (default: now)
+        weight: Smoothing weight of the new observations (default: config.TRAFFIC_CALIBRATION_WEIGHT)
+    """
+    global _calibration_version
+    if weight is None:
+        weight = config.TRAFFIC_CALIBRATION_WEIGHT
+    when = when or datetime.now()
+    hour = when.weekday() * 24 + when.hour
+    base_durations = np.asarray(base_durations, dtype=float)
+    observed = np.asarray(observed_durations, dtype=float) / np.where(base_durations > 0, base_durations, np.nan) - 1
+    classes = road_class(distances, base_durations)
+    expected = _base_table()[:, hour]
+
+    with _lock:
+        for cls in range(len(ROAD_CLASSES)):
+            samples = observed[(classes == cls) & np.isfinite(observed)]
+            if samples.size == 0 or expected[cls] <= 0:
+                continue
+            ratio = np.clip(max(samples.mean(), 0.0) / expected[cls], 0.2, 5.0)
+            _calibration[cls, hour] = (1 - weight) * _calibration[cls, hour] + weight * ratio
+        _calibration_version += 1
@@ -0,0 +1,179 @@
+"""
+Background traffic refresh of the routes users are currently looking at.
+
+Optimized and loaded routes are registered here under a random route key kept
+in the user's session. One daemon thread refreshes the traffic of every active
+route once per config.TRAFFIC_REFRESH_INTERVAL, however many tabs show it, and
+wakes up the Server-Sent Events streams waiting for that route. Routes nobody
+has asked about for config.ACTIVE_ROUTE_TTL are dropped.
+
+The registry lives in process memory, so the app is meant to run as a single
+(multi-threaded) worker process; a route missing from the registry is simply
+registered again by the next /get_route request.
+"""
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import config
+from route_optimizer import apply_traffic_update, check_for_traffic_updates, fill_weather
+
+_routes = {}
+_condition = threading.Condition()
+_thread = None
+
+
+def _ensure_started():
+    global _thread
+    if _thread is None or not _thread.is_alive():
+        _thread = threading.Thread(target=_run, name='traffic-refresher', daemon=True)
+        _thread.start()
+
+
+def register(coordinates, route_details):
+    """
+    Start tracking a route
+
+    Returns:
+        Route key to keep in the session
+    """
+    key = uuid.uuid4().hex
+    with _condition:
+        _routes[key] = {
+            'coordinates': coordinates,
+            'route_details': route_details,
+            'version': 0,
+            'last_event': None,
+            'last_seen': time.monotonic(),
+            'viewers': 0
+        }
+        # Forget the least recently seen routes above the limit
+        while len(_routes) > config.TRAFFIC_MAX_ACTIVE_ROUTES:
+            oldest = min(_routes, key=lambda k: _routes[k]['last_seen'])
+            del _routes[oldest]
+        _ensure_started()
+    return key
+
+
+def get(key):
+    """
+    Current state of a tracked route, marking it as active
+
+    Returns:
+        Dictionary with 'route_details', 'version' and 'last_event', or None if not tracked
+    """
+    with _condition:
+        entry = _routes.get(key)
+        if entry is None:
+            return None
+        entry['last_seen'] = time.monotonic()
+        return {field: entry[field] for field in ('route_details', 'version', 'last_event')}
+
+
+@contextmanager
+def viewer(key):
+    """Mark a route as watched (by an open event stream) while in the block"""
+    with _condition:
+        if key in _routes:
+            _routes[key]['viewers'] += 1
+    try:
+        yield
+    finally:
+        with _condition:
+            if key in _routes:
+                _routes[key]['viewers'] -= 1
+                _routes[key]['last_seen'] = time.monotonic()
+
+
+def wait_for_update(key, version, timeout):
+    """
+    Wait until a route has a version newer than `version`
+
+    Returns:
+        The route's last event if it is the next version, an event with 'reload'
+        set if the client missed more than one refresh, {'expired': True} if the
+        route is no longer tracked, or None on timeout
+    """
+    deadline = time.monotonic() + timeout
+    with _condition:
+        while True:
+            entry = _routes.get(key)
+            if entry is None:
+                return {'expired': True}
+            if entry['version'] > version:
+                if entry['version'] == version + 1 and entry['last_event']:
+                    return entry['last_event']
+                return {'version': entry['version'], 'reload': True}
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            _condition.wait(remaining)
+
+
+def refresh_route(key):
+    """
+    Refresh the traffic of one tracked route (and its weather, if still pending)
+    and notify its event streams
+
+    Returns:
+        The event published, or None if nothing changed
+    """
+    with _condition:
+        entry = _routes.get(key)
+        if entry is None:
+            return None
+        route_data = {'coordinates': entry['coordinates'], 'route_details': entry['route_details']}
+
+    update = check_for_traffic_updates(route_data)
+    route_details = route_data['route_details']
+    if update.get('changes') or update.get('new_route'):
+        route_details = apply_traffic_update(route_details, update)
+    # Routes loaded from a saved snapshot get their weather here, after loading
+    weather_filled = bool(route_details.get('weather_pending'))
+    if weather_filled:
+        route_details = fill_weather(route_details, route_data['coordinates'])
+    if route_details is route_data['route_details']:
+        return None
+
+    with _condition:
+        entry = _routes.get(key)
+        if entry is None:
+            return None
+        entry['route_details'] = route_details
+        entry['version'] += 1
+        event = {
+            'version': entry['version'],
+            'needs_update': update.get('needs_update', False),
+            'reason': update.get('reason', ''),
+            # A rebuilt route has new geometry (and new weather): clients fetch it again
+            'reload': bool(update.get('new_route')) or weather_filled,
+            'changes': update.get('changes') or [],
+            'totals': update.get('totals')
+        }
+        entry['last_event'] = event
+        _condition.notify_all()
+    return event
+
+
+def refresh_all():
+    """Refresh every active route once and drop the inactive ones"""
+    now = time.monotonic()
+    with _condition:
+        for key in [k for k, entry in _routes.items()
+                    if not entry['viewers'] and now - entry['last_seen'] > config.ACTIVE_ROUTE_TTL]:
+            del _routes[key]
+        keys = list(_routes)
+
+    for key in keys:
+        try:
+            refresh_route(key)
+        except Exception as e:
+            logging.error(f"Error refreshing traffic of route {key}: {str(e)}")
+
+
+def _run():
+    while True:
+        time.sleep(config.TRAFFIC_REFRESH_INTERVAL)
+        refresh_all()
@@ -0,0 +1,489 @@
+"""
+Route ordering algorithms working purely on a duration matrix.
+
+All functions take the matrix returned by get_distance_matrix (a list of lists,
+possibly containing None for unreachable pairs) or a NumPy array, and return
+routes as lists of point indices starting with the start point.
+"""
+import time
+
+import numpy as np
+
+import config
+
+
+def to_matrix(values):
+    """Convert a matrix from the API (list of lists, None = unreachable) to a float array"""
+    matrix = np.array(values, dtype=float)
+    matrix[np.isnan(matrix)] = np.inf
+    return matrix
+
+
+def route_cost(matrix, route):
+    """Sum the matrix entries along consecutive route indices"""
+    if len(route) < 2:
+        return 0.0
+    route = np.asarray(route)
+    return float(np.asarray(matrix)[route[:-1], route[1:]].sum())
+
+
+def nearest_neighbour(matrix, start=0, round_trip=False):
+    """
+    Greedy nearest neighbour tour
+
+    Args:
+        matrix: N x N duration matrix
+        start: Index of the starting point
+        round_trip: Whether the courier returns to the start
+
+    Returns:
+        List of point indices
+    """
+    matrix = to_matrix(matrix)
+    n = len(matrix)
+    visited = np.zeros(n, dtype=bool)
+    visited[start] = True
+    route = [start]
+    current = start
+
+    for _ in range(n - 1):
+        row = np.where(visited, np.inf, matrix[current])
+        nearest = int(np.argmin(row))
+        visited[nearest] = True
+        route.append(nearest)
+        current = nearest
+
+    if round_trip and n > 1:
+        route.append(start)
+    return route
+
+
+def penalize_unreachable(matrix):
+    """Copy of a matrix with unreachable (infinite) pairs replaced by a cost larger than any route"""
+    finite = matrix[np.isfinite(matrix)]
+    penalty = (finite.max() if finite.size else 1.0) * len(matrix) * 10 + 1
+    return np.where(np.isfinite(matrix), matrix, penalty)
+
+
+def held_karp(matrix, start=0, round_trip=False):
+    """
+    Exact Held-Karp dynamic programming solver
+
+    The DP table holds, for every subset of stops and every last stop, the cheapest
+    path from the start covering that subset. Subsets are processed layer by layer
+    (by number of stops) and each layer is evaluated at once with NumPy.
+    Memory and time grow as 2^n * n^2, so keep n at about 16 or below.
+
+    Args:
+        matrix: N x N duration matrix
+        start: Index of the starting point
+        round_trip: Whether the courier returns to the start
+
+    Returns:
+        Tuple (route indices, total cost); the cost is infinite if every route
+        uses an unreachable pair, in which case the route uses as few as possible
+    """
+    original = to_matrix(matrix)
+    n = len(original)
+    if n <= 1:
+        return [start] * (2 if round_trip and n == 1 else n), 0.0
+    # Search on finite costs: with infinite ones no path may be found and the
+    # parent walk below would never reach the start
+    matrix = penalize_unreachable(original)
+
+    # Stops other than the start are mapped to bits 0..m-1
+    others = np.array([i for i in range(n) if i != start])
+    m = len(others)
+    stop_costs = matrix[np.ix_(others, others)]
+    from_start = matrix[start, others]
+    to_start = matrix[others, start]
+
+    full = (1 << m) - 1
+    bits = 1 << np.arange(m)
+    masks = np.arange(1 << m)
+    popcount = np.zeros(1 << m, dtype=np.int8)
+    for bit in bits:
+        popcount += (masks & bit) > 0
+
+    cost = np.full((1 << m, m), np.inf)
+    parent = np.full((1 << m, m), -1, dtype=np.int8)
+    cost[bits, np.arange(m)] = from_start
+
+    # candidate[s, j, i] = cost[subset without j, ending at i] + cost i -> j.
+    # Entries where j is not in the subset (or i == j) read states that are
+    # still infinite, so they never win the minimum.
+    arrival = stop_costs.T[None, :, :]
+    for size in range(2, m + 1):
+        layer = masks[popcount == size]
+        previous = layer[:, None] ^ bits[None, :]
+        candidate = cost[previous] + arrival
+        best = candidate.argmin(axis=2)
+        cost[layer] = np.take_along_axis(candidate, best[:, :, None], axis=2)[:, :, 0]
+        parent[layer] = best
+
+    final = cost[full] + to_start if round_trip else cost[full]
+    last = int(np.argmin(final))
+
+    order = []
+    mask = full
+    while last >= 0:
+        order.append(int(others[last]))
+        previous_last = int(parent[mask, last])
+        mask ^= 1 << last
+        last = previous_last
+    order.reverse()
+
+    route = [start] + order
+    if round_trip:
+        route.append(start)
+    return route, route_cost(original, route)
+
+
+def _two_opt_deltas(matrix, tour, forward, backward):
+    """Cost change of reversing tour[i..j] for every pair of inner positions i < j"""
+    inner = np.arange(1, len(tour) - 1)
+    before, first = tour[inner - 1], tour[inner]
+    last, after = tour[inner], tour[inner + 1]
+
+    delta = (matrix[before[:, None], last[None, :]]
+             + matrix[first[:, None], after[None, :]]
+             - matrix[before, first][:, None]
+             - matrix[last, after][None, :])
+    # The matrix may be asymmetric, so the reversed part changes cost too
+    delta += (backward[inner][None, :] - backward[inner][:, None]) - (forward[inner][None, :] - forward[inner][:, None])
+    delta[np.tril_indices(len(inner))] = np.inf
+    return inner, delta
+
+
+def _or_opt_deltas(matrix, tour, forward, backward, length):
+    """
+    Cost change of moving every chain of `length` inner stops between every pair of
+    consecutive stops elsewhere, in original and reversed orientation.
+    Returns (chain starts, positions, deltas with shape (2, starts, positions)).
+    """
+    size = len(tour)
+    starts = np.arange(1, size - length)
+    if len(starts) == 0:
+        return starts, None, None
+    ends = starts + length - 1
+    before, first, last, after = tour[starts - 1], tour[starts], tour[ends], tour[ends + 1]
+    removal_gain = matrix[before, first] + matrix[last, after] - matrix[before, after]
+
+    positions = np.arange(size - 1)
+    left, right = tour[positions], tour[positions + 1]
+    edge = matrix[left, right]
+
+    kept = (matrix[left[None, :], first[:, None]] + matrix[last[:, None], right[None, :]]
+            - edge[None, :] - removal_gain[:, None])
+    chain_change = (backward[ends] - backward[starts]) - (forward[ends] - forward[starts])
+    reversed_ = (matrix[left[None, :], last[:, None]] + matrix[first[:, None], right[None, :]]
+                 - edge[None, :] - removal_gain[:, None] + chain_change[:, None])
+
+    # Edges touching the chain itself are not valid insertion points
+    blocked = (positions[None, :] >= starts[:, None] - 1) & (positions[None, :] <= ends[:, None])
+    deltas = np.stack([kept, reversed_])
+    deltas[:, blocked] = np.inf
+    return starts, positions, deltas
+
+
+def improve_route(matrix, route, round_trip=False, time_budget=None):
+    """
+    Improve a route with 2-opt and Or-opt local search
+
+    Every iteration evaluates all 2-opt reversals and all Or-opt moves of chains
+    of 1-3 stops at once with NumPy and applies the best improving one, until no
+    improving move is left or the time budget runs out. The start (and the end of
+    a round trip) stays in place.
+
+    Args:
+        matrix: N x N duration matrix
+        route: Initial route indices, e.g. from nearest_neighbour
+        round_trip: Whether the route returns to the start (route[-1] == route[0])
+        time_budget: Maximum time in seconds (default: config.LOCAL_SEARCH_TIME_BUDGET)
+
+    Returns:
+        Dictionary with the improved route, its cost and the improvement over the initial one
+    """
+    if time_budget is None:
+        time_budget = config.LOCAL_SEARCH_TIME_BUDGET
+    deadline = time.monotonic() + time_budget
+
+    original = to_matrix(matrix)
+    n = len(original)
+    initial_cost = route_cost(original, route)
+
+    # Unreachable pairs get a large finite cost so that deltas stay comparable
+    search = penalize_unreachable(original)
+
+    if round_trip:
+        tour = np.array(route)
+    else:
+        # An open path gets a free dummy end point so both modes share the same moves
+        padded = np.zeros((n + 1, n + 1))
+        padded[:n, :n] = search
+        search = padded
+        tour = np.array(list(route) + [n])
+
+    iterations = 0
+    timed_out = False
+    while len(tour) > 3:
+        if time.monotonic() > deadline:
+            timed_out = True
+            break
+
+        steps = search[tour[:-1], tour[1:]]
+        forward = np.concatenate(([0.0], np.cumsum(steps)))
+        backward = np.concatenate(([0.0], np.cumsum(search[tour[1:], tour[:-1]])))
+
+        best_delta = -1e-9
+        best_move = None
+
+        inner, delta = _two_opt_deltas(search, tour, forward, backward)
+        flat = int(np.argmin(delta))
+        if delta.flat[flat] < best_delta:
+            i, j = np.unravel_index(flat, delta.shape)
+            best_delta = delta.flat[flat]
+            best_move = ('2-opt', inner[i], inner[j])
+
+        for length in (1, 2, 3):
+            starts, positions, deltas = _or_opt_deltas(search, tour, forward, backward, length)
+            if deltas is None:
+                continue
+            flat = int(np.argmin(deltas))
+            if deltas.flat[flat] < best_delta:
+                orientation, i, q = np.unravel_index(flat, deltas.shape)
+                best_delta = deltas.flat[flat]
+                best_move = ('or-opt', starts[i], length, positions[q], bool(orientation))
+
+        if best_move is None:
+            break
+
+        if best_move[0] == '2-opt':
+            _, i, j = best_move
+            tour[i:j + 1] = tour[i:j + 1][::-1].copy()
+        else:
+            _, i, length, q, reverse = best_move
+            chain = tour[i:i + length][::-1] if reverse else tour[i:i + length]
+            if q < i:
+                tour = np.concatenate((tour[:q + 1], chain, tour[q + 1:i], tour[i + length:]))
+            else:
+                tour = np.concatenate((tour[:i], tour[i + length:q + 1], chain, tour[q + 1:]))
+        iterations += 1
+
+    improved = [int(i) for i in tour if i != n]
+    cost = route_cost(original, improved)
+    improvement = initial_cost - cost
+    return {
+        'route': improved,
+        'initial_cost': initial_cost,
+        'cost': cost,
+        'improvement': improvement,
+        'improvement_percent': improvement / initial_cost * 100 if initial_cost else 0.0,
+        'iterations': iterations,
+        'timed_out': timed_out
+    }
+
+
+def _window_arrays(n, service_times, windows):
+    """Service times and (earliest, latest) bounds as arrays, missing bounds are open"""
+    service = np.zeros(n) if service_times is None else np.array(service_times, dtype=float)
+    earliest = np.full(n, -np.inf)
+    latest = np.full(n, np.inf)
+    for i, window in enumerate(windows or []):
+        if not window:
+            continue
+        if window[0] is not None:
+            earliest[i] = window[0]
+        if window[1] is not None:
+            latest[i] = window[1]
+    return service, earliest, latest
+
+
+def schedule_route(matrix, route, service_times=None, windows=None, start_time=0):
+    """
+    Compute arrival, waiting and service times along a route
+
+    The courier leaves the first point at start_time, waits at a stop if arriving
+    before its window opens, and is late if service starts after the window closes.
+
+    Args:
+        matrix: N x N duration matrix (seconds)
+        route: Route indices
+        service_times: Service duration per point in seconds
+        windows: (earliest, latest) per point in seconds on the same clock as start_time,
+            None for no window
+        start_time: Departure time from the first point
+
+    Returns:
+        List of dictionaries, one per route position; positions after an unreachable
+        leg have infinite times and no wait or lateness
+    """
+    matrix = to_matrix(matrix)
+    service, earliest, latest = _window_arrays(len(matrix), service_times, windows)
+
+    stops = []
+    departure = start_time
+    for position, index in enumerate(route):
+        # The start and the return to it are not deliveries: no window, no service
+        is_stop = 0 < position and not (position == len(route) - 1 and index == route[0])
+        if position == 0:
+            arrival = service_start = departure = start_time
+        else:
+            arrival = departure + matrix[route[position - 1], index]
+            service_start = max(arrival, earliest[index]) if is_stop else arrival
+            departure = service_start + service[index] if is_stop else arrival
+        # After an unreachable leg all times are infinite; wait and lateness are not known
+        reached = np.isfinite(arrival)
+        stops.append({
+            'index': int(index),
+            'arrival': float(arrival),
+            'wait': float(service_start - arrival) if reached else 0.0,
+            'service_start': float(service_start),
+            'departure': float(departure),
+            'late': float(max(0.0, service_start - latest[index])) if is_stop and reached else 0.0
+        })
+    return stops
+
+
+def held_karp_time_windows(matrix, service_times=None, windows=None, start_time=0, start=0, round_trip=False):
+    """
+    Exact Held-Karp solver with time windows
+
+    Like held_karp, but the DP table stores the earliest departure time from the
+    last stop of each partial route. Arriving before a window opens means waiting;
+    partial routes that reach a stop after its window closes are dropped at once,
+    so infeasible orders never grow further. Because an earlier departure is never
+    worse, the result minimizes the completion time of the route.
+
+    Unreachable pairs are searched with a large finite cost, as in held_karp.
+
+    Returns:
+        Tuple (route indices, completion time), or (None, inf) if no order meets all
+        windows; the completion time is infinite if the route uses an unreachable pair
+    """
+    original = to_matrix(matrix)
+    n = len(original)
+    if n <= 1:
+        return [start] * (2 if round_trip and n == 1 else n), float(start_time)
+    matrix = penalize_unreachable(original)
+
+    service, earliest, latest = _window_arrays(n, service_times, windows)
+    others = np.array([i for i in range(n) if i != start])
+    m = len(others)
+    stop_costs = matrix[np.ix_(others, others)]
+    service, earliest, latest = service[others], earliest[others], latest[others]
+
+    def depart(arrival):
+        service_start = np.maximum(arrival, earliest)
+        return np.where(service_start <= latest, service_start + service, np.inf)
+
+    full = (1 << m) - 1
+    bits = 1 << np.arange(m)
+    masks = np.arange(1 << m)
+    popcount = np.zeros(1 << m, dtype=np.int8)
+    for bit in bits:
+        popcount += (masks & bit) > 0
+
+    departure = np.full((1 << m, m), np.inf)
+    parent = np.full((1 << m, m), -1, dtype=np.int8)
+    departure[bits, np.arange(m)] = depart(start_time + matrix[start, others])
+
+    arrival_cost = stop_costs.T[None, :, :]
+    for size in range(2, m + 1):
+        layer = masks[popcount == size]
+        candidate = departure[layer[:, None] ^ bits[None, :]] + arrival_cost
+        best = candidate.argmin(axis=2)
+        arrival = np.take_along_axis(candidate, best[:, :, None], axis=2)[:, :, 0]
+        departure[layer] = depart(arrival)
+        parent[layer] = best
+
+    final = departure[full] + matrix[others, start] if round_trip else departure[full]
+    last = int(np.argmin(final))
+    finish = float(final[last])
+    if not np.isfinite(finish):
+        return None, np.inf
+
+    order = []
+    mask = full
+    while last >= 0:
+        order.append(int(others[last]))
+        previous_last = int(parent[mask, last])
+        mask ^= 1 << last
+        last = previous_last
+    order.reverse()
+
+    route = [start] + order
+    if round_trip:
+        route.append(start)
+    if not np.isfinite(route_cost(original, route)):
+        finish = np.inf
+    return route, finish
+
+
+def nearest_feasible_neighbour(matrix, service_times=None, windows=None, start_time=0, start=0, round_trip=False):
+    """
+    Greedy construction for time windows: always go to the stop where service can
+    start soonest without missing its window; if none is reachable in time, take
+    the stop whose window closes first.
+    """
+    matrix = to_matrix(matrix)
+    n = len(matrix)
+    service, earliest, latest = _window_arrays(n, service_times, windows)
+    visited = np.zeros(n, dtype=bool)
+    visited[start] = True
+    route = [start]
+    current, now = start, start_time
+
+    for _ in range(n - 1):
+        service_start = np.maximum(now + matrix[current], earliest)
+        feasible = ~visited & (service_start <= latest)
+        if feasible.any():
+            nearest = int(np.argmin(np.where(feasible, service_start, np.inf)))
+        else:
+            nearest = int(np.argmin(np.where(visited, np.inf, latest)))
+        visited[nearest] = True
+        route.append(nearest)
+        now = service_start[nearest] + service[nearest]
+        current = nearest
+
+    if round_trip and n > 1:
+        route.append(start)
+    return route
+
+
+def solve_time_windows(matrix, service_times=None, windows=None, start_time=0, round_trip=False):
+    """
+    Order stops respecting delivery time windows and service durations
+
+    Routes up to config.EXACT_SOLVER_MAX_LOCATIONS points are solved exactly. When
+    no order meets every window, the windows' closing times are relaxed and the
+    fastest order is returned together with the violations. Larger routes, and
+    any the exact solver cannot order, use nearest_feasible_neighbour.
+
+    Returns:
+        Dictionary with the route, per-stop schedule, violations, completion time
+        and the stops that cannot be reached (their times in the schedule are infinite)
+    """
+    n = len(matrix)
+    route = None
+    if n <= config.EXACT_SOLVER_MAX_LOCATIONS:
+        route, finish = held_karp_time_windows(matrix, service_times, windows, start_time, round_trip=round_trip)
+        if route is None:
+            relaxed = [(window[0], None) if window else None for window in (windows or [])]
+            route, finish = held_karp_time_windows(matrix, service_times, relaxed, start_time, round_trip=round_trip)
+    if route is None:
+        route = nearest_feasible_neighbour(matrix, service_times, windows, start_time, round_trip=round_trip)
+
+    stops = schedule_route(matrix, route, service_times, windows, start_time)
+    violations = [{'index': stop['index'], 'late': stop['late']} for stop in stops if stop['late'] > 0]
+    unreachable = [stop['index'] for stop in stops if not np.isfinite(stop['arrival'])]
+    finish = stops[-1]['departure'] if stops else start_time
+    return {
+        'route': route,
+        'schedule': stops,
+        'violations': violations,
+        'unreachable': unreachable,
+        'feasible': not violations and not unreachable,
+        'finish_time': finish,
+        'duration': finish - start_time
+    }
@@ -0,0 +1,110 @@
+"""
+Weather lookups bucketed into geohash tiles.
+
+Stops in one tile (about 5 x 5 km at the default precision) share one upstream
+call made for the tile centre. Results are cached for the provider's update
+interval, and concurrent lookups of the same tile wait for a single call.
+"""
+import logging
+import threading
+from concurrent.futures import Future
+
+import config
+from caching import TTLCache
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_MISSING = object()
+
+_cache = TTLCache(maxsize=config.WEATHER_CACHE_SIZE, ttl=config.WEATHER_CACHE_TTL)
+_in_flight = {}
+_lock = threading.Lock()
+_stats = {'upstream_calls': 0, 'coalesced': 0}
+
+
+def geohash(coords, precision=None):
+    """Geohash of a [longitude, latitude] point"""
+    if precision is None:
+        precision = config.WEATHER_GEOHASH_PRECISION
+    ranges = [[-180.0, 180.0], [-90.0, 90.0]]
+    chars = []
+    bit = value = 0
+    axis = 0  # longitude first
+    while len(chars) < precision:
+        low, high = ranges[axis]
+        middle = (low + high) / 2
+        value <<= 1
+        if coords[axis] >= middle:
+            value |= 1
+            ranges[axis][0] = middle
+        else:
+            ranges[axis][1] = middle
+        axis = 1 - axis
+        bit += 1
+        if bit == 5:
+            chars.append(_BASE32[value])
+            bit = value = 0
+    return ''.join(chars)
+
+
+def tile_centre(tile):
+    """[longitude, latitude] centre of a geohash tile"""
+    ranges = [[-180.0, 180.0], [-90.0, 90.0]]
+    axis = 0
+    for char in tile:
+        value = _BASE32.index(char)
+        for shift in range(4, -1, -1):
+            middle = sum(ranges[axis]) / 2
+            ranges[axis][0 if value >> shift & 1 else 1] = middle
+            axis = 1 - axis
+    return [sum(ranges[0]) / 2, sum(ranges[1]) / 2]
+
+
+def get(coords, fetch):
+    """
+    Weather for a point, shared by its whole geohash tile
+
+    Args:
+        coords: [longitude, latitude] pair
+        fetch: Function (coords) returning weather data for a point, or None on failure
+
+    Returns:
+        Weather data dictionary, or None if the upstream call failed
+    """
+    tile = geohash(coords)
+    result = _cache.get(tile, _MISSING)
+    if result is not _MISSING:
+        return result
+
+    with _lock:
+        future = _in_flight.get(tile)
+        leader = future is None
+        if leader:
+            future = Future()
+            _in_flight[tile] = future
+        else:
+            _stats['coalesced'] += 1
+    if not leader:
+        return future.result()
+
+    result = None
+    try:
+        with _lock:
+            _stats['upstream_calls'] += 1
+        result = fetch(tile_centre(tile))
+        # Failures are remembered briefly so a broken provider is not hammered
+        _cache.set(tile, result, ttl=config.WEATHER_CACHE_TTL if result else config.WEATHER_FAILURE_TTL)
+    except Exception as e:
+        logging.error(f"Error fetching weather for tile {tile}: {str(e)}")
+    finally:
+        with _lock:
+            del _in_flight[tile]
+        future.set_result(result)
+    return result
+
+
+def stats():
+    """Upstream call and coalescing counters of the weather cache"""
+    with _lock:
+        counters = dict(_stats)
+    counters['memory'] = _cache.stats()
+    return counters